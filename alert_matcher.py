@@ -0,0 +1,58 @@
+from bisect import bisect_left, bisect_right
+
+def build_subscription_index(subscriptions):
+    # 按 (fuel_type, threshold) 排序，每种燃料对应一个有序的阈值列表
+    index = {}
+    for sub in sorted(subscriptions, key=lambda sub: (sub[2], sub[1])):
+        thresholds, subs = index.setdefault(sub[2], ([], []))
+        thresholds.append(sub[1])
+        subs.append(sub)
+    return index
+
+def match_alerts(subscription_index, latest_prices):
+    # latest_prices: {fuel_type: [(fuel_type, station, price, updated, ...), ...]}
+    # 返回 {email: [alert, ...]}，与原来逐条比较的结果相同
+    notifications = {}
+
+    for fuel_type, board in latest_prices.items():
+        if not board or fuel_type not in subscription_index:
+            continue
+
+        board = sorted(board, key=lambda price: price[2])
+        board_prices = [price[2] for price in board]
+        board_items = [(price[1], price[2], price[3]) for price in board]
+        thresholds, subs = subscription_index[fuel_type]
+
+        # 只有阈值 >= 最低价格的订阅才可能匹配
+        start = bisect_left(thresholds, board_prices[0])
+        for sub in subs[start:]:
+            email, threshold = sub[0], sub[1]
+            alerts = [{
+                'fuel_type': fuel_type,
+                'station': station,
+                'price': price,
+                'threshold': threshold,
+                'updated': updated
+            } for station, price, updated in board_items[:bisect_right(board_prices, threshold)]]
+            if email in notifications:
+                notifications[email].extend(alerts)
+            else:
+                notifications[email] = alerts
+
+    return notifications
+
+def suppress_repeats(notifications, last_alerted, epsilon):
+    # last_alerted: {(email, fuel_type, station): 上次提醒时的价格}
+    # 已经提醒过的加油站只有价格比上次提醒时至少再低 epsilon 才再次提醒
+    # 返回 (需要提醒的 {email: [alert, ...]}, 本次满足阈值的全部 (email, fuel_type, station))
+    fresh = {}
+    matched = set()
+    for email, alerts in notifications.items():
+        for alert in alerts:
+            key = (email, alert['fuel_type'], alert['station'])
+            matched.add(key)
+            previous = last_alerted.get(key)
+            # 容忍浮点误差，正好降低 epsilon 时也提醒
+            if previous is None or alert['price'] <= previous - epsilon + 1e-9:
+                fresh.setdefault(email, []).append(alert)
+    return fresh, matched
@@ -0,0 +1,274 @@
+import threading
+import warnings
+from collections import namedtuple
+import numpy as np
+from cache import TTLCache
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+# 季节性分析前先减去一周的滚动均值，去掉价格的长期走势
+TREND_WINDOW_HOURS = 168
+
+# 一种燃料的小时价格矩阵：stations × hours，价格在两次变化之间保持不变 (前向填充)
+# start_hour 为第一列对应的小时数 (自 1970-01-01 起)
+PriceMatrix = namedtuple('PriceMatrix', ['stations', 'cities', 'start_hour', 'values'])
+
+def parse_hours(timestamps):
+    # ISO 时间字符串 -> 自 1970-01-01 起的小时数；有无法解析的值时另外返回有效行的掩码
+    try:
+        return np.array(timestamps, dtype='datetime64[s]').astype('datetime64[h]').astype(np.int64), None
+    except ValueError:
+        hours = np.empty(len(timestamps), dtype=np.int64)
+        valid = np.ones(len(timestamps), dtype=bool)
+        for i, timestamp in enumerate(timestamps):
+            try:
+                hours[i] = np.datetime64(timestamp, 's').astype('datetime64[h]').astype(np.int64)
+            except (ValueError, TypeError):
+                valid[i] = False
+        return hours, valid
+
+def forward_fill(values):
+    # 沿最后一个轴用前一个有效值填充 NaN
+    mask = ~np.isnan(values)
+    index = np.where(mask, np.arange(values.shape[-1]), 0)
+    np.maximum.accumulate(index, axis=-1, out=index)
+    return np.take_along_axis(values, index, axis=-1)
+
+def rolling_mean(values, window):
+    # 沿最后一个轴的滚动均值 (忽略 NaN，窗口开头不足 window 时用已有的数据)
+    valid = ~np.isnan(values)
+    shape = values.shape[:-1] + (1,)
+    sums = np.concatenate([np.zeros(shape), np.cumsum(np.where(valid, values, 0.0), axis=-1)], axis=-1)
+    counts = np.concatenate([np.zeros(shape), np.cumsum(valid, axis=-1)], axis=-1)
+    end = np.arange(1, values.shape[-1] + 1)
+    start = np.maximum(end - window, 0)
+    window_counts = counts[..., end] - counts[..., start]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(window_counts > 0, (sums[..., end] - sums[..., start]) / window_counts, np.nan)
+
+def seasonal_profile(values, start_hour):
+    # 相对一周滚动均值的偏差，按 (星期几, 小时) 分组求平均，返回 7 × 24 的数组
+    deviation = values - rolling_mean(values, TREND_WINDOW_HOURS)
+    hours = start_hour + np.arange(values.shape[-1])
+    # 1970-01-01 是星期四
+    bucket = ((hours // 24 + 3) % 7) * 24 + hours % 24
+    bucket = np.broadcast_to(bucket, deviation.shape)
+    valid = ~np.isnan(deviation)
+    sums = np.bincount(bucket[valid], weights=deviation[valid], minlength=168)
+    counts = np.bincount(bucket[valid], minlength=168)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan).reshape(7, 24), counts.reshape(7, 24)
+
+def _to_list(values, digits=4):
+    return [None if np.isnan(value) else round(float(value), digits) for value in values]
+
+def _hour_to_iso(hour):
+    return str(np.datetime64(int(hour), 'h'))
+
+class _HistoryBuffer:
+    # 某种燃料已读取的历史价格，按 price_history.id 增量追加；加油站名编码为整数
+    # 只保留分析窗口内的记录，以及每个加油站在窗口之前的最后一条
+    def __init__(self):
+        self.last_id = 0
+        self.station_codes = {}
+        self.station_cities = []
+        self._codes = []
+        self._prices = []
+        self._hours = []
+
+    def extend(self, rows):
+        ids, stations, cities, prices, timestamps = zip(*rows)
+        codes = np.fromiter((self.station_codes.setdefault(station, len(self.station_codes)) for station in stations),
+                            dtype=np.int64, count=len(stations))
+        self.station_cities.extend([None] * (len(self.station_codes) - len(self.station_cities)))
+        # 每个加油站最近一次记录的城市
+        for code, city in zip(codes, cities):
+            self.station_cities[code] = city
+        hours, valid = parse_hours(timestamps)
+        prices = np.array(prices, dtype=np.float64)
+        if valid is not None:
+            codes, prices, hours = codes[valid], prices[valid], hours[valid]
+        self._codes.append(codes)
+        self._prices.append(prices)
+        self._hours.append(hours)
+        self.last_id = max(self.last_id, max(ids))
+
+    def prune(self, start_hour):
+        # 丢弃 start_hour 之前的记录，每个加油站只保留其中最后一条；保留的旧记录放在前面，同一小时以窗口内的记录为准
+        codes, prices, hours = self.arrays()
+        old = np.flatnonzero(hours < start_hour)
+        if not len(old):
+            return
+        order = old[np.lexsort((old, hours[old], codes[old]))]
+        anchors = order[np.r_[codes[order][1:] != codes[order][:-1], True]]
+        # 已经裁剪过：窗口之前只剩放在最前面的每站一条
+        if len(anchors) == len(old) and old[-1] == len(old) - 1:
+            return
+        keep = np.concatenate([np.sort(anchors), np.flatnonzero(hours >= start_hour)])
+        self._codes = [codes[keep]]
+        self._prices = [prices[keep]]
+        self._hours = [hours[keep]]
+
+    def arrays(self):
+        # 合并已读取的分块，之后只保留一个数组
+        if len(self._codes) > 1:
+            self._codes = [np.concatenate(self._codes)]
+            self._prices = [np.concatenate(self._prices)]
+            self._hours = [np.concatenate(self._hours)]
+        if not self._codes:
+            return np.array([], dtype=np.int64), np.array([]), np.array([], dtype=np.int64)
+        return self._codes[0], self._prices[0], self._hours[0]
+
+class PriceAnalytics:
+    # 历史价格只读取最近 max_days 天 (之后按 id 增量读取，并丢弃移出窗口的记录)，统计结果按数据版本缓存到下一次抓取
+    def __init__(self, get_db, max_days=366, cache_size=256, stamp_ttl=5):
+        self.get_db = get_db
+        self.max_hours = max_days * 24
+        self.results = TTLCache(maxsize=cache_size, ttl=24 * 3600)
+        self._stamps = TTLCache(maxsize=1, ttl=stamp_ttl)
+        self._buffers = {}
+        # 每种燃料一个锁，第一次读取某种燃料时不阻塞其他燃料的请求
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _version(self, db):
+        versions = self._stamps.get_or_load('data_versions', db.get_data_versions, version=db.version)
+        return versions.get('prices', (0, None))[0]
+
+    def _window_start(self, end_hour):
+        return end_hour - self.max_hours + 1
+
+    def _initial_rows(self, db, fuel_type):
+        # 第一次只读取最新记录之前 max_days 天内的历史价格 (以及每站窗口前的最后一条)
+        latest = db.get_latest_price_history_timestamp(fuel_type)
+        if latest is None:
+            return []
+        hours, valid = parse_hours([latest])
+        if valid is not None:
+            return db.iter_price_history_rows(fuel_type)
+        return db.iter_price_history_window(fuel_type, _hour_to_iso(self._window_start(int(hours[0]))))
+
+    def _build_matrix(self, buffer):
+        codes, prices, hours = buffer.arrays()
+        stations = np.array(list(buffer.station_codes), dtype=object)
+        cities = np.array(buffer.station_cities, dtype=object)
+        if not len(prices):
+            return PriceMatrix(stations, cities, 0, np.empty((len(stations), 0)))
+        end_hour = int(hours.max())
+        start_hour = max(int(hours.min()), self._window_start(end_hour))
+        # 窗口之前的价格放在第一列，作为前向填充的初始值
+        columns = np.clip(hours, start_hour, end_hour) - start_hour
+        n_hours = end_hour - start_hour + 1
+        values = np.full((len(stations), n_hours), np.nan)
+        # 同一小时有多条记录时取最后写入的一条
+        flat = codes * n_hours + columns
+        order = np.argsort(flat, kind='stable')
+        flat = flat[order]
+        last = np.r_[flat[1:] != flat[:-1], True]
+        values.ravel()[flat[last]] = prices[order][last]
+        return PriceMatrix(stations, cities, start_hour, forward_fill(values))
+
+    def matrix(self, fuel_type):
+        db = self.get_db()
+        version = self._version(db)
+        found, matrix = self.results.get(('matrix', fuel_type), version)
+        if found:
+            return matrix
+        with self._lock:
+            lock = self._locks.setdefault(fuel_type, threading.Lock())
+        with lock:
+            found, matrix = self.results.get(('matrix', fuel_type), version)
+            if found:
+                return matrix
+            buffer = self._buffers.get(fuel_type)
+            if buffer is None:
+                buffer = _HistoryBuffer()
+                for rows in self._initial_rows(db, fuel_type):
+                    buffer.extend(rows)
+                self._buffers[fuel_type] = buffer
+            else:
+                for rows in db.iter_price_history_rows(fuel_type, buffer.last_id):
+                    buffer.extend(rows)
+            hours = buffer.arrays()[2]
+            if len(hours):
+                buffer.prune(self._window_start(int(hours.max())))
+            matrix = self._build_matrix(buffer)
+            self.results.set(('matrix', fuel_type), matrix, version)
+            return matrix
+
+    def series(self, fuel_type, station=None, city=None):
+        # 返回 (start_hour, values)：指定加油站时为该站的价格，指定城市时为城市内各站的平均价格，否则为全部加油站的平均价格
+        matrix = self.matrix(fuel_type)
+        if station:
+            selected = matrix.stations == station
+        elif city:
+            selected = matrix.cities == city
+        else:
+            selected = np.ones(len(matrix.stations), dtype=bool)
+        if not selected.any():
+            raise KeyError(station or city or fuel_type)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            return matrix.start_hour, np.nanmean(matrix.values[selected], axis=0)
+
+    def _cached(self, key, compute):
+        db = self.get_db()
+        return self.results.get_or_load(key, compute, version=self._version(db))
+
+    def rolling(self, fuel_type, station=None, city=None, window=24, days=7):
+        def compute():
+            start_hour, values = self.series(fuel_type, station, city)
+            means = rolling_mean(values, window)
+            keep = min(days * 24, len(values))
+            return {
+                'fuel_type': fuel_type,
+                'station': station,
+                'city': city,
+                'window_hours': window,
+                'start': _hour_to_iso(start_hour + len(values) - keep) if keep else None,
+                'interval': 'hour',
+                'prices': _to_list(values[len(values) - keep:]),
+                'rolling_mean': _to_list(means[len(values) - keep:])
+            }
+        return self._cached(('rolling', fuel_type, station, city, window, days), compute)
+
+    def seasonality(self, fuel_type, station=None, city=None):
+        def compute():
+            start_hour, values = self.series(fuel_type, station, city)
+            profile, counts = seasonal_profile(values, start_hour)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                by_day = np.nanmean(profile, axis=1)
+                by_hour = np.nanmean(profile, axis=0)
+            return {
+                'fuel_type': fuel_type,
+                'station': station,
+                'city': city,
+                'day_of_week': dict(zip(WEEKDAYS, _to_list(by_day))),
+                'hour_of_day': _to_list(by_hour),
+                'hours_observed': int(counts.sum())
+            }
+        return self._cached(('seasonality', fuel_type, station, city), compute)
+
+    def cheapest_time(self, fuel_type, station=None, city=None):
+        # 价格相对一周均值最低的 (星期几, 小时)，以及平均可节省的金额
+        def compute():
+            start_hour, values = self.series(fuel_type, station, city)
+            profile, _ = seasonal_profile(values, start_hour)
+            if np.isnan(profile).all():
+                return {'fuel_type': fuel_type, 'station': station, 'city': city, 'recommendation': None}
+            day, hour = np.unravel_index(np.nanargmin(profile), profile.shape)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                by_hour = np.nanmean(profile, axis=0)
+            return {
+                'fuel_type': fuel_type,
+                'station': station,
+                'city': city,
+                'recommendation': {
+                    'day_of_week': WEEKDAYS[day],
+                    'hour': int(hour),
+                    'expected_saving': round(-float(profile[day, hour]), 4),
+                    'cheapest_hour_of_day': int(np.nanargmin(by_hour))
+                }
+            }
+        return self._cached(('cheapest_time', fuel_type, station, city), compute)
@@ -0,0 +1,52 @@
+import logging
+import threading
+from flask import Blueprint, jsonify, request
+
+MAX_WINDOW_HOURS = 24 * 90
+
+def create_analytics_blueprint(get_db, engine=None):
+    # /api/v1/analytics/{rolling,seasonality,cheapest_time}?fuel_type=&station=|city=
+    # 计算引擎 (NumPy) 在第一次请求时才导入，注册蓝图不会拖慢 Web 进程启动
+    analytics_bp = Blueprint('analytics', __name__, url_prefix='/api/v1/analytics')
+    analytics_bp.engine = engine
+    engine_lock = threading.Lock()
+
+    def get_engine():
+        with engine_lock:
+            if analytics_bp.engine is None:
+                from analytics import PriceAnalytics
+                analytics_bp.engine = PriceAnalytics(get_db)
+            return analytics_bp.engine
+
+    def respond(compute):
+        fuel_type = request.args.get('fuel_type', '95 E10')
+        station = request.args.get('station') or None
+        city = request.args.get('city') or None
+        try:
+            return jsonify(compute(get_engine(), fuel_type, station, city)), 200
+        except KeyError:
+            return jsonify({"error": "No price history for the requested fuel type, station or city"}), 404
+        except Exception as e:
+            logging.error(f"Error computing price analytics: {str(e)}", exc_info=True)
+            return jsonify({"error": "Could not compute analytics"}), 500
+
+    @analytics_bp.route('/rolling')
+    def rolling():
+        try:
+            window = int(request.args.get('window', 24))
+            days = int(request.args.get('days', 7))
+        except ValueError:
+            return jsonify({"error": "window and days must be integers"}), 400
+        if not 1 <= window <= MAX_WINDOW_HOURS or not 1 <= days <= 366:
+            return jsonify({"error": f"window must be 1-{MAX_WINDOW_HOURS} hours and days 1-366"}), 400
+        return respond(lambda engine, fuel_type, station, city: engine.rolling(fuel_type, station, city, window, days))
+
+    @analytics_bp.route('/seasonality')
+    def seasonality():
+        return respond(lambda engine, *query: engine.seasonality(*query))
+
+    @analytics_bp.route('/cheapest_time')
+    def cheapest_time():
+        return respond(lambda engine, *query: engine.cheapest_time(*query))
+
+    return analytics_bp
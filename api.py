@@ -1,248 +1,301 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, render_template_string
-from database import Database
-from scraper import scrape_fuel_prices
-from apscheduler.schedulers.background import BackgroundScheduler
-from email_sender import send_email
+from flask import Flask, Response, current_app, g, request, jsonify, render_template, redirect, url_for, flash, session, stream_with_context
+from markupsafe import Markup
+from database import get_db, get_db_if_ready, release_db
+from cache import TTLCache
+from metrics import CONTENT_TYPE, HTTP_REQUEST_SECONDS, render_metrics
+from json_api import create_api_blueprint
+from price_events import create_events_blueprint
+from analytics_api import create_analytics_blueprint
+from snapshots import EXTRA_MARKER, SnapshotStore, build_home_snapshot, personalize_fragment, snapshot_versions
 import logging
+import math
 import sqlite3
-from datetime import datetime, timedelta
-from distance_calculator import calculate_distance_and_time, get_address
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
+import threading
+import time
 import os
 from dotenv import load_dotenv
 
+# 导入本模块只定义路由，不连接数据库、不启动线程；应用由 create_app() 创建。
+# 抓取 (requests / BeautifulSoup)、地理编码 (geopy)、NumPy 和导出等较重的依赖在用到的路由中才导入，
+# 启动后由后台线程预先导入
+
 load_dotenv()  # 加载 .env 文件中的环境变量
 
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'DEBUG'))
+
+# 定时抓取和邮件发送由独立的 job_runner.py 进程执行，Web 进程只处理请求
+
+def start_timer():
+    g.request_started = time.perf_counter()
+
+def record_request_latency(response):
+    # 流式响应 (SSE、导出) 只记录到开始返回响应体为止
+    started = g.pop('request_started', None)
+    if started is not None:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, request.endpoint or 'unmatched',
+                                     request.method, str(response.status_code))
+    return response
+
+def teardown_db(exception):
+    # 请求结束后把连接归还连接池
+    # 数据库还在后台初始化时不等待 (/health、/ready 不使用数据库)
+    release_db()
+
+# 价格榜单 (含加油站坐标) 的读缓存，对应资源的数据版本号变化或超过 TTL 后重新查询
+board_cache = TTLCache(maxsize=int(os.getenv('BOARD_CACHE_SIZE', '64')),
+                       ttl=int(os.getenv('BOARD_CACHE_TTL', '3600')))
+
+# /api/nearby 的最大搜索半径 (km)
+MAX_NEARBY_RADIUS_KM = 100
+
+# 价格由 job runner 进程写入，缓存版本号来自 data_versions 表 (最多每 5 秒查询一次，本进程写入后立即重新查询)；
+# 只取对应资源的版本号，订阅等无关写入不会使加油站索引和价格缓存失效
+version_stamps = TTLCache(maxsize=4, ttl=5)
+
+def data_version(db, resource):
+    versions = version_stamps.get_or_load('data_versions', db.get_data_versions, version=db.version)
+    return versions.get(resource, (0, None))[0]
 
-app = Flask(__name__)
+# 预渲染的主页快照，由 job runner 在每次抓取后生成；数据版本不匹配时在本进程重新渲染
+home_snapshots = SnapshotStore(os.getenv('SNAPSHOT_DIR', '/data/snapshots'))
 
-scheduler = BackgroundScheduler()
-scheduler.start()
+def get_home_snapshot(db):
+    app = current_app._get_current_object()
+    versions = snapshot_versions(version_stamps.get_or_load('data_versions', db.get_data_versions, version=db.version))
+    return home_snapshots.get_or_build(versions, lambda: build_home_snapshot(app, db, versions))
 
-def get_db():
-    database_url = os.getenv('DATABASE_URL')
-    if not database_url:
-        raise ValueError("DATABASE_URL environment variable is not set")
-    logging.info(f"Connecting to database: {database_url}")
-    return Database(database_url)
+# 地址解析结果缓存在内存和数据库中，重复的地址不再请求外部服务
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+def get_geocoder():
+    global _geocoder
+    with _geocoder_lock:
+        if _geocoder is None:
+            from geocoder import GeocodeCache
+            _geocoder = GeocodeCache(get_db)
+        return _geocoder
+
+class Startup:
+    # 后台完成数据库建表/迁移和预热，/health 立即返回，/ready 在数据库可用且已有价格数据后返回 200
+    def __init__(self):
+        self.started_at = time.time()
+        self.warmed = threading.Event()
+        self.data_loaded = False
+        self.error = None
+
+    def start(self, app):
+        threading.Thread(target=self._run, args=(app,), name="startup", daemon=True).start()
+
+    def _run(self, app):
+        try:
+            # 第一次 get_db() 时执行结构迁移；期间到达的请求在 get_db() 处等待
+            db = get_db()
+            logging.info(f"Database ready {time.time() - self.started_at:.2f}s after start")
+            # 预先导入请求中才用到的模块，并渲染主页快照
+            import distance_calculator, routing, spatial_index, exporter, geocoder, analytics  # noqa: F401
+            with app.app_context():
+                if self.has_data(db):
+                    get_home_snapshot(db)
+            self.warmed.set()
+            logging.info(f"Warm-up finished {time.time() - self.started_at:.2f}s after start")
+        except Exception as e:
+            self.error = str(e)
+            logging.error(f"Error during startup: {str(e)}", exc_info=True)
+        finally:
+            release_db()
+
+    def has_data(self, db):
+        # 价格由 job runner 写入；一旦有数据就不再查询
+        if not self.data_loaded:
+            self.data_loaded = db.has_fuel_prices()
+        return self.data_loaded
 
 # 所有路由定义
-@app.route('/')
 def home():
     logging.debug("Entering home route")
     try:
         db = get_db()
-        logging.debug("Getting subscriptions from database")
-        subscriptions = db.get_all_subscriptions()
-        logging.debug(f"Retrieved {len(subscriptions)} subscriptions")
-        
-        logging.debug("Getting latest top 10 fuel prices from database")
-        grouped_prices = {
-            '95 E10': db.get_latest_top10_fuel_prices('95 E10'),
-            '98 E5': db.get_latest_top10_fuel_prices('98 E5'),
-            'Diesel': db.get_latest_top10_fuel_prices('Diesel')
-        }
-        logging.debug(f"Retrieved fuel prices for {len(grouped_prices)} fuel types")
-    
+        snapshot = get_home_snapshot(db)
         user_email = request.args.get('email')
+
+        # 匿名访问直接返回预渲染的主页 (有待显示的 flash 消息时除外)
+        if not user_email and not session.get('_flashes'):
+            etag = f'"{snapshot.page_hash}"'
+            if etag in request.headers.get('If-None-Match', ''):
+                return Response(status=304, headers={'ETag': etag})
+            return Response(snapshot.page, mimetype='text/html', headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
         user_location = None
         if user_email:
             user_location = db.get_user_location(user_email)
-        
-        if user_location and len(user_location) >= 2:
-            for fuel_type in grouped_prices:
-                for i, price in enumerate(grouped_prices[fuel_type]):
-                    station_location = db.get_station_location(price[1])
-                    logging.debug(f"Station location for {price[1]}: {station_location}")
-                    if station_location:
-                        station_lat, station_lon = station_location
-                        calc_result = calculate_distance_and_time(user_location[0], user_location[1], station_lat, station_lon)
-                        grouped_prices[fuel_type][i] = price + (calc_result['distance'], calc_result['time_minutes'])
-                        logging.debug(f"Calculated distance and time for {price[1]}: {calc_result}")
-                    else:
-                        grouped_prices[fuel_type][i] = price + (None, None)
-                        logging.warning(f"No location found for station: {price[1]}")
-    
+
+        # 复用预渲染的价格表格，只计算距离和时间两列
+        if user_email:
+            price_tables = {
+                fuel_type: personalize_fragment(fragment, snapshot.locations[fuel_type], user_location)
+                for fuel_type, fragment in snapshot.fragments.items()
+            }
+        else:
+            price_tables = {fuel_type: Markup(fragment.replace(EXTRA_MARKER, '')) for fuel_type, fragment in snapshot.fragments.items()}
+
         logging.debug("Rendering index.html template")
-        return render_template('index.html', subscriptions=subscriptions, grouped_prices=grouped_prices, user_email=user_email, user_location=user_location)
+        return render_template('index.html', subscriptions=db.get_all_subscriptions(), price_tables=price_tables, user_email=user_email, user_location=user_location)
     except Exception as e:
         logging.error(f"Error in home route: {str(e)}", exc_info=True)
         return "An error occurred", 500
 
-@app.route('/subscribe', methods=['POST'])
 def subscribe():
     email = request.form.get('email')
     threshold = request.form.get('threshold')
     fuel_type = request.form.get('fuel_type')
-    
+    alert_mode = request.form.get('alert_mode', 'instant')
+
     if not email or not threshold or not fuel_type:
         flash("Email, threshold and fuel type are required", "error")
         return redirect(url_for('home'))
-    
+    if alert_mode not in ('instant', 'daily', 'weekly'):
+        flash("Alert mode must be instant, daily or weekly", "error")
+        return redirect(url_for('home'))
+
     db = get_db()
-    db.add_user(email, float(threshold), fuel_type)
-    
+    db.add_user(email, float(threshold), fuel_type, alert_mode=alert_mode)
+
     flash("Subscription successful", "success")
     return redirect(url_for('home'))
 
-@app.route('/unsubscribe', methods=['POST'])
 def unsubscribe():
     email = request.form.get('email')
-    
+
     if not email:
         flash("Email is required", "error")
         return redirect(url_for('home'))
-    
+
     with get_db() as db:
         db.remove_user(email)
-    
+
     flash("Unsubscription successful", "success")
     return redirect(url_for('home'))
 
-@app.route('/update_prices', methods=['POST'])
 def update_prices():
+    # 抓取依赖 requests / BeautifulSoup，只在手动触发时导入
+    from jobs import run_job, update_fuel_prices_and_notify
     try:
-        update_fuel_prices_and_notify()
-        flash("Fuel prices updated successfully", "success")
+        # 与 job runner 共用任务租约，抓取正在进行时不会重复运行
+        if run_job('update_fuel_prices_and_notify', update_fuel_prices_and_notify) is None:
+            flash("A price update is already running", "info")
+        else:
+            flash("Fuel prices updated successfully", "success")
     except Exception as e:
         flash(f"Error updating prices: {str(e)}", "error")
     return redirect(url_for('home'))
 
-@app.route('/health')
 def health_check():
+    # 存活检查：进程能处理请求即可，不访问数据库
     return jsonify({"status": "healthy"}), 200
 
-@app.route('/view_data')
+def readiness_check():
+    # 就绪检查：数据库建表完成并且已有价格数据
+    startup = current_app.extensions['startup']
+    db = get_db_if_ready()
+    data_loaded = db is not None and startup.has_data(db)
+    ready = data_loaded and startup.error is None
+    body = {
+        "status": "ready" if ready else "starting",
+        "database": db is not None,
+        "data_loaded": data_loaded,
+        "warmed_up": startup.warmed.is_set(),
+        "uptime_seconds": round(time.time() - startup.started_at, 2)
+    }
+    if startup.error:
+        body["error"] = startup.error
+    return jsonify(body), 200 if ready else 503
+
+def get_station_index(db):
+    from spatial_index import StationIndex
+    # 加油站坐标变化时重建空间索引
+    return board_cache.get_or_load(
+        ('station_index',),
+        lambda: StationIndex(db.get_all_stations()),
+        version=data_version(db, 'stations')
+    )
+
+def get_current_price_map(db, fuel_type):
+    return board_cache.get_or_load(
+        ('current_prices', fuel_type),
+        lambda: {station: (price, updated) for station, price, updated in db.get_current_prices(fuel_type)},
+        version=data_version(db, 'prices')
+    )
+
+def nearby_stations():
+    from spatial_index import cheapest_nearby
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+        radius_km = float(request.args.get('radius_km', 5))
+        k = int(request.args.get('k', 10))
+    except (KeyError, ValueError):
+        return jsonify({"error": "lat and lon are required; lat, lon, radius_km and k must be numbers"}), 400
+    fuel_type = request.args.get('fuel_type', '95 E10')
+    # NaN 与任何数比较都为 False，先排除非有限值
+    if (not all(map(math.isfinite, (lat, lon, radius_km))) or not -90 <= lat <= 90 or not -180 <= lon <= 180
+            or not 0 < radius_km <= MAX_NEARBY_RADIUS_KM or k <= 0):
+        return jsonify({"error": f"lat, lon, radius_km (at most {MAX_NEARBY_RADIUS_KM} km) or k out of range"}), 400
+
+    db = get_db()
+    stations = cheapest_nearby(get_station_index(db), get_current_price_map(db, fuel_type), lat, lon, radius_km, k)
+    return jsonify({
+        "fuel_type": fuel_type,
+        "radius_km": radius_km,
+        "stations": stations
+    }), 200
+
+def metrics():
+    # Prometheus 文本格式；job runner 的指标由其 METRICS_PORT 暴露
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
+
+def cache_stats():
+    return jsonify({"board_cache": board_cache.stats(), "price_events": current_app.blueprints['events'].bus.stats()}), 200
+
 def view_data():
-    conn = sqlite3.connect('/data/fuel_prices.db')  # 修改这里
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables = cursor.fetchall()
-    
-    data = {}
-    for table in tables:
-        table_name = table[0]
-        cursor.execute(f"SELECT * FROM {table_name}")
-        columns = [description[0] for description in cursor.description]
-        rows = cursor.fetchall()
-        data[table_name] = {
-            'columns': columns,
-            'rows': rows
-        }
-    
-    conn.close()
-
-    html_template = """
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Database Data</title>
-        <style>
-            table { border-collapse: collapse; width: 100%; margin-bottom: 20px; }
-            th, td { border: 1px solid #ddd; padding: 8px; text-align: left; }
-            th { background-color: #f2f2f2; }
-        </style>
-    </head>
-    <body>
-        <h1>Database Data</h1>
-        {% for table_name, table_data in data.items() %}
-            <h2>{{ table_name }}</h2>
-            <table>
-                <tr>
-                    {% for column in table_data['columns'] %}
-                        <th>{{ column }}</th>
-                    {% endfor %}
-                </tr>
-                {% for row in table_data['rows'] %}
-                    <tr>
-                        {% for cell in row %}
-                            <td>{{ cell }}</td>
-                        {% endfor %}
-                    </tr>
-                {% endfor %}
-            </table>
-        {% endfor %}
-    </body>
-    </html>
-    """
-    
-    return render_template_string(html_template, data=data)
+    from exporter import EXPORT_TABLES, FORMATS, iter_table_chunks, stream_export, stream_html
+    # 流式导出：?table=&format=csv|ndjson|html|arrow|parquet&fuel_type=&since=&until=
+    # 不指定 table 时以 HTML 逐块输出所有表
+    db = get_db()
+    table = request.args.get('table')
+    export_format = request.args.get('format', 'html')
+    try:
+        if table:
+            mimetype, extension, body = stream_export(
+                db, table, export_format,
+                fuel_type=request.args.get('fuel_type'),
+                since=request.args.get('since'),
+                until=request.args.get('until')
+            )
+        elif export_format == 'html':
+            mimetype = FORMATS['html'][0]
+            body = stream_html([(name, *iter_table_chunks(db, name)) for name in EXPORT_TABLES])
+        else:
+            raise ValueError("table is required for non-HTML exports")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    headers = {}
+    if table and export_format != 'html':
+        headers['Content-Disposition'] = f'attachment; filename="{table}.{extension}"'
+    return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
 
 # 错误处理器
-@app.errorhandler(404)
 def not_found(error):
     return render_template('404.html'), 404
 
-@app.errorhandler(500)
 def server_error(error):
     return render_template('500.html'), 500
 
-@app.errorhandler(Exception)
 def handle_exception(e):
     print(f"Unhandled exception: {str(e)}")
     return "An error occurred", 500
 
-# 辅助函数
-def update_fuel_prices_and_notify():
-    try:
-        prices = scrape_fuel_prices()
-        logging.info(f"Scraped prices: {prices}")
-        db = get_db()
-        db.update_fuel_prices(prices)
-        
-        # 获取最新的前10个最低价格
-        latest_prices = {}
-        for fuel_type in ['95 E10', '98 E5', 'Diesel']:
-            latest_prices[fuel_type] = db.get_latest_top10_fuel_prices(fuel_type)
-        
-        # 通知逻辑
-        subscriptions = db.get_all_subscriptions()
-        logging.info(f"Found {len(subscriptions)} subscriptions")
-        
-        # 用于存储每个用户的通知信息
-        notifications = {}
-        
-        for sub in subscriptions:
-            email, threshold, fuel_type = sub
-            logging.info(f"Checking subscription: {email}, {threshold}, {fuel_type}")
-            if fuel_type in latest_prices:
-                for price in latest_prices[fuel_type]:
-                    logging.info(f"Comparing price {price[2]} with threshold {threshold}")
-                    if price[2] <= threshold:
-                        if email not in notifications:
-                            notifications[email] = []
-                        notifications[email].append({
-                            'fuel_type': fuel_type,
-                            'station': price[1],
-                            'price': price[2],
-                            'threshold': threshold,
-                            'updated': price[3]
-                        })
-        
-        # 发送合并后的通知
-        for email, alerts in notifications.items():
-            subject = "Fuel Price Alert"
-            message = "The following fuel prices have dropped below your thresholds:\n\n"
-            for alert in alerts:
-                message += f"- {alert['fuel_type']} at {alert['station']}: €{alert['price']} (Threshold: €{alert['threshold']}, Updated: {alert['updated']})\n"
-            
-            logging.info(f"Sending email to {email}: {subject}")
-            if send_email(email, subject, message):
-                logging.info(f"Successfully sent price alert to {email}")
-            else:
-                logging.error(f"Failed to send price alert to {email}")
-        
-        logging.info("Fuel prices updated and notifications sent successfully")
-    except Exception as e:
-        logging.error(f"Error updating fuel prices and sending notifications: {str(e)}", exc_info=True)
-
-# 设置定时任务，每小时更新一次燃料价格并发送通知
-scheduler.add_job(update_fuel_prices_and_notify, 'interval', hours=1)
-
 # 辅助函数
 def clean_database():
     try:
@@ -268,52 +321,28 @@ def clean_database():
     except Exception as e:
         logging.error(f"Error checking database: {str(e)}", exc_info=True)
 
-def initialize_data():
-    logging.info("Initializing data...")
-    try:
-        db = get_db()
-        # 确保表已创建
-        db.create_tables()
-        
-        prices = scrape_fuel_prices()
-        logging.info(f"Scraped prices during initialization: {prices}")
-        if prices:
-            db.update_fuel_prices(prices)
-            logging.info(f"Initialized {sum(len(price_list) for price_list in prices.values())} fuel prices in database")
-        else:
-            logging.warning("No fuel prices scraped during initialization")
-        
-        check_prices = db.get_latest_fuel_prices()
-        logging.info(f"After initialization, retrieved {len(check_prices)} prices from database")
-    except Exception as e:
-        logging.error(f"Error initializing data: {str(e)}", exc_info=True)
-
-
-
-@app.route('/add_vehicle', methods=['POST'])
 def add_vehicle():
+    from geopy.exc import GeocoderTimedOut, GeocoderServiceError
     email = request.form.get('email')
     address = request.form.get('address')
-    
+
     if not email or not address:
         flash("Email and address are required", "error")
         return redirect(url_for('home'))
-    
+
     try:
-        geolocator = Nominatim(user_agent="fuel_price_tracker")
-        location = geolocator.geocode(address)
+        location = get_geocoder().geocode(address)
         if location:
             db = get_db()
-            db.update_user_location(email, location.latitude, location.longitude, address)
+            db.update_user_location(email, location[0], location[1], address)
             flash("Vehicle location added successfully", "success")
         else:
             flash("Could not find the location. Please try a more specific address.", "error")
     except (GeocoderTimedOut, GeocoderServiceError):
         flash("Geocoding service is currently unavailable. Please try again later.", "error")
-    
+
     return redirect(url_for('home'))
 
-@app.route('/manage_stations', methods=['GET', 'POST'])
 def manage_stations():
     db = get_db()
     if request.method == 'POST':
@@ -325,19 +354,62 @@ def manage_stations():
             flash("Station location added/updated successfully", "success")
         else:
             flash("All fields are required", "error")
-    
+
     stations = db.get_all_stations()
     return render_template('manage_stations.html', stations=stations)
 
+ROUTES = [
+    ('/', home, ['GET']),
+    ('/subscribe', subscribe, ['POST']),
+    ('/unsubscribe', unsubscribe, ['POST']),
+    ('/update_prices', update_prices, ['POST']),
+    ('/health', health_check, ['GET']),
+    ('/ready', readiness_check, ['GET']),
+    ('/api/nearby', nearby_stations, ['GET']),
+    ('/metrics', metrics, ['GET']),
+    ('/cache_stats', cache_stats, ['GET']),
+    ('/view_data', view_data, ['GET']),
+    ('/add_vehicle', add_vehicle, ['POST']),
+    ('/manage_stations', manage_stations, ['GET', 'POST']),
+]
+
+def create_app(background_startup=True):
+    # background_startup：在后台线程中初始化数据库并预热；job runner 只用应用渲染模板时关闭
+    app = Flask(__name__)
+    # 主页的价格实时更新：poll (定时请求，默认)、sse (长连接，需要 gthread / gevent worker) 或 off
+    app.config['LIVE_UPDATES'] = os.getenv('LIVE_UPDATES', 'poll')
+    app.config['LIVE_UPDATES_POLL_INTERVAL'] = int(os.getenv('LIVE_UPDATES_POLL_INTERVAL', '60'))
+    app.before_request(start_timer)
+    app.after_request(record_request_latency)
+    app.teardown_appcontext(teardown_db)
+
+    for rule, view_func, methods in ROUTES:
+        app.add_url_rule(rule, view_func=view_func, methods=methods)
+
+    # 版本化的 JSON API (/api/v1/...)
+    app.register_blueprint(create_api_blueprint(get_db))
+
+    # 价格趋势分析 (/api/v1/analytics/...)
+    app.register_blueprint(create_analytics_blueprint(get_db))
+
+    # 价格变化推送 (/events/prices SSE 和 /events/prices/poll 长轮询)
+    app.register_blueprint(create_events_blueprint(get_db))
+
+    app.register_error_handler(404, not_found)
+    app.register_error_handler(500, server_error)
+    app.register_error_handler(Exception, handle_exception)
+
+    startup = app.extensions['startup'] = Startup()
+    if background_startup:
+        startup.start(app)
+    return app
 
-# 确保在应用启动时调用这个函数
 if __name__ == '__main__':
     logging.info("Starting the application")
-    initialize_data()
-    clean_database()
-    
+    app = create_app()
+
     print("Registered routes:")
     for rule in app.url_map.iter_rules():
         print(f"{rule.endpoint}: {rule.methods} {rule.rule}")
-    
-    app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
+
+    app.run(host='0.0.0.0', port=5001, debug=True)
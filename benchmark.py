@@ -0,0 +1,540 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import smtplib
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+
+from alert_matcher import build_subscription_index, match_alerts
+from database import Database
+from email_sender import SMTPConnectionPool, build_message
+from mail_queue import MailDispatcher
+from query_plans import full_scans, generate_dataset, plan_queries, query_plan
+from scraper import PARSER_BACKENDS, ScraperEngine, lxml, parse_fuel_prices
+from standins import StandInHTTPServer, StandInSMTPServer, fixture_html
+
+FUEL_TYPES = ['95 E10', '98 E5', 'Diesel']
+
+def _timed(func, *args, repeat=3):
+    # 返回多次运行中最快的一次 (秒) 和函数结果
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+# 订阅匹配 ---------------------------------------------------------------
+
+def _synthetic_boards(rng):
+    boards = {}
+    for fuel_type in FUEL_TYPES:
+        prices = sorted(round(rng.uniform(1.6, 2.1), 3) for _ in range(10))
+        boards[fuel_type] = [(fuel_type, f"Station {i}", price, '1 hour ago') for i, price in enumerate(prices)]
+    return boards
+
+def _synthetic_subscriptions(rng, count):
+    return [
+        (f"user{i}@example.com", round(rng.uniform(1.0, 1.75), 2), rng.choice(FUEL_TYPES))
+        for i in range(count)
+    ]
+
+def _naive_match(subscriptions, latest_prices):
+    # 旧实现：每个订阅与榜单逐条比较
+    notifications = {}
+    for email, threshold, fuel_type in subscriptions:
+        for price in latest_prices.get(fuel_type, []):
+            if price[2] <= threshold:
+                notifications.setdefault(email, []).append({
+                    'fuel_type': fuel_type,
+                    'station': price[1],
+                    'price': price[2],
+                    'threshold': threshold,
+                    'updated': price[3]
+                })
+    return notifications
+
+def bench_matcher(sizes):
+    rng = random.Random(42)
+    boards = _synthetic_boards(rng)
+    print(f"{'subscriptions':>14} {'naive (ms)':>12} {'index build (ms)':>17} {'indexed match (ms)':>19} {'alerted':>9}")
+    results = []
+    for size in sizes:
+        subscriptions = _synthetic_subscriptions(rng, size)
+        naive_time, expected = _timed(_naive_match, subscriptions, boards)
+        build_time, index = _timed(build_subscription_index, subscriptions)
+        match_time, notifications = _timed(match_alerts, index, boards)
+        assert notifications == expected
+        print(f"{size:>14} {naive_time * 1000:>12.1f} {build_time * 1000:>17.1f} {match_time * 1000:>19.1f} {len(notifications):>9}")
+        results.append({'size': size, 'naive_s': naive_time, 'build_s': build_time, 'match_s': match_time})
+    return results
+
+# SMTP 发送 ---------------------------------------------------------------
+
+def _send_one_connection_per_message(host, port, count):
+    # 旧实现：每封邮件都新建连接并登录
+    for i in range(count):
+        with smtplib.SMTP(host, port) as server:
+            server.login('bench@example.com', 'secret')
+            server.send_message(build_message('bench@example.com', f"user{i}@example.com", "Fuel Price Alert", "Benchmark"))
+
+def bench_smtp(sizes):
+    count = 200
+    server = StandInSMTPServer()
+    host, port = server.server_address
+    print(f"{count} messages, stand-in connect delay {server.connect_delay * 1000:.0f} ms, "
+          f"per-message delay {server.message_delay * 1000:.0f} ms")
+
+    start = time.perf_counter()
+    _send_one_connection_per_message(host, port, count)
+    elapsed = time.perf_counter() - start
+    print(f"{'pool size':>10} {'seconds':>9} {'msg/s':>9}")
+    print(f"{'none':>10} {elapsed:>9.2f} {count / elapsed:>9.1f}")
+    results = [{'size': 0, 'seconds': elapsed}]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        for size in sizes:
+            pool = SMTPConnectionPool(host, port, 'bench@example.com', 'secret', size=size, use_ssl=False)
+            dispatcher = MailDispatcher(lambda: db, pool, workers=size)
+            db.enqueue_emails([(f"user{i}@example.com", "Fuel Price Alert", "Benchmark") for i in range(count)])
+            start = time.perf_counter()
+            sent, failed = dispatcher.drain()
+            elapsed = time.perf_counter() - start
+            pool.close()
+            assert sent == count and failed == 0
+            print(f"{size:>10} {elapsed:>9.2f} {count / elapsed:>9.1f}")
+            results.append({'size': size, 'seconds': elapsed})
+        db.close()
+    server.close()
+    return results
+
+# 抓取 -----------------------------------------------------------------------
+
+def _scrape_sequentially(base_url, cities):
+    # 旧实现：每个城市一次阻塞的 requests.get
+    import requests
+    for city in cities:
+        parse_fuel_prices(requests.get(base_url.format(city=city)).content)
+
+def bench_scrape(sizes):
+    import logging
+    logging.getLogger().setLevel(logging.WARNING)
+    server = StandInHTTPServer()
+    print(f"stand-in latency {server.latency * 1000:.0f} ms per request")
+    print(f"{'cities':>7} {'sequential (s)':>15} {'engine (s)':>11} {'engine, 304s (s)':>17}")
+    results = []
+    for size in sizes:
+        cities = [f"city{i}" for i in range(size)]
+        start = time.perf_counter()
+        _scrape_sequentially(server.base_url, cities)
+        sequential = time.perf_counter() - start
+
+        engine = ScraperEngine(cities, base_url=server.base_url)
+        start = time.perf_counter()
+        scraped = engine.scrape()
+        first = time.perf_counter() - start
+        assert all(result['error'] is None for result in scraped.values())
+
+        # 第二次抓取时页面未变化，服务器返回 304
+        start = time.perf_counter()
+        scraped = engine.scrape()
+        second = time.perf_counter() - start
+        assert all(result['not_modified'] for result in scraped.values())
+        engine.close()
+        print(f"{size:>7} {sequential:>15.2f} {first:>11.2f} {second:>17.2f}")
+        results.append({'size': size, 'sequential_s': sequential, 'engine_s': first, 'not_modified_s': second})
+    server.close()
+    return results
+
+def _without_timestamps(prices):
+    return {
+        fuel_type: [(price['station'], price['price'], price['updated']) for price in price_list]
+        for fuel_type, price_list in prices.items()
+    }
+
+def bench_parse(sizes):
+    import logging
+    logging.getLogger().setLevel(logging.WARNING)
+    backends = [name for name in PARSER_BACKENDS if lxml is not None or name == 'html.parser']
+    print(f"{'rows/table':>11} " + " ".join(f"{name + ' (ms)':>18}" for name in backends))
+    results = []
+    for size in sizes:
+        page = fixture_html('oulu', stations_per_table=size)
+        timings = []
+        expected = None
+        for name in backends:
+            elapsed, prices = _timed(parse_fuel_prices, page, name, repeat=5)
+            # 各解析器的结果必须一致
+            if expected is None:
+                expected = _without_timestamps(prices)
+            assert _without_timestamps(prices) == expected, f"{name} output differs"
+            timings.append(elapsed)
+        print(f"{size:>11} " + " ".join(f"{elapsed * 1000:>18.2f}" for elapsed in timings))
+        results.append(dict({'size': size}, **{f"{name}_s": elapsed for name, elapsed in zip(backends, timings)}))
+    return results
+
+# 价格趋势分析 -----------------------------------------------------------
+
+def bench_analytics(sizes):
+    import numpy as np
+    from analytics import forward_fill, rolling_mean, seasonal_profile
+
+    hours = 366 * 24
+    rng = np.random.default_rng(1)
+    start_hour = int(np.datetime64('2025-01-01T00', 'h').astype(np.int64))
+    print(f"one year of hourly prices ({hours} hours)")
+    print(f"{'stations':>9} {'fill (ms)':>10} {'rolling 24h (ms)':>17} {'seasonality (ms)':>17} {'total (ms)':>11}")
+    results = []
+    for size in sizes:
+        # 价格平均每 6 小时变化一次，其余小时为 NaN，由前向填充补齐
+        values = np.full((size, hours), np.nan)
+        changes = rng.random((size, hours)) < 1 / 6
+        changes[:, 0] = True
+        values[changes] = 1.8 + 0.1 * rng.random(changes.sum())
+        fill, filled = _timed(forward_fill, values)
+        rolling, _ = _timed(rolling_mean, filled, 24)
+        season, _ = _timed(seasonal_profile, filled, start_hour)
+        total = fill + rolling + season
+        print(f"{size:>9} {fill * 1000:>10.1f} {rolling * 1000:>17.1f} {season * 1000:>17.1f} {total * 1000:>11.1f}")
+        results.append({'size': size, 'fill_s': fill, 'rolling_s': rolling, 'seasonality_s': season})
+    return results
+
+# 道路行驶时间矩阵 -------------------------------------------------------
+
+def fixture_osm(path, side, spacing_km=0.1, origin=(65.0, 25.4)):
+    # 生成 side × side 的方格路网 (OSM XML)：每 10 条为主干道，其余为居民区道路
+    lat_step = spacing_km / 111.2
+    lon_step = spacing_km / (111.2 * math.cos(math.radians(origin[0])))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("<?xml version='1.0' encoding='UTF-8'?>\n<osm version='0.6'>\n")
+        for i in range(side):
+            for j in range(side):
+                f.write(f"<node id='{i * side + j + 1}' lat='{origin[0] + i * lat_step:.7f}' "
+                        f"lon='{origin[1] + j * lon_step:.7f}'/>\n")
+        way_id = 1
+        for horizontal in (True, False):
+            for line in range(side):
+                refs = [line * side + k + 1 if horizontal else k * side + line + 1 for k in range(side)]
+                highway = 'primary' if line % 10 == 0 else 'residential'
+                f.write(f"<way id='{way_id}'>" + "".join(f"<nd ref='{ref}'/>" for ref in refs) +
+                        f"<tag k='highway' v='{highway}'/></way>\n")
+                way_id += 1
+        f.write("</osm>\n")
+    return origin[0], origin[1], origin[0] + (side - 1) * lat_step, origin[1] + (side - 1) * lon_step
+
+def bench_routing(sizes):
+    import logging
+    import numpy as np
+    from distance_calculator import calculate_distances_and_times
+    from routing import RouteStore, build_route_matrix, load_osm_graph, route_distances_and_times
+
+    logging.getLogger().setLevel(logging.WARNING)
+    rng = random.Random(7)
+    station_count = 50
+    lookups = 2000
+    print(f"{station_count} stations, 100 m road grid, 0.5 km cells, {lookups} lookups of 10 stations")
+    print(f"{'grid side':>10} {'nodes':>8} {'load (s)':>9} {'build (s)':>10} {'cells':>7} "
+          f"{'lookup (us)':>12} {'geodesic (us)':>14}")
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            osm_path = os.path.join(tmp, f"grid-{size}.osm")
+            min_lat, min_lon, max_lat, max_lon = fixture_osm(osm_path, size)
+            stations = [(f"Station {i}", rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon))
+                        for i in range(station_count)]
+
+            start = time.perf_counter()
+            graph = load_osm_graph(osm_path)
+            load = time.perf_counter() - start
+            start = time.perf_counter()
+            grid, stations, minutes, lengths = build_route_matrix(graph, stations)
+            build = time.perf_counter() - start
+            store = RouteStore(os.path.join(tmp, f"routes-{size}"))
+            store.save(grid, stations, minutes, lengths)
+            routes = store.get()
+
+            users = [(rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon)) for _ in range(lookups)]
+            targets = [rng.sample(stations, 10) for _ in range(lookups)]
+            start = time.perf_counter()
+            for (lat, lon), chosen in zip(users, targets):
+                route_distances_and_times(lat, lon, [s[1] for s in chosen], [s[2] for s in chosen], routes)
+            lookup = (time.perf_counter() - start) / lookups
+            start = time.perf_counter()
+            for (lat, lon), chosen in zip(users, targets):
+                calculate_distances_and_times(lat, lon, [s[1] for s in chosen], [s[2] for s in chosen])
+            geodesic = (time.perf_counter() - start) / lookups
+
+            # 道路距离不会短于直线距离
+            distances, _ = route_distances_and_times(users[0][0], users[0][1], [s[1] for s in stations],
+                                                     [s[2] for s in stations], routes)
+            straight, _ = calculate_distances_and_times(users[0][0], users[0][1], [s[1] for s in stations],
+                                                        [s[2] for s in stations])
+            assert np.all(distances >= straight - 0.6)
+            print(f"{size:>10} {len(graph.lats):>8} {load:>9.2f} {build:>10.2f} {grid.size:>7} "
+                  f"{lookup * 1e6:>12.1f} {geodesic * 1e6:>14.1f}")
+            results.append({'size': size, 'load_s': load, 'build_s': build, 'lookup_s': lookup, 'geodesic_s': geodesic})
+    return results
+
+# 查询与解析的微基准 -----------------------------------------------------
+
+def _measure(func, rounds, warmup=1):
+    # 与 pytest-benchmark 相同的统计量 (秒)：先预热，再运行 rounds 次
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    mean = statistics.fmean(samples)
+    return {
+        'min': min(samples),
+        'max': max(samples),
+        'mean': mean,
+        'median': statistics.median(samples),
+        'stddev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        'rounds': rounds,
+        'ops': 1 / mean if mean else None
+    }
+
+def _print_measurements(results):
+    print(f"{'name':<48} {'min (ms)':>10} {'median (ms)':>12} {'mean (ms)':>10} {'stddev (ms)':>12} {'ops/s':>10}")
+    for name, stats in results.items():
+        print(f"{name:<48} {stats['min'] * 1000:>10.3f} {stats['median'] * 1000:>12.3f} {stats['mean'] * 1000:>10.3f} "
+              f"{stats['stddev'] * 1000:>12.3f} {stats['ops']:>10.1f}")
+
+def bench_db(args):
+    import logging
+    logging.getLogger().setLevel(logging.WARNING)
+    rounds = args.rounds
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        db, info = generate_dataset(os.path.join(tmp, 'bench.db'), args.stations, args.subscribers, args.hours)
+        print(f"dataset: {info['stations']} stations, {info['subscribers']} subscribers, {info['hours']} hours, "
+              f"{info['history_rows']} history rows (generated in {time.perf_counter() - start:.1f}s)")
+        station = 'Station 0'
+        email = 'user0@example.com'
+        queries = {
+            'get_data_versions': db.get_data_versions,
+            'get_all_subscriptions': db.get_all_subscriptions,
+            'get_subscriptions_for_price': lambda: db.get_subscriptions_for_price('95 E10', 1.8),
+            'get_current_prices_snapshot': db.get_current_prices_snapshot,
+            'get_latest_fuel_prices': db.get_latest_fuel_prices,
+            'get_current_prices': lambda: db.get_current_prices('95 E10'),
+            'get_latest_top10_fuel_prices': lambda: db.get_latest_top10_fuel_prices('95 E10'),
+            'get_latest_top10_fuel_prices_with_locations': lambda: db.get_latest_top10_fuel_prices_with_locations('95 E10'),
+            'get_price_history': lambda: db.get_price_history('95 E10', station),
+            'get_price_stats': lambda: db.get_price_stats('95 E10'),
+            'get_station_price_stats': lambda: db.get_station_price_stats('95 E10', station),
+            'get_all_stations': db.get_all_stations,
+            'get_station_location': lambda: db.get_station_location(station),
+            'get_user_location': lambda: db.get_user_location(email),
+            'get_page(fuel_prices)': lambda: db.get_page('fuel_prices', ['fuel_type', 'station', 'price'],
+                                                         ['fuel_type', 'station'], limit=50),
+            'get_alert_state': db.get_alert_state,
+            'get_price_events_after': lambda: db.get_price_events_after(0),
+        }
+        results = {name: _measure(query, rounds) for name, query in queries.items()}
+        db.close()
+
+    # 抓取解析：与 tankille.fi 结构相同的固定页面
+    page = fixture_html('oulu', stations_per_table=40)
+    for name in PARSER_BACKENDS:
+        if lxml is None and name != 'html.parser':
+            continue
+        results[f"parse_fuel_prices[{name}]"] = _measure(lambda: parse_fuel_prices(page, name), rounds)
+    _print_measurements(results)
+    return results
+
+# Flask 路由并发负载 -----------------------------------------------------
+
+def _percentile(sorted_samples, percent):
+    # 最近秩法
+    index = max(0, min(len(sorted_samples) - 1, math.ceil(percent / 100 * len(sorted_samples)) - 1))
+    return sorted_samples[index]
+
+def bench_load(args):
+    # 进程内运行 Flask 应用：每个线程一个 Werkzeug 测试客户端，按路由统计延迟
+    import logging
+    from concurrent.futures import ThreadPoolExecutor
+
+    logging.getLogger().setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = os.path.join(tmp, 'bench.db')
+        os.environ['SNAPSHOT_DIR'] = os.path.join(tmp, 'snapshots')
+        os.environ['LOG_LEVEL'] = 'WARNING'
+        _, info = generate_dataset(os.environ['DATABASE_URL'], args.stations, args.subscribers, args.hours)
+        import api
+        app = api.create_app()
+
+        lat, lon = info['coords'][0]
+        routes = {
+            'home': '/',
+            'home_personalized': '/?email=user0@example.com',
+            'api_prices': '/api/v1/prices?limit=50',
+            'api_stations': '/api/v1/stations',
+            'api_subscriptions': '/api/v1/subscriptions?limit=100',
+            'api_nearby': f'/api/nearby?lat={lat}&lon={lon}&radius_km=10&fuel_type=95%20E10',
+            'analytics_rolling': '/api/v1/analytics/rolling?fuel_type=95%20E10',
+            'health': '/health',
+            'metrics': '/metrics',
+        }
+        local = threading.local()
+
+        def request(path):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = app.test_client()
+            start = time.perf_counter()
+            response = client.get(path)
+            elapsed = time.perf_counter() - start
+            return elapsed, response.status_code
+
+        # 预热：第一次请求会生成快照、读取历史价格、建立索引
+        for path in routes.values():
+            request(path)
+
+        print(f"{args.requests} requests per route, {args.concurrency} threads")
+        print(f"{'route':<20} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'max (ms)':>9} {'req/s':>8} {'errors':>7}")
+        results = {}
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for name, path in routes.items():
+                start = time.perf_counter()
+                outcomes = list(pool.map(request, [path] * args.requests))
+                wall = time.perf_counter() - start
+                samples = sorted(elapsed for elapsed, _ in outcomes)
+                errors = sum(1 for _, status in outcomes if status >= 400)
+                results[name] = {
+                    'path': path,
+                    'p50': _percentile(samples, 50),
+                    'p95': _percentile(samples, 95),
+                    'p99': _percentile(samples, 99),
+                    'max': samples[-1],
+                    'throughput': len(samples) / wall,
+                    'errors': errors
+                }
+                stats = results[name]
+                print(f"{name:<20} {stats['p50'] * 1000:>9.2f} {stats['p95'] * 1000:>9.2f} {stats['p99'] * 1000:>9.2f} "
+                      f"{stats['max'] * 1000:>9.2f} {stats['throughput']:>8.0f} {errors:>7}")
+        api.get_db().close()
+    return results
+
+# 热点查询的执行计划 -----------------------------------------------------
+
+def bench_plans(args):
+    # 在合成数据集上记录热点查询实际执行的 SQL，检查 EXPLAIN QUERY PLAN 中没有全表扫描 (SQLite)
+    import logging
+    logging.getLogger().setLevel(logging.WARNING)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db, _ = generate_dataset(os.path.join(tmp, 'bench.db'), args.stations, args.subscribers, args.hours)
+        # 应用的数据库不运行 ANALYZE，这里也按没有统计信息时的计划检查
+        for name, query in plan_queries(db).items():
+            plan = query_plan(db, query)
+            results[name] = {'plan': plan, 'full_scans': full_scans(plan)}
+        db.close()
+
+    failures = [name for name, result in results.items() if result['full_scans']]
+    for name, result in results.items():
+        print(f"{'FULL SCAN' if result['full_scans'] else 'ok':<10} {name:<44} {'; '.join(result['plan'])}")
+    print(f"\n{len(results) - len(failures)}/{len(results)} queries use an index")
+    return results
+
+# 结果对比 ---------------------------------------------------------------
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def _timings(results, prefix=''):
+    # 把嵌套的结果展开为 {路径: 秒}，只保留耗时类的数值
+    timing_keys = ('min', 'median', 'mean', 'p50', 'p95', 'p99', 'seconds')
+    flat = {}
+    if isinstance(results, dict):
+        for key, value in results.items():
+            path = f"{prefix}.{key}" if prefix else str(key)
+            if isinstance(value, (dict, list)):
+                flat.update(_timings(value, path))
+            elif isinstance(value, (int, float)) and (key in timing_keys or str(key).endswith('_s')):
+                flat[path] = value
+    elif isinstance(results, list):
+        for row in results:
+            label = f"{prefix}[{row.get('size')}]" if isinstance(row, dict) else prefix
+            flat.update(_timings(row, label))
+    return flat
+
+def compare_results(previous, current, threshold=0.1):
+    # 打印变化超过 threshold 的耗时 (正数为变慢)，返回变慢的项数
+    before = _timings(previous['results'])
+    after = _timings(current['results'])
+    print(f"\n== compare {previous.get('commit')} -> {current.get('commit')} ==")
+    regressions = 0
+    for key in sorted(before.keys() & after.keys()):
+        if not before[key]:
+            continue
+        change = after[key] / before[key] - 1
+        if abs(change) >= threshold:
+            regressions += change > 0
+            print(f"{key:<70} {before[key] * 1000:>10.3f} ms -> {after[key] * 1000:>10.3f} ms  {change:+.0%}")
+    return regressions
+
+BENCHMARKS = {
+    'matcher': lambda args: bench_matcher(args.sizes or [1000, 10000, 100000, 1000000]),
+    'smtp': lambda args: bench_smtp(args.sizes or [1, 2, 4, 8]),
+    'scrape': lambda args: bench_scrape(args.sizes or [1, 4, 16, 32]),
+    'parse': lambda args: bench_parse(args.sizes or [10, 40, 200, 1000]),
+    'analytics': lambda args: bench_analytics(args.sizes or [10, 100, 300, 1000]),
+    'routing': lambda args: bench_routing(args.sizes or [50, 100, 200]),
+    'db': bench_db,
+    'load': bench_load,
+    'plans': bench_plans,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fuel Price Tracker benchmarks")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS) + ['all'])
+    parser.add_argument('--sizes', type=int, nargs='*', help="Problem sizes to run")
+    parser.add_argument('--stations', type=int, default=300, help="Synthetic dataset: number of stations (db, load, plans)")
+    parser.add_argument('--subscribers', type=int, default=10000, help="Synthetic dataset: number of subscribers (db, load, plans)")
+    parser.add_argument('--hours', type=int, default=24 * 30, help="Synthetic dataset: hours of price history (db, load, plans)")
+    parser.add_argument('--rounds', type=int, default=50, help="Rounds per micro-benchmark (db)")
+    parser.add_argument('--requests', type=int, default=500, help="Requests per route (load)")
+    parser.add_argument('--concurrency', type=int, default=8, help="Client threads (load)")
+    parser.add_argument('--json', help="Write results to this JSON file")
+    parser.add_argument('--compare', help="Compare with a JSON file written by an earlier run")
+    args = parser.parse_args()
+
+    names = sorted(BENCHMARKS) if args.benchmark == 'all' else [args.benchmark]
+    report = {
+        'commit': _git_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'args': {key: value for key, value in vars(args).items() if key not in ('json', 'compare')},
+        'results': {}
+    }
+    for name in names:
+        print(f"\n== {name} ==")
+        report['results'][name] = BENCHMARKS[name](args)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.json}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare_results(json.load(f), report)
+    # plans 发现全表扫描时以非零状态退出，可以直接用在 CI 中
+    if any(result['full_scans'] for result in report['results'].get('plans', {}).values()):
+        raise SystemExit(1)
@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    # 线程安全的 LRU + TTL 缓存；条目记录写入时的数据版本，版本变化后视为失效
+    def __init__(self, maxsize=128, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, version=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at, entry_version = entry
+                if entry_version != version:
+                    del self._data[key]
+                    self.invalidations += 1
+                elif expires_at <= time.monotonic():
+                    del self._data[key]
+                    self.expirations += 1
+                else:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value, version=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl, version)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader, version=None):
+        found, value = self.get(key, version)
+        if not found:
+            value = loader()
+            self.set(key, value, version)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
@@ -1,156 +1,322 @@
-import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 import os
+import threading
+import time
+from db_backends import create_backend
+from migrations import migrate
+from price_diff import diff_prices
+from metrics import DB_METHOD_SECONDS, instrument_methods
 
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'DEBUG'))
 
 class Database:
-    _instance = None
+    # 每个数据库 URL 一个实例，每个线程使用自己的连接
+    _instances = {}
+    _instances_lock = threading.Lock()
 
-    def __new__(cls, *args, **kwargs):
-        if cls._instance is None:
-            cls._instance = super(Database, cls).__new__(cls)
-            cls._instance.conn = None
-            cls._instance.cursor = None
-        return cls._instance
+    def __new__(cls, database_url, *args, **kwargs):
+        with cls._instances_lock:
+            instance = cls._instances.get(database_url)
+            if instance is None:
+                instance = super(Database, cls).__new__(cls)
+                instance._initialized = False
+                instance._init_lock = threading.Lock()
+                cls._instances[database_url] = instance
+        return instance
 
     def __init__(self, database_url):
-        self.database_url = database_url
-        if self.conn is None:
-            logging.debug(f"Initializing database connection with URL: {self.database_url}")
-            self.conn = sqlite3.connect(self.database_url, check_same_thread=False)
-            self.cursor = self.conn.cursor()
-            self.create_tables()
-
-    def create_tables(self):
-        logging.debug("Creating tables if they don't exist")
-        self.conn.execute('''
-            CREATE TABLE IF NOT EXISTS users
-            (id INTEGER PRIMARY KEY AUTOINCREMENT,
-             email TEXT UNIQUE,
-             threshold REAL,
-             fuel_type TEXT)
-        ''')
-        
-        # 检查是否需要添加新列
-        cursor = self.conn.execute('PRAGMA table_info(users)')
-        columns = [row[1] for row in cursor.fetchall()]
-        
-        if 'latitude' not in columns:
-            self.conn.execute('ALTER TABLE users ADD COLUMN latitude REAL')
-        if 'longitude' not in columns:
-            self.conn.execute('ALTER TABLE users ADD COLUMN longitude REAL')
-        if 'address' not in columns:
-            self.conn.execute('ALTER TABLE users ADD COLUMN address TEXT')
-        
-        self.conn.execute('''
-            CREATE TABLE IF NOT EXISTS fuel_prices
-            (id INTEGER PRIMARY KEY AUTOINCREMENT,
-             fuel_type TEXT,
-             station TEXT,
-             price REAL,
-             updated TEXT,
-             timestamp DATETIME,
-             UNIQUE(fuel_type, station))
-        ''')
-        self.conn.execute('''
-            CREATE TABLE IF NOT EXISTS user_vehicles
-            (id INTEGER PRIMARY KEY AUTOINCREMENT,
-             user_email TEXT,
-             latitude REAL,
-             longitude REAL,
-             FOREIGN KEY (user_email) REFERENCES users(email))
-        ''')
+        if self._initialized:
+            return
+        with self._init_lock:
+            if self._initialized:
+                return
+            self.database_url = database_url
+            self.backend = create_backend(database_url)
+            self._local = threading.local()
+            # 本进程内的写入次数，供 data_versions 的短期缓存判断是否需要重新查询
+            self.version = 0
+            self._version_lock = threading.Lock()
+            logging.debug(f"Initializing {self.backend.name} database")
+            # 结构版本在启动时确定一次，之后的查询不再检查表结构
+            self.schema_version = migrate(self.conn, self.backend)
+            logging.info(f"Database schema at version {self.schema_version}")
+            self._initialized = True
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self.backend.connect()
+            self._local.cursor = conn.cursor()
+        return conn
+
+    @property
+    def cursor(self):
+        self.conn
+        return self._local.cursor
+
+    def release(self):
+        # 请求 (或一次后台任务) 结束时调用：把当前线程的连接归还连接池，供其他线程复用
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self.backend.release(conn):
+            self._local.conn = None
+            self._local.cursor = None
+
+    def bump_version(self):
+        with self._version_lock:
+            self.version += 1
+        return self.version
+
+    def _touch_data_version(self, resource):
+        # 与数据写入在同一事务中提交
         self.conn.execute('''
-            CREATE TABLE IF NOT EXISTS stations
-            (id INTEGER PRIMARY KEY AUTOINCREMENT,
-             name TEXT UNIQUE,
-             latitude REAL,
-             longitude REAL)
-        ''')
-        self.conn.commit()
-        logging.info("Tables created and updated successfully")
+            INSERT INTO data_versions (resource, version, updated_at) VALUES (?, 1, ?)
+            ON CONFLICT(resource) DO UPDATE SET
+                version = data_versions.version + 1,
+                updated_at = excluded.updated_at
+        ''', (resource, datetime.now().isoformat()))
+
+    def get_data_versions(self):
+        cursor = self.conn.execute('SELECT resource, version, updated_at FROM data_versions')
+        return {resource: (version, updated_at) for resource, version, updated_at in cursor.fetchall()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # 正常退出时提交，出现异常时回滚当前线程的事务
+        if exc_type is None:
+            self.conn.commit()
+        else:
+            self.conn.rollback()
+        return False
 
-    def add_user(self, email, threshold, fuel_type, latitude=None, longitude=None, address=None):
+    def add_user(self, email, threshold, fuel_type, latitude=None, longitude=None, address=None, alert_mode='instant'):
         self.conn.execute('''
-            INSERT OR REPLACE INTO users 
-            (email, threshold, fuel_type, latitude, longitude, address) 
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (email, threshold, fuel_type, latitude, longitude, address))
+            INSERT INTO users 
+            (email, threshold, fuel_type, latitude, longitude, address, alert_mode) 
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(email) DO UPDATE SET
+                threshold = excluded.threshold,
+                fuel_type = excluded.fuel_type,
+                latitude = excluded.latitude,
+                longitude = excluded.longitude,
+                address = excluded.address,
+                alert_mode = excluded.alert_mode
+        ''', (email, threshold, fuel_type, latitude, longitude, address, alert_mode))
+        # 订阅条件变化后重新开始提醒
+        self.conn.execute('DELETE FROM alert_state WHERE email = ?', (email,))
+        if alert_mode == 'instant':
+            self.conn.execute('DELETE FROM alert_digest WHERE email = ?', (email,))
+        self._touch_data_version('subscriptions')
         self.conn.commit()
+        self.bump_version()
 
     def remove_user(self, email):
         self.conn.execute('DELETE FROM users WHERE email = ?', (email,))
+        self.conn.execute('DELETE FROM alert_state WHERE email = ?', (email,))
+        self.conn.execute('DELETE FROM alert_digest WHERE email = ?', (email,))
+        self._touch_data_version('subscriptions')
         self.conn.commit()
+        self.bump_version()
 
     def get_all_subscriptions(self):
-        cursor = self.conn.execute('PRAGMA table_info(users)')
-        columns = [row[1] for row in cursor.fetchall()]
-        
-        select_columns = ['email', 'threshold', 'fuel_type']
-        if 'latitude' in columns:
-            select_columns.append('latitude')
-        if 'longitude' in columns:
-            select_columns.append('longitude')
-        if 'address' in columns:
-            select_columns.append('address')
-        
-        query = f"SELECT {', '.join(select_columns)} FROM users"
-        cursor = self.conn.execute(query)
+        # latitude / longitude / address 列由迁移保证存在
+        query = 'SELECT email, threshold, fuel_type, latitude, longitude, address FROM users'
+        cursor = self.backend.execute_prepared(self.conn, 'all_subscriptions', query, ())
+        return cursor.fetchall()
+
+    def get_subscriptions_for_price(self, fuel_type, min_price):
+        # 使用 users(fuel_type, threshold) 索引做范围查询
+        cursor = self.conn.execute('''
+            SELECT email, threshold, fuel_type, COALESCE(alert_mode, 'instant') FROM users
+            WHERE fuel_type = ? AND threshold >= ?
+            ORDER BY threshold
+        ''', (fuel_type, min_price))
         return cursor.fetchall()
 
+    def get_current_prices_snapshot(self):
+        cursor = self.conn.execute('SELECT fuel_type, station, price FROM fuel_prices')
+        return {(fuel_type, station): price for fuel_type, station, price in cursor.fetchall()}
+
     def update_fuel_prices(self, prices):
         logging.info("Updating fuel prices in database")
-        for fuel_type, price_list in prices.items():
-            for price in price_list:
-                self.cursor.execute('''
-                    INSERT OR REPLACE INTO fuel_prices 
-                    (fuel_type, station, price, updated, timestamp)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (fuel_type, price['station'], price['price'], price['updated'], price['timestamp']))
-
-        self.conn.commit()
+        changes = diff_prices(self.get_current_prices_snapshot(), prices)
+        self.apply_price_changes(changes)
         logging.info("Fuel prices updated successfully")
+        return changes
+
+    def apply_price_changes(self, changes):
+        # 只写入新增或价格变化的行，未变化的行只更新时间戳
+        rows = [
+            (entry['fuel_type'], entry['station'], entry['price'], entry['updated'], entry['timestamp'], entry.get('city'))
+            for entry in changes['new'] + changes['changed']
+        ]
+        if rows:
+            # 历史表只追加，当前价格表按 (fuel_type, station) 增量更新
+            self.cursor.executemany('''
+                INSERT INTO price_history
+                (fuel_type, station, price, updated, timestamp, city)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+            self.cursor.executemany('''
+                INSERT INTO fuel_prices
+                (fuel_type, station, price, updated, timestamp, city)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(fuel_type, station) DO UPDATE SET
+                    price = excluded.price,
+                    updated = excluded.updated,
+                    timestamp = excluded.timestamp,
+                    city = excluded.city
+            ''', rows)
+
+        timestamp_updates = [
+            (entry['timestamp'], entry['fuel_type'], entry['station'])
+            for entry in changes['unchanged']
+        ]
+        self._touch_data_version('prices')
+        # update_fuel_price_timestamps 会一并提交上面的写入
+        self.update_fuel_price_timestamps(timestamp_updates)
+        self.bump_version()
 
     def get_latest_fuel_prices(self):
         cursor = self.conn.execute('''
             SELECT fuel_type, station, price, updated
             FROM fuel_prices
-            WHERE (fuel_type, station, timestamp) IN (
-                SELECT fuel_type, station, MAX(timestamp)
-                FROM fuel_prices
-                GROUP BY fuel_type, station
-            )
         ''')
         return cursor.fetchall()
 
+    def has_fuel_prices(self):
+        cursor = self.conn.execute('SELECT 1 FROM fuel_prices LIMIT 1')
+        return cursor.fetchone() is not None
+
+    def get_current_prices(self, fuel_type):
+        cursor = self.conn.execute('''
+            SELECT station, price, updated FROM fuel_prices WHERE fuel_type = ?
+        ''', (fuel_type,))
+        return cursor.fetchall()
+
     def get_latest_top10_fuel_prices(self, fuel_type):
+        # fuel_prices 每个加油站只有一行，按 (fuel_type, timestamp) 索引取最近 10 条
         query = '''
-        WITH latest_prices AS (
-            SELECT *,
-                   ROW_NUMBER() OVER (PARTITION BY station ORDER BY timestamp DESC) as rn
+        SELECT fuel_type, station, price, updated, timestamp
+        FROM (
+            SELECT fuel_type, station, price, updated, timestamp
             FROM fuel_prices
             WHERE fuel_type = ?
-        ),
-        top_10_latest AS (
-            SELECT *
-            FROM latest_prices
-            WHERE rn = 1
             ORDER BY timestamp DESC
             LIMIT 10
-        )
-        SELECT fuel_type, station, price, updated, timestamp
-        FROM top_10_latest
+        ) AS t
         ORDER BY price ASC
-        LIMIT 10
         '''
-        self.cursor.execute(query, (fuel_type,))
-        return self.cursor.fetchall()
+        cursor = self.backend.execute_prepared(self.conn, 'latest_top10_fuel_prices', query, (fuel_type,))
+        return cursor.fetchall()
+
+    def get_latest_top10_fuel_prices_with_locations(self, fuel_type):
+        # 与 get_latest_top10_fuel_prices 相同，但一次性 JOIN 出加油站坐标，避免逐行查询
+        query = '''
+        SELECT t.fuel_type, t.station, t.price, t.updated, t.timestamp, s.latitude, s.longitude
+        FROM (
+            SELECT fuel_type, station, price, updated, timestamp
+            FROM fuel_prices
+            WHERE fuel_type = ?
+            ORDER BY timestamp DESC
+            LIMIT 10
+        ) AS t
+        LEFT JOIN stations s ON s.name = t.station
+        ORDER BY t.price ASC
+        '''
+        cursor = self.conn.execute(query, (fuel_type,))
+        return cursor.fetchall()
+
+    def get_price_history(self, fuel_type, station, days=7):
+        since = (datetime.now() - timedelta(days=days)).isoformat()
+        cursor = self.conn.execute('''
+            SELECT price, updated, timestamp
+            FROM price_history
+            WHERE fuel_type = ? AND station = ? AND timestamp >= ?
+            ORDER BY timestamp
+        ''', (fuel_type, station, since))
+        return cursor.fetchall()
+
+    def iter_price_history_rows(self, fuel_type, after_id=0, chunk_size=50000):
+        # 分析模块按 id 增量、分块读取历史价格
+        cursor = self.backend.stream_cursor(self.conn)
+        cursor.execute('''
+            SELECT id, station, city, price, timestamp
+            FROM price_history
+            WHERE fuel_type = ? AND id > ?
+            ORDER BY id
+        ''', (fuel_type, after_id))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+    def get_latest_price_history_timestamp(self, fuel_type):
+        cursor = self.conn.execute('SELECT MAX(timestamp) FROM price_history WHERE fuel_type = ?', (fuel_type,))
+        return cursor.fetchone()[0]
+
+    def iter_price_history_window(self, fuel_type, since, chunk_size=50000):
+        # 分析模块第一次读取：先返回每个加油站在 since 之前的最后一条记录 (前向填充的初始值)，再分块返回 since 之后的记录
+        cursor = self.conn.execute('''
+            SELECT h.id, h.station, h.city, h.price, h.timestamp
+            FROM fuel_prices f
+            JOIN price_history h ON h.id = (
+                SELECT id FROM price_history
+                WHERE fuel_type = f.fuel_type AND station = f.station AND timestamp < ?
+                ORDER BY timestamp DESC, id DESC
+                LIMIT 1
+            )
+            WHERE f.fuel_type = ?
+        ''', (since, fuel_type))
+        anchors = cursor.fetchall()
+        if anchors:
+            yield anchors
+        cursor = self.backend.stream_cursor(self.conn)
+        cursor.execute('''
+            SELECT id, station, city, price, timestamp
+            FROM price_history
+            WHERE fuel_type = ? AND timestamp >= ?
+            ORDER BY id
+        ''', (fuel_type, since))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+    def get_price_stats(self, fuel_type, days=7):
+        # 每个加油站在最近 N 天内的最低 / 平均 / 最高价格
+        since = (datetime.now() - timedelta(days=days)).isoformat()
+        cursor = self.conn.execute('''
+            SELECT station, MIN(price), AVG(price), MAX(price), COUNT(*)
+            FROM price_history
+            WHERE fuel_type = ? AND timestamp >= ?
+            GROUP BY station
+            ORDER BY MIN(price) ASC
+        ''', (fuel_type, since))
+        return cursor.fetchall()
+
+    def get_station_price_stats(self, fuel_type, station, days=7):
+        since = (datetime.now() - timedelta(days=days)).isoformat()
+        cursor = self.conn.execute('''
+            SELECT MIN(price), AVG(price), MAX(price), COUNT(*)
+            FROM price_history
+            WHERE fuel_type = ? AND station = ? AND timestamp >= ?
+        ''', (fuel_type, station, since))
+        return cursor.fetchone()
 
     def close(self):
-        if hasattr(self, 'conn'):
-            self.conn.close()
+        # 关闭 (或归还) 当前线程的连接，下次访问时会重新打开
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            if not self.backend.release(conn):
+                conn.close()
+            self._local.conn = None
+            self._local.cursor = None
 
     def update_fuel_price_timestamps(self, updates):
         query = """
@@ -171,7 +337,7 @@ class Database:
 
     def add_user_vehicle(self, email, latitude, longitude):
         self.conn.execute('''
-            INSERT OR REPLACE INTO user_vehicles (user_email, latitude, longitude)
+            INSERT INTO user_vehicles (user_email, latitude, longitude)
             VALUES (?, ?, ?)
         ''', (email, latitude, longitude))
         self.conn.commit()
@@ -184,10 +350,15 @@ class Database:
 
     def add_or_update_station(self, name, latitude, longitude):
         self.conn.execute('''
-            INSERT OR REPLACE INTO stations (name, latitude, longitude)
+            INSERT INTO stations (name, latitude, longitude)
             VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                latitude = excluded.latitude,
+                longitude = excluded.longitude
         ''', (name, latitude, longitude))
+        self._touch_data_version('stations')
         self.conn.commit()
+        self.bump_version()
 
     def get_station_location(self, name):
         cursor = self.conn.execute('''
@@ -204,16 +375,358 @@ class Database:
         cursor = self.conn.execute('SELECT name, latitude, longitude FROM stations')
         return cursor.fetchall()
 
+    def get_stations_missing_location(self, limit=100):
+        # 抓取到的加油站中还没有坐标的
+        cursor = self.conn.execute('''
+            SELECT f.station, MAX(f.city) FROM fuel_prices f
+            LEFT JOIN stations s ON s.name = f.station
+            WHERE s.latitude IS NULL OR s.longitude IS NULL
+            GROUP BY f.station
+            LIMIT ?
+        ''', (limit,))
+        return cursor.fetchall()
+
+    def get_geocode(self, kind, query_key):
+        cursor = self.conn.execute('''
+            SELECT latitude, longitude, address, found, created_at FROM geocode_cache
+            WHERE kind = ? AND query_key = ?
+        ''', (kind, query_key))
+        return cursor.fetchone()
+
+    def put_geocode(self, kind, query_key, result):
+        latitude, longitude, address = result if result else (None, None, None)
+        self.conn.execute('''
+            INSERT INTO geocode_cache (kind, query_key, latitude, longitude, address, found, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(kind, query_key) DO UPDATE SET
+                latitude = excluded.latitude,
+                longitude = excluded.longitude,
+                address = excluded.address,
+                found = excluded.found,
+                created_at = excluded.created_at
+        ''', (kind, query_key, latitude, longitude, address, 1 if result else 0, datetime.now().isoformat()))
+        self.conn.commit()
+
+    def reserve_rate_limit_slot(self, name, interval):
+        # 原子地占用下一个时间片，返回可以开始调用的时间 (Unix 时间戳)；所有进程共享同一个 name 的限速
+        now = time.time()
+        cursor = self.conn.execute('''
+            INSERT INTO rate_limits (name, next_at) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                next_at = CASE WHEN rate_limits.next_at > ? THEN rate_limits.next_at ELSE ? END + ?
+            RETURNING next_at
+        ''', (name, now + interval, now, now, interval))
+        next_at = cursor.fetchone()[0]
+        self.conn.commit()
+        return next_at - interval
+
     def update_user_location(self, email, latitude, longitude, address):
         self.conn.execute('''
             UPDATE users 
             SET latitude = ?, longitude = ?, address = ?
             WHERE email = ?
         ''', (latitude, longitude, address, email))
+        self._touch_data_version('subscriptions')
         self.conn.commit()
+        self.bump_version()
+
+    def get_page(self, table, columns, key_columns, filters=None, after=None, limit=50):
+        # 键集分页：按 key_columns 排序，从上一页最后一行的键之后开始读取
+        # table / columns 只能来自调用方的白名单，不能直接使用用户输入
+        select_columns = list(columns) + [column for column in key_columns if column not in columns]
+        conditions = []
+        params = []
+        for column, value in (filters or {}).items():
+            conditions.append(f"{column} = ?")
+            params.append(value)
+        if after:
+            conditions.append(f"({', '.join(key_columns)}) > ({', '.join(['?'] * len(key_columns))})")
+            params.extend(after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        cursor = self.conn.execute(f'''
+            SELECT {', '.join(select_columns)} FROM {table}
+            {where}
+            ORDER BY {', '.join(key_columns)}
+            LIMIT ?
+        ''', params + [limit])
+        return select_columns, cursor.fetchall()
+
+    def iter_rows(self, table, columns, filters=None, time_column=None, since=None, until=None, chunk_size=1000):
+        # 分块读取，每次最多 chunk_size 行；table / columns 只能来自白名单
+        conditions = []
+        params = []
+        for column, value in (filters or {}).items():
+            conditions.append(f"{column} = ?")
+            params.append(value)
+        if time_column and since:
+            conditions.append(f"{time_column} >= ?")
+            params.append(since)
+        if time_column and until:
+            conditions.append(f"{time_column} < ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        cursor = self.backend.stream_cursor(self.conn)
+        cursor.execute(f"SELECT {', '.join(columns)} FROM {table} {where}", params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
 
     def get_user_location(self, email):
         cursor = self.conn.execute('''
             SELECT latitude, longitude, address FROM users WHERE email = ?
         ''', (email,))
-        return cursor.fetchone()
\ No newline at end of file
+        return cursor.fetchone()
+
+    def _insert_outbox(self, messages, now):
+        # messages: [(to_email, subject, body), ...]，由调用方提交
+        self.cursor.executemany('''
+            INSERT INTO email_outbox (to_email, subject, body, status, attempts, next_attempt_at, created_at)
+            VALUES (?, ?, ?, 'pending', 0, ?, ?)
+        ''', [(to_email, subject, body, now, now) for to_email, subject, body in messages])
+
+    def enqueue_emails(self, messages):
+        self._insert_outbox(messages, datetime.now().isoformat())
+        self.conn.commit()
+
+    def get_alert_state(self):
+        # 返回 {(email, fuel_type, station): 上次提醒时的价格}
+        cursor = self.conn.execute('SELECT email, fuel_type, station, price FROM alert_state')
+        return {(email, fuel_type, station): price for email, fuel_type, station, price in cursor.fetchall()}
+
+    def record_alerts(self, messages, digest_alerts, alerted, cleared):
+        # 一次抓取的提醒在同一事务中写入：instant 邮件进发件箱、daily / weekly 提醒进汇总表、更新去重状态；
+        # 中途失败时全部回滚，不会出现邮件已排队但状态未更新 (下次重复提醒) 或相反的情况
+        # digest_alerts: [(email, fuel_type, station, price, threshold, updated), ...]
+        # alerted: [(email, fuel_type, station, price), ...] 本次提醒的价格
+        # cleared: [(email, fuel_type, station), ...] 不再满足阈值的加油站，之后再满足时重新提醒
+        now = datetime.now().isoformat()
+        with self:
+            if messages:
+                self._insert_outbox(messages, now)
+            if digest_alerts:
+                # 同一加油站在汇总发送前多次降价时只保留最低价格
+                self.cursor.executemany('''
+                    INSERT INTO alert_digest (email, fuel_type, station, price, threshold, updated, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(email, fuel_type, station) DO UPDATE SET
+                        price = excluded.price,
+                        threshold = excluded.threshold,
+                        updated = excluded.updated
+                    WHERE excluded.price < alert_digest.price
+                ''', [row + (now,) for row in digest_alerts])
+            if alerted:
+                self.cursor.executemany('''
+                    INSERT INTO alert_state (email, fuel_type, station, price, alerted_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(email, fuel_type, station) DO UPDATE SET
+                        price = excluded.price,
+                        alerted_at = excluded.alerted_at
+                ''', [row + (now,) for row in alerted])
+            if cleared:
+                self.cursor.executemany('''
+                    DELETE FROM alert_state WHERE email = ? AND fuel_type = ? AND station = ?
+                ''', cleared)
+
+    def get_digest_alerts(self, alert_mode):
+        cursor = self.conn.execute('''
+            SELECT d.email, d.fuel_type, d.station, d.price, d.threshold, d.updated
+            FROM alert_digest d
+            JOIN users u ON u.email = d.email
+            WHERE u.alert_mode = ?
+            ORDER BY d.email, d.fuel_type, d.price
+        ''', (alert_mode,))
+        return cursor.fetchall()
+
+    def enqueue_digest_emails(self, messages, alerts):
+        # 汇总邮件写入发件箱，同时删除已汇总的提醒 (同一事务)；
+        # 期间又有更低价格写入的提醒价格不同，不会被删除，留到下一次汇总
+        self._insert_outbox(messages, datetime.now().isoformat())
+        self.cursor.executemany('''
+            DELETE FROM alert_digest WHERE email = ? AND fuel_type = ? AND station = ? AND price = ?
+        ''', [tuple(alert[:4]) for alert in alerts])
+        self.conn.commit()
+
+    def claim_pending_emails(self, limit):
+        # 取出到期的待发送邮件并标记为发送中
+        now = datetime.now().isoformat()
+        cursor = self.conn.execute('''
+            SELECT id, to_email, subject, body, attempts FROM email_outbox
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY next_attempt_at
+            LIMIT ?
+        ''', (now, limit))
+        rows = cursor.fetchall()
+        self.conn.executemany("UPDATE email_outbox SET status = 'sending' WHERE id = ?",
+                              [(row[0],) for row in rows])
+        self.conn.commit()
+        return rows
+
+    def mark_email_sent(self, email_id):
+        self.conn.execute('''
+            UPDATE email_outbox SET status = 'sent', attempts = attempts + 1, sent_at = ?, last_error = NULL
+            WHERE id = ?
+        ''', (datetime.now().isoformat(), email_id))
+        self.conn.commit()
+
+    def reschedule_email(self, email_id, next_attempt_at, error):
+        self.conn.execute('''
+            UPDATE email_outbox SET status = 'pending', attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+            WHERE id = ?
+        ''', (next_attempt_at.isoformat(), error, email_id))
+        self.conn.commit()
+
+    def mark_email_failed(self, email_id, error):
+        self.conn.execute('''
+            UPDATE email_outbox SET status = 'failed', attempts = attempts + 1, last_error = ?
+            WHERE id = ?
+        ''', (error, email_id))
+        self.conn.commit()
+
+    def requeue_interrupted_emails(self):
+        # 进程重启时，把上次未完成的发送重新放回队列
+        cursor = self.conn.execute("UPDATE email_outbox SET status = 'pending' WHERE status = 'sending'")
+        self.conn.commit()
+        return cursor.rowcount
+
+    def try_acquire_lease(self, name, owner, ttl):
+        # 租约不存在、已过期或本来就属于 owner 时获取 (续约)，返回是否持有租约
+        now = datetime.now()
+        self.conn.execute('''
+            INSERT INTO job_leases (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                owner = excluded.owner,
+                expires_at = excluded.expires_at
+            WHERE job_leases.owner = excluded.owner OR job_leases.expires_at < ?
+        ''', (name, owner, (now + timedelta(seconds=ttl)).isoformat(), now.isoformat()))
+        self.conn.commit()
+        cursor = self.conn.execute('SELECT owner FROM job_leases WHERE name = ?', (name,))
+        row = cursor.fetchone()
+        return row is not None and row[0] == owner
+
+    def release_lease(self, name, owner):
+        self.conn.execute('DELETE FROM job_leases WHERE name = ? AND owner = ?', (name, owner))
+        self.conn.commit()
+
+    def get_lease(self, name):
+        cursor = self.conn.execute('SELECT owner, expires_at FROM job_leases WHERE name = ?', (name,))
+        return cursor.fetchone()
+
+    def record_job_run(self, job_name, owner, started_at, finished_at, status,
+                       rows_written=0, emails_queued=0, emails_sent=0, error=None):
+        self.conn.execute('''
+            INSERT INTO job_runs
+            (job_name, owner, started_at, finished_at, duration_seconds, status,
+             rows_written, emails_queued, emails_sent, error)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (job_name, owner, started_at.isoformat(), finished_at.isoformat(),
+              (finished_at - started_at).total_seconds(), status,
+              rows_written, emails_queued, emails_sent, error))
+        self.conn.commit()
+
+    def get_job_runs(self, job_name=None, limit=50):
+        if job_name:
+            cursor = self.conn.execute('''
+                SELECT job_name, owner, started_at, finished_at, duration_seconds, status,
+                       rows_written, emails_queued, emails_sent, error
+                FROM job_runs WHERE job_name = ? ORDER BY started_at DESC LIMIT ?
+            ''', (job_name, limit))
+        else:
+            cursor = self.conn.execute('''
+                SELECT job_name, owner, started_at, finished_at, duration_seconds, status,
+                       rows_written, emails_queued, emails_sent, error
+                FROM job_runs ORDER BY started_at DESC LIMIT ?
+            ''', (limit,))
+        return cursor.fetchall()
+
+    def get_price_baselines(self):
+        cursor = self.conn.execute('SELECT fuel_type, station, recent FROM price_baselines')
+        return {
+            (fuel_type, station): [float(price) for price in recent.split(',') if price]
+            for fuel_type, station, recent in cursor.fetchall()
+        }
+
+    def save_price_baselines(self, baselines):
+        # baselines: {(fuel_type, station): [price, ...]}
+        now = datetime.now().isoformat()
+        self.cursor.executemany('''
+            INSERT INTO price_baselines (fuel_type, station, recent, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(fuel_type, station) DO UPDATE SET
+                recent = excluded.recent,
+                updated_at = excluded.updated_at
+        ''', [(fuel_type, station, ','.join(repr(price) for price in recent), now)
+              for (fuel_type, station), recent in baselines.items()])
+        self.conn.commit()
+
+    def quarantine_prices(self, outliers):
+        now = datetime.now().isoformat()
+        self.cursor.executemany('''
+            INSERT INTO price_quarantine
+            (fuel_type, station, city, price, updated, timestamp, reason, score, baseline, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(entry['fuel_type'], entry['station'], entry.get('city'), entry['price'], entry['updated'],
+               entry['timestamp'], entry['reason'], entry['score'], entry['baseline'], now)
+              for entry in outliers])
+        self.conn.commit()
+
+    def get_quarantined_prices(self, limit=100):
+        cursor = self.conn.execute('''
+            SELECT fuel_type, station, city, price, updated, timestamp, reason, score, baseline, created_at
+            FROM price_quarantine ORDER BY created_at DESC LIMIT ?
+        ''', (limit,))
+        return cursor.fetchall()
+
+    def publish_price_events(self, changes, retention=timedelta(days=2)):
+        # 把一次抓取的新增/变化价格写成事件，并清理过期事件
+        now = datetime.now()
+        rows = [
+            (kind, entry['fuel_type'], entry['station'], entry.get('city'),
+             entry.get('old_price'), entry['price'], entry['updated'], now.isoformat())
+            for kind in ('new', 'changed')
+            for entry in changes[kind]
+        ]
+        if rows:
+            self.cursor.executemany('''
+                INSERT INTO price_events
+                (kind, fuel_type, station, city, old_price, price, updated, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+        self.conn.execute('DELETE FROM price_events WHERE created_at < ?', ((now - retention).isoformat(),))
+        self.conn.commit()
+        return len(rows)
+
+    def get_price_events_after(self, last_id, limit=500):
+        cursor = self.conn.execute('''
+            SELECT id, kind, fuel_type, station, city, old_price, price, updated, created_at
+            FROM price_events WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, limit))
+        return cursor.fetchall()
+
+    def get_last_price_event_id(self):
+        cursor = self.conn.execute('SELECT MAX(id) FROM price_events')
+        return cursor.fetchone()[0] or 0
+
+# 每个公开方法的耗时记录到 fuel_db_method_seconds{method=...}
+instrument_methods(Database, DB_METHOD_SECONDS)
+
+def get_db():
+    # 当前进程共享的数据库实例 (Web 进程和 job runner 都通过它访问数据库)
+    database_url = os.getenv('DATABASE_URL')
+    if not database_url:
+        raise ValueError("DATABASE_URL environment variable is not set")
+    return Database(database_url)
+
+def get_db_if_ready():
+    # 不触发建表：实例还没有创建或建表 (迁移) 还没有完成时返回 None，供 /health、/ready 使用
+    database_url = os.getenv('DATABASE_URL')
+    instance = Database._instances.get(database_url) if database_url else None
+    return instance if instance is not None and instance._initialized else None
+
+def release_db():
+    # 把当前线程的连接归还连接池：请求结束时，以及后台线程每次任务 / 轮询结束后调用，
+    # 避免长期运行的线程一直占用连接
+    db = get_db_if_ready()
+    if db is not None:
+        db.release()
@@ -0,0 +1,260 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import uuid
+import weakref
+from urllib.parse import urlparse
+
+# 每个连接打开时执行的 PRAGMA：WAL 模式下读操作不会被每小时的写入阻塞
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-20000',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA busy_timeout=5000',
+]
+
+class SQLiteBackend:
+    name = 'sqlite'
+    # 结构迁移 (migrations.py) 中使用的列类型
+    types = {
+        'pk': 'INTEGER PRIMARY KEY AUTOINCREMENT',
+        'real': 'REAL',
+        'datetime': 'DATETIME',
+    }
+
+    def __init__(self, database_url, pool_size=8):
+        # 兼容 sqlite:///path 形式的 URL 和直接的文件路径
+        if database_url.startswith('sqlite:///'):
+            database_url = database_url[len('sqlite:///'):]
+        self.path = database_url
+        # 请求结束时归还的连接最多保留 pool_size 个，之后的请求直接复用，不必重新打开和执行 PRAGMA
+        self.pool_size = pool_size
+        self._idle = []
+        self._idle_lock = threading.Lock()
+
+    def connect(self):
+        with self._idle_lock:
+            if self._idle:
+                return self._idle.pop()
+        # 连接会在线程之间传递 (归还后被其他请求线程取出)，但同一时间只被一个线程使用
+        conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        logging.debug(f"Opened SQLite connection for thread {threading.current_thread().name}")
+        return conn
+
+    def release(self, conn):
+        # 回滚未提交的事务后放回空闲列表，空闲列表已满时关闭连接
+        conn.rollback()
+        with self._idle_lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return True
+        conn.close()
+        return True
+
+    def table_columns(self, conn, table):
+        cursor = conn.execute(f'PRAGMA table_info({table})')
+        return [row[1] for row in cursor.fetchall()]
+
+    def add_column(self, conn, table, column, column_type):
+        if column not in self.table_columns(conn, table):
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+
+    def user_version(self, conn):
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+
+    def set_user_version(self, conn, version):
+        conn.execute(f'PRAGMA user_version = {int(version)}')
+
+    def begin_schema_change(self, conn):
+        # 立即获取写锁，其他进程的迁移在 busy_timeout 内等待
+        conn.execute('BEGIN IMMEDIATE')
+
+    def stream_cursor(self, conn):
+        # sqlite3 游标按需逐步读取结果，fetchmany 不会把整个结果集读入内存
+        return conn.cursor()
+
+    def execute_prepared(self, conn, name, sql, params):
+        # sqlite3 模块自带语句缓存，直接执行即可
+        return conn.execute(sql, params)
+
+    def close(self):
+        with self._idle_lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+_VALUES_PATTERN = re.compile(r'VALUES\s*(\((?:\s*\?\s*,?)+\))', re.IGNORECASE)
+
+def _to_pyformat(sql):
+    # 把 sqlite 风格的 ? 占位符转换为 psycopg2 的 %s
+    return sql.replace('%', '%%').replace('?', '%s')
+
+class PostgresCursor:
+    # 提供与 sqlite3 游标相同的用法 (? 占位符、executemany)
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        if params:
+            self._cursor.execute(_to_pyformat(sql), params)
+        else:
+            self._cursor.execute(sql)
+        return self
+
+    def executemany(self, sql, rows):
+        from psycopg2.extras import execute_batch, execute_values
+
+        rows = list(rows)
+        if not rows:
+            return self
+        match = _VALUES_PATTERN.search(sql)
+        if match:
+            # INSERT ... VALUES 使用 execute_values 合并成一条多行插入
+            template = _to_pyformat(match.group(1))
+            statement = _to_pyformat(sql[:match.start(1)]) + '%s' + _to_pyformat(sql[match.end(1):])
+            execute_values(self._cursor, statement, rows, template=template, page_size=500)
+        else:
+            execute_batch(self._cursor, _to_pyformat(sql), rows, page_size=500)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+class PostgresConnection:
+    # 包装 psycopg2 连接，使 Database 中的代码可以像使用 sqlite3 一样调用 execute
+    def __init__(self, conn, prepared):
+        self.raw = conn
+        # 已在 raw 连接上 PREPARE 过的语句名，由后端按 raw 连接保存，连接归还后再取出时仍然有效
+        self.prepared = prepared
+
+    def cursor(self):
+        return PostgresCursor(self.raw.cursor())
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, rows):
+        return self.cursor().executemany(sql, rows)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+# 结构迁移使用的咨询锁编号
+SCHEMA_LOCK_ID = 720301
+
+class PostgresBackend:
+    name = 'postgresql'
+    types = {
+        'pk': 'SERIAL PRIMARY KEY',
+        'real': 'DOUBLE PRECISION',
+        'datetime': 'TEXT',
+    }
+
+    def __init__(self, database_url, minconn=1, maxconn=10, timeout=30):
+        from psycopg2.pool import ThreadedConnectionPool
+
+        # psycopg2 归还连接时只保留 minconn 个空闲连接，其余直接关闭
+        self.pool = ThreadedConnectionPool(minconn, maxconn, dsn=database_url)
+        # 连接全部被占用时 getconn 会直接抛出 PoolError，这里改为最多等待 timeout 秒
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(maxconn)
+        # raw 连接 -> 已准备的语句名；连接被连接池关闭并回收后自动删除
+        self._prepared = weakref.WeakKeyDictionary()
+        self._prepared_lock = threading.Lock()
+
+    def connect(self):
+        from psycopg2.pool import PoolError
+
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolError(f"no database connection available after {self.timeout}s")
+        try:
+            raw = self.pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._prepared_lock:
+            prepared = self._prepared.setdefault(raw, set())
+        conn = PostgresConnection(raw, prepared)
+        logging.debug(f"Checked out PostgreSQL connection for thread {threading.current_thread().name}")
+        return conn
+
+    def release(self, conn):
+        # 归还连接池，未提交的事务会被回滚
+        try:
+            self.pool.putconn(conn.raw)
+        finally:
+            self._slots.release()
+        return True
+
+    def table_columns(self, conn, table):
+        cursor = conn.execute('''
+            SELECT column_name FROM information_schema.columns
+            WHERE table_name = ? ORDER BY ordinal_position
+        ''', (table,))
+        return [row[0] for row in cursor.fetchall()]
+
+    def add_column(self, conn, table, column, column_type):
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {column_type}')
+
+    def user_version(self, conn):
+        # PostgreSQL 没有 user_version，结构版本只记录在 schema_version 表
+        return None
+
+    def set_user_version(self, conn, version):
+        pass
+
+    def begin_schema_change(self, conn):
+        # 事务级咨询锁，提交或回滚时自动释放
+        conn.execute('SELECT pg_advisory_xact_lock(?)', (SCHEMA_LOCK_ID,))
+
+    def stream_cursor(self, conn):
+        # psycopg2 普通游标会一次取回全部结果，流式读取需要服务端命名游标
+        return PostgresCursor(conn.raw.cursor(name=f"stream_{uuid.uuid4().hex}"))
+
+    def execute_prepared(self, conn, name, sql, params):
+        # 热点查询在每个连接上只 PREPARE 一次，之后用 EXECUTE 调用
+        if name not in conn.prepared:
+            counter = iter(range(1, len(params) + 1))
+            statement = re.sub(r'\?', lambda _: f'${next(counter)}', sql)
+            conn.raw.cursor().execute(f'PREPARE {name} AS {statement}')
+            conn.prepared.add(name)
+        placeholders = ', '.join(['?'] * len(params))
+        return conn.execute(f'EXECUTE {name} ({placeholders})' if params else f'EXECUTE {name}', params)
+
+    def close(self):
+        self.pool.closeall()
+
+def create_backend(database_url):
+    # 根据 URL 协议选择数据库后端，没有协议时按 SQLite 文件路径处理
+    scheme = urlparse(database_url).scheme
+    if scheme in ('postgres', 'postgresql'):
+        return PostgresBackend(database_url,
+                               minconn=int(os.getenv('DB_POOL_MIN', '2')),
+                               maxconn=int(os.getenv('DB_POOL_SIZE', '10')),
+                               timeout=float(os.getenv('DB_POOL_TIMEOUT', '30')))
+    return SQLiteBackend(database_url, pool_size=int(os.getenv('DB_POOL_SIZE', '8')))
@@ -1,21 +1,39 @@
-from geopy.distance import geodesic
+import numpy as np
 from geopy.geocoders import Nominatim
 
-def calculate_distance_and_time(user_lat, user_lon, station_lat, station_lon):
-    user_coords = (user_lat, user_lon)
-    station_coords = (station_lat, station_lon)
-    distance = geodesic(user_coords, station_coords).kilometers
+# 地球平均半径 (km)
+EARTH_RADIUS_KM = 6371.0088
+# 假设平均速度为 50 km/h
+AVERAGE_SPEED_KMH = 50
+
+def calculate_distances_and_times(user_lat, user_lon, station_lats, station_lons):
+    # 一次性计算用户到一组加油站的距离 (haversine) 和行驶时间
+    # 缺少坐标的加油站 (None) 返回 NaN
+    station_lats = np.radians(np.asarray(station_lats, dtype=float))
+    station_lons = np.radians(np.asarray(station_lons, dtype=float))
+    user_lat = np.radians(user_lat)
+    user_lon = np.radians(user_lon)
+
+    dlat = station_lats - user_lat
+    dlon = station_lons - user_lon
+    a = np.sin(dlat / 2) ** 2 + np.cos(user_lat) * np.cos(station_lats) * np.sin(dlon / 2) ** 2
+    distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    times = distances / AVERAGE_SPEED_KMH * 60
 
-    # 假设平均速度为 50 km/h
-    time_hours = distance / 50
-    time_minutes = time_hours * 60
+    return np.round(distances, 2), np.round(times, 2)
+
+def calculate_distance_and_time(user_lat, user_lon, station_lat, station_lon):
+    distances, times = calculate_distances_and_times(user_lat, user_lon, [station_lat], [station_lon])
 
     return {
-        'distance': round(distance, 2),
-        'time_minutes': round(time_minutes, 2)
+        'distance': float(distances[0]),
+        'time_minutes': float(times[0])
     }
 
-def get_address(lat, lon):
+def get_address(lat, lon, geocoder=None):
+    # 传入 geocoder.GeocodeCache 时使用带缓存的反向地理编码
+    if geocoder is not None:
+        return geocoder.reverse(lat, lon) or "Unknown"
     geolocator = Nominatim(user_agent="fuel_price_tracker")
     location = geolocator.reverse(f"{lat}, {lon}")
-    return location.address if location else "Unknown"
\ No newline at end of file
+    return location.address if location else "Unknown"
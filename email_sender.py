@@ -1,23 +1,33 @@
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+import logging
 import os
+import queue
 import ssl
+import threading
+import time
+from contextlib import contextmanager
+from metrics import SMTP_SEND_SECONDS
 
-def send_email(to_email, subject, message):
-    smtp_server = os.getenv('SMTP_SERVER')
-    smtp_port = int(os.getenv('SMTP_PORT'))
-    smtp_username = os.getenv('SMTP_USERNAME')
-    smtp_password = os.getenv('SMTP_PASSWORD')
-
+def build_message(from_email, to_email, subject, message):
     # 创建邮件
     msg = MIMEMultipart()
-    msg['From'] = smtp_username
+    msg['From'] = from_email
     msg['To'] = to_email
     msg['Subject'] = subject
 
     # 添加邮件正文
     msg.attach(MIMEText(message, 'plain'))
+    return msg
+
+def send_email(to_email, subject, message):
+    smtp_server = os.getenv('SMTP_SERVER')
+    smtp_port = int(os.getenv('SMTP_PORT'))
+    smtp_username = os.getenv('SMTP_USERNAME')
+    smtp_password = os.getenv('SMTP_PASSWORD')
+
+    msg = build_message(smtp_username, to_email, subject, message)
 
     try:
         # 使用SSL连接到SMTP服务器
@@ -29,4 +39,108 @@ def send_email(to_email, subject, message):
         return True
     except Exception as e:
         print(f"Failed to send email: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+class SMTPConnectionPool:
+    # 保持少量已登录的 SMTP 连接，避免每封邮件都重新握手和登录
+    def __init__(self, host, port, username, password, size=4, use_ssl=True, timeout=30, max_idle=60):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+
+    def _connect(self):
+        if self.use_ssl:
+            context = ssl.create_default_context()
+            server = smtplib.SMTP_SSL(self.host, self.port, context=context, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.username:
+            server.login(self.username, self.password)
+        logging.debug(f"Opened SMTP connection to {self.host}:{self.port}")
+        return server
+
+    @staticmethod
+    def _discard(server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def _checkout(self):
+        while True:
+            try:
+                server, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - last_used < self.max_idle:
+                return server
+            # 空闲太久的连接可能已被服务器断开，先检查一下
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._discard(server)
+
+    @contextmanager
+    def connection(self):
+        if self._closed:
+            raise RuntimeError("SMTP connection pool is closed")
+        self._slots.acquire()
+        server = None
+        try:
+            server = self._checkout()
+            yield server
+        except Exception:
+            # 出错的连接不再复用
+            if server is not None:
+                self._discard(server)
+            server = None
+            raise
+        finally:
+            if server is not None:
+                if self._closed:
+                    self._discard(server)
+                else:
+                    self._idle.put((server, time.monotonic()))
+            self._slots.release()
+
+    def send(self, to_email, subject, message):
+        msg = build_message(self.username, to_email, subject, message)
+        start = time.perf_counter()
+        result = 'error'
+        try:
+            with self.connection() as server:
+                server.send_message(msg)
+            result = 'ok'
+        finally:
+            SMTP_SEND_SECONDS.observe(time.perf_counter() - start, result)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(server)
+
+def pool_from_env(size=None):
+    return SMTPConnectionPool(
+        os.getenv('SMTP_SERVER'),
+        int(os.getenv('SMTP_PORT', '465')),
+        os.getenv('SMTP_USERNAME'),
+        os.getenv('SMTP_PASSWORD'),
+        size=size or int(os.getenv('SMTP_POOL_SIZE', '4')),
+        use_ssl=os.getenv('SMTP_USE_SSL', '1') == '1'
+    )
@@ -0,0 +1,206 @@
+import csv
+import html
+import io
+import json
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# 可导出的表：列及其类型 (用于 Arrow / Parquet)，以及可用于过滤的列
+EXPORT_TABLES = {
+    'fuel_prices': {
+        'columns': [('id', 'int'), ('fuel_type', 'str'), ('station', 'str'), ('price', 'float'),
+                    ('updated', 'str'), ('timestamp', 'str'), ('city', 'str')],
+        'fuel_type': True,
+        'time_column': 'timestamp',
+    },
+    'price_history': {
+        'columns': [('id', 'int'), ('fuel_type', 'str'), ('station', 'str'), ('price', 'float'),
+                    ('updated', 'str'), ('timestamp', 'str'), ('city', 'str')],
+        'fuel_type': True,
+        'time_column': 'timestamp',
+    },
+    'stations': {
+        'columns': [('id', 'int'), ('name', 'str'), ('latitude', 'float'), ('longitude', 'float')],
+        'fuel_type': False,
+        'time_column': None,
+    },
+    'users': {
+        'columns': [('id', 'int'), ('email', 'str'), ('threshold', 'float'), ('fuel_type', 'str'),
+                    ('latitude', 'float'), ('longitude', 'float'), ('address', 'str')],
+        'fuel_type': True,
+        'time_column': None,
+    },
+    'user_vehicles': {
+        'columns': [('id', 'int'), ('user_email', 'str'), ('latitude', 'float'), ('longitude', 'float')],
+        'fuel_type': False,
+        'time_column': None,
+    },
+    'email_outbox': {
+        'columns': [('id', 'int'), ('to_email', 'str'), ('subject', 'str'), ('status', 'str'),
+                    ('attempts', 'int'), ('next_attempt_at', 'str'), ('last_error', 'str'),
+                    ('created_at', 'str'), ('sent_at', 'str')],
+        'fuel_type': False,
+        'time_column': 'created_at',
+    },
+}
+
+# Parquet 每个 row group 的行数：缓冲这么多行，换取与表大小无关的元数据内存
+PARQUET_ROW_GROUP_ROWS = 16384
+
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'html': ('text/html; charset=utf-8', 'html'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+def iter_table_chunks(db, table, fuel_type=None, since=None, until=None, chunk_size=1000):
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown table: {table}")
+    spec = EXPORT_TABLES[table]
+    if fuel_type and not spec['fuel_type']:
+        raise ValueError(f"Table {table} cannot be filtered by fuel type")
+    if (since or until) and not spec['time_column']:
+        raise ValueError(f"Table {table} cannot be filtered by time")
+    columns = [name for name, _ in spec['columns']]
+    filters = {'fuel_type': fuel_type} if fuel_type else None
+    return columns, db.iter_rows(table, columns, filters, spec['time_column'], since, until, chunk_size)
+
+def _drain(buffer):
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+def stream_csv(columns, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield _drain(buffer)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield _drain(buffer)
+
+def stream_ndjson(columns, chunks):
+    for rows in chunks:
+        yield "".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows)
+
+def stream_html(tables):
+    # tables: [(table_name, columns, chunks), ...]，逐块输出 HTML 表格
+    yield """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Database Data</title>
+    <style>
+        table { border-collapse: collapse; width: 100%; margin-bottom: 20px; }
+        th, td { border: 1px solid #ddd; padding: 8px; text-align: left; }
+        th { background-color: #f2f2f2; }
+    </style>
+</head>
+<body>
+    <h1>Database Data</h1>
+"""
+    for table_name, columns, chunks in tables:
+        yield f"<h2>{html.escape(table_name)}</h2>\n<table>\n<tr>"
+        yield "".join(f"<th>{html.escape(column)}</th>" for column in columns) + "</tr>\n"
+        for rows in chunks:
+            yield "".join(
+                "<tr>" + "".join(f"<td>{html.escape(str(cell))}</td>" for cell in row) + "</tr>\n"
+                for row in rows
+            )
+        yield "</table>\n"
+    yield "</body>\n</html>\n"
+
+class _ChunkSink(io.RawIOBase):
+    # 只追加写入的输出流，写入的数据在每个批次后取出并发送给客户端
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def _arrow_schema(table):
+    types = {'int': pa.int64(), 'float': pa.float64(), 'str': pa.string()}
+    return pa.schema([(name, types[column_type]) for name, column_type in EXPORT_TABLES[table]['columns']])
+
+def _record_batch(schema, rows):
+    columns = list(zip(*rows))
+    arrays = []
+    for column, field in zip(columns, schema):
+        if field.type == pa.string():
+            # SQLite 列没有强类型，文本列中可能混有数字
+            column = [value if value is None or isinstance(value, str) else str(value) for value in column]
+        arrays.append(pa.array(column, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def stream_arrow(table, chunks):
+    schema = _arrow_schema(table)
+    sink = _ChunkSink()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        yield sink.drain()
+        for rows in chunks:
+            writer.write_batch(_record_batch(schema, rows))
+            yield sink.drain()
+    yield sink.drain()
+
+def stream_parquet(table, chunks, row_group_rows=None):
+    # 数据块累积到 row_group_rows 行 (默认 PARQUET_ROW_GROUP_ROWS) 后写成一个 row group，文件尾在最后写出
+    # ParquetWriter 在关闭前保留每个 row group 的元数据，每个数据块一个 row group 时内存随行数增长
+    row_group_rows = row_group_rows or PARQUET_ROW_GROUP_ROWS
+    schema = _arrow_schema(table)
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        batches = []
+        pending = 0
+        for rows in chunks:
+            batches.append(_record_batch(schema, rows))
+            pending += len(rows)
+            if pending >= row_group_rows:
+                writer.write_table(pa.Table.from_batches(batches))
+                batches = []
+                pending = 0
+                yield sink.drain()
+        if batches:
+            writer.write_table(pa.Table.from_batches(batches))
+    yield sink.drain()
+
+def stream_export(db, table, export_format, fuel_type=None, since=None, until=None, chunk_size=1000):
+    # 返回 (mimetype, 文件扩展名, 生成器)
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown format: {export_format}")
+    if export_format in ('arrow', 'parquet') and pa is None:
+        raise ValueError(f"pyarrow is required for {export_format} export")
+    columns, chunks = iter_table_chunks(db, table, fuel_type, since, until, chunk_size)
+    mimetype, extension = FORMATS[export_format]
+    if export_format == 'csv':
+        body = stream_csv(columns, chunks)
+    elif export_format == 'ndjson':
+        body = stream_ndjson(columns, chunks)
+    elif export_format == 'html':
+        body = stream_html([(table, columns, chunks)])
+    elif export_format == 'arrow':
+        body = stream_arrow(table, chunks)
+    else:
+        body = stream_parquet(table, chunks)
+    return mimetype, extension, body
@@ -0,0 +1,92 @@
+import logging
+import re
+import time
+from datetime import datetime, timedelta
+from geopy.geocoders import Nominatim
+from cache import TTLCache
+
+# 查不到结果的地址也缓存一段时间，避免重复请求外部服务
+NEGATIVE_TTL = timedelta(days=7)
+
+def normalize_address(address):
+    return re.sub(r'\s+', ' ', address.strip().lower()).strip(' ,.')
+
+def coordinate_key(lat, lon):
+    # 约 11 米的坐标格子
+    return f"{round(lat, 4):.4f},{round(lon, 4):.4f}"
+
+class RateLimiter:
+    # 两次调用之间至少间隔 min_interval 秒 (Nominatim 要求每秒最多 1 次请求)
+    # 时间片记录在数据库的 rate_limits 表中，所有 Web worker 和 job runner 共享同一个限额
+    def __init__(self, get_db, name='nominatim', min_interval=1.0):
+        self.get_db = get_db
+        self.name = name
+        self.min_interval = min_interval
+
+    def wait(self):
+        if self.min_interval <= 0:
+            return
+        delay = self.get_db().reserve_rate_limit_slot(self.name, self.min_interval) - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+class GeocodeCache:
+    # 地理编码结果先查内存 LRU，再查数据库 geocode_cache 表，最后才请求外部服务
+    def __init__(self, get_db, geolocator=None, min_interval=1.0, memory_size=1024):
+        self.get_db = get_db
+        self._geolocator = geolocator
+        self.rate_limiter = RateLimiter(get_db, min_interval=min_interval)
+        self.memory = TTLCache(maxsize=memory_size, ttl=NEGATIVE_TTL.total_seconds())
+
+    @property
+    def geolocator(self):
+        if self._geolocator is None:
+            self._geolocator = Nominatim(user_agent="fuel_price_tracker")
+        return self._geolocator
+
+    def _lookup(self, kind, key, fetch):
+        found, value = self.memory.get((kind, key))
+        if found:
+            return value
+
+        db = self.get_db()
+        cached = db.get_geocode(kind, key)
+        if cached is not None:
+            latitude, longitude, address, hit, created_at = cached
+            if hit or datetime.fromisoformat(created_at) > datetime.now() - NEGATIVE_TTL:
+                value = (latitude, longitude, address) if hit else None
+                self.memory.set((kind, key), value)
+                return value
+
+        # 超时等服务错误直接抛出，不写入缓存
+        self.rate_limiter.wait()
+        location = fetch()
+        value = (location.latitude, location.longitude, location.address) if location else None
+        db.put_geocode(kind, key, value)
+        self.memory.set((kind, key), value)
+        return value
+
+    def geocode(self, address):
+        # 返回 (latitude, longitude, address)，找不到时返回 None
+        return self._lookup('forward', normalize_address(address), lambda: self.geolocator.geocode(address))
+
+    def reverse(self, lat, lon):
+        result = self._lookup('reverse', coordinate_key(lat, lon), lambda: self.geolocator.reverse(f"{lat}, {lon}"))
+        return result[2] if result else None
+
+def backfill_station_locations(db, geocoder, limit=100):
+    # 为抓取到但还没有坐标的加油站批量查询坐标，受 RateLimiter 限速
+    missing = db.get_stations_missing_location(limit)
+    located = 0
+    for station, city in missing:
+        query = f"{station}, {city.title()}, Finland" if city else f"{station}, Finland"
+        try:
+            result = geocoder.geocode(query)
+        except Exception as e:
+            logging.warning(f"Geocoding failed for station {station}: {str(e)}")
+            continue
+        if result:
+            db.add_or_update_station(station, result[0], result[1])
+            located += 1
+    logging.info(f"Located {located} of {len(missing)} stations without coordinates")
+    return located
@@ -0,0 +1,11 @@
+import os
+
+# gunicorn -c gunicorn.conf.py 'api:create_app()'
+bind = os.getenv('BIND', '0.0.0.0:5001')
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+# gthread：每个 worker 用线程处理请求，SSE 长连接 (LIVE_UPDATES=sse) 只占用一个线程而不是整个 worker
+worker_class = os.getenv('WORKER_CLASS', 'gthread')
+threads = int(os.getenv('WEB_THREADS', '32'))
+# gthread 下超时只针对 worker 进程本身的心跳，不限制单个 SSE 连接的时长
+timeout = int(os.getenv('WEB_TIMEOUT', '60'))
+accesslog = '-'
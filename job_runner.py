@@ -0,0 +1,134 @@
+import logging
+import os
+import signal
+import sys
+import threading
+from datetime import datetime
+from apscheduler.schedulers.background import BackgroundScheduler
+from dotenv import load_dotenv
+from database import get_db, release_db
+from email_sender import pool_from_env
+from geocoder import GeocodeCache
+from jobs import default_owner, run_job, update_fuel_prices_and_notify, backfill_station_coordinates, send_alert_digests
+from mail_queue import MailDispatcher
+from metrics import serve_metrics
+
+load_dotenv()  # 加载 .env 文件中的环境变量
+
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'DEBUG'))
+
+LEADER_LEASE = 'job_runner'
+
+class JobRunner:
+    # 独立于 Web 进程的任务进程。多个实例同时运行时，只有持有 leader 租约的实例
+    # 执行定时抓取和邮件发送，其余实例待命，租约过期后接替
+    def __init__(self, owner=None, lease_ttl=60, scrape_interval_minutes=60, jitter=300, digest_hour=7):
+        self.owner = owner or default_owner()
+        self.lease_ttl = lease_ttl
+        self.scrape_interval_minutes = scrape_interval_minutes
+        self.jitter = jitter
+        self.digest_hour = digest_hour
+        self._stopped = threading.Event()
+        self.scheduler = None
+        self.mail_dispatcher = None
+
+    def _renew(self):
+        try:
+            return get_db().try_acquire_lease(LEADER_LEASE, self.owner, self.lease_ttl)
+        except Exception as e:
+            logging.error(f"Error renewing job runner lease: {str(e)}", exc_info=True)
+            return False
+        finally:
+            release_db()
+
+    def _record_delivery(self, started_at, finished_at, sent, failed):
+        get_db().record_job_run('deliver_emails', self.owner, started_at, finished_at,
+                                'success' if not failed else 'partial', emails_sent=sent,
+                                error=f"{failed} emails failed" if failed else None)
+
+    def _start_jobs(self):
+        self.mail_dispatcher = MailDispatcher(get_db, pool_from_env(), on_drain=self._record_delivery)
+        self.mail_dispatcher.start()
+        geocoder = GeocodeCache(get_db)
+
+        # max_instances=1 + coalesce：上一次还没跑完时不会叠加运行，错过的多次只补跑一次
+        # jitter：多个部署共用抓取目标时错开请求时间
+        self.scheduler = BackgroundScheduler(job_defaults={'max_instances': 1, 'coalesce': True})
+        self.scheduler.add_job(
+            run_job, 'interval', minutes=self.scrape_interval_minutes, jitter=self.jitter,
+            args=('update_fuel_prices_and_notify',
+                  lambda: update_fuel_prices_and_notify(self.mail_dispatcher), self.owner),
+            id='update_fuel_prices_and_notify', next_run_time=datetime.now()
+        )
+        self.scheduler.add_job(
+            run_job, 'interval', hours=1, jitter=self.jitter,
+            args=('backfill_station_coordinates',
+                  lambda: backfill_station_coordinates(geocoder), self.owner),
+            id='backfill_station_coordinates'
+        )
+        # 汇总提醒：daily 每天、weekly 每周一在 digest_hour 点发送
+        self.scheduler.add_job(
+            run_job, 'cron', hour=self.digest_hour,
+            args=('send_daily_digests',
+                  lambda: send_alert_digests('daily', self.mail_dispatcher), self.owner),
+            id='send_daily_digests'
+        )
+        self.scheduler.add_job(
+            run_job, 'cron', day_of_week='mon', hour=self.digest_hour,
+            args=('send_weekly_digests',
+                  lambda: send_alert_digests('weekly', self.mail_dispatcher), self.owner),
+            id='send_weekly_digests'
+        )
+        self.scheduler.start()
+
+    def _stop_jobs(self):
+        if self.scheduler is not None:
+            self.scheduler.shutdown(wait=False)
+            self.scheduler = None
+        if self.mail_dispatcher is not None:
+            self.mail_dispatcher.stop(timeout=30)
+            self.mail_dispatcher = None
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        # 返回进程退出码：正常停止为 0，失去 leader 租约为 1
+        renew_interval = self.lease_ttl / 3
+        logging.info(f"Job runner {self.owner} waiting for leadership")
+        while not self._renew():
+            if self._stopped.wait(renew_interval):
+                return 0
+        logging.info(f"Job runner {self.owner} acquired leadership")
+
+        self._start_jobs()
+        try:
+            while not self._stopped.wait(renew_interval):
+                if not self._renew():
+                    logging.error(f"Job runner {self.owner} lost leadership, exiting")
+                    return 1
+            return 0
+        finally:
+            self._stop_jobs()
+            if self._stopped.is_set():
+                get_db().release_lease(LEADER_LEASE, self.owner)
+
+def runner_from_env():
+    return JobRunner(
+        lease_ttl=int(os.getenv('JOB_RUNNER_LEASE_TTL', '60')),
+        scrape_interval_minutes=int(os.getenv('SCRAPE_INTERVAL_MINUTES', '60')),
+        jitter=int(os.getenv('JOB_JITTER_SECONDS', '300')),
+        digest_hour=int(os.getenv('DIGEST_HOUR', '7'))
+    )
+
+def main():
+    # 抓取和邮件发送的指标在本进程中，需要单独暴露给 Prometheus
+    if os.getenv('METRICS_PORT'):
+        serve_metrics(int(os.getenv('METRICS_PORT')))
+    runner = runner_from_env()
+    signal.signal(signal.SIGTERM, lambda signum, frame: runner.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: runner.stop())
+    return runner.run()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+import logging
+import os
+import socket
+import threading
+from datetime import datetime
+from database import get_db, release_db
+from scraper import scrape_fuel_prices
+from alert_matcher import build_subscription_index, match_alerts, suppress_repeats
+from geocoder import backfill_station_locations
+from metrics import JOB_RUN_SECONDS, log_hot_path
+from price_validation import ScrapeValidationError, validator_from_env
+
+# 单次任务租约的有效期 (秒)，应大于任务的最长运行时间
+JOB_LEASE_TTL = int(os.getenv('JOB_LEASE_TTL', '1800'))
+
+# 同一加油站再次提醒所需的最小降价幅度 (€)
+ALERT_REPEAT_EPSILON = float(os.getenv('ALERT_REPEAT_EPSILON', '0.01'))
+DIGEST_MODES = ('daily', 'weekly')
+
+_validator = None
+_validator_lock = threading.Lock()
+
+def get_validator():
+    global _validator
+    with _validator_lock:
+        if _validator is None:
+            _validator = validator_from_env(get_db)
+        return _validator
+
+_job_locks = {}
+_job_locks_guard = threading.Lock()
+
+def default_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _job_lock(name):
+    with _job_locks_guard:
+        return _job_locks.setdefault(name, threading.Lock())
+
+def run_job(name, func, owner=None, lease_ttl=JOB_LEASE_TTL):
+    # 防止同一任务重叠运行：进程内用非阻塞锁，跨进程用数据库中的租约
+    # 运行结果 (耗时、写入行数、排队邮件数) 记录到 job_runs；任务已在运行时返回 None
+    owner = owner or default_owner()
+    lock = _job_lock(name)
+    if not lock.acquire(blocking=False):
+        logging.warning(f"Job {name} is already running in this process, skipping")
+        return None
+    try:
+        db = get_db()
+        lease = f"job:{name}"
+        if not db.try_acquire_lease(lease, owner, lease_ttl):
+            logging.warning(f"Job {name} is already running in another process, skipping")
+            return None
+        started_at = datetime.now()
+        stats = {}
+        try:
+            stats = func() or {}
+        except Exception as e:
+            JOB_RUN_SECONDS.observe((datetime.now() - started_at).total_seconds(), name, 'failed')
+            db.record_job_run(name, owner, started_at, datetime.now(), 'failed', error=str(e),
+                              rows_written=stats.get('rows_written', 0),
+                              emails_queued=stats.get('emails_queued', 0))
+            raise
+        else:
+            JOB_RUN_SECONDS.observe((datetime.now() - started_at).total_seconds(), name, 'success')
+            db.record_job_run(name, owner, started_at, datetime.now(), 'success',
+                              rows_written=stats.get('rows_written', 0),
+                              emails_queued=stats.get('emails_queued', 0),
+                              emails_sent=stats.get('emails_sent', 0))
+            logging.info(f"Job {name} finished in {(datetime.now() - started_at).total_seconds():.2f}s: {stats}")
+            return stats
+        finally:
+            db.release_lease(lease, owner)
+    finally:
+        # 任务之间不占用数据库连接
+        release_db()
+        lock.release()
+
+def update_fuel_prices_and_notify(mail_dispatcher=None):
+    # 抓取价格、写入变化并把提醒邮件写入发件箱；邮件由 job runner 中的 MailDispatcher 发送
+    prices = scrape_fuel_prices()
+    logging.info(f"Scraped {sum(len(price_list) for price_list in prices.values())} prices")
+    if log_hot_path():
+        logging.info(f"Scraped prices: {prices}")
+    db = get_db()
+
+    # 校验：异常价格隔离到 price_quarantine，异常过多时放弃本次抓取
+    validator = get_validator()
+    try:
+        prices, outliers = validator.validate(prices)
+    except ScrapeValidationError as e:
+        db.quarantine_prices(e.outliers)
+        raise
+    if outliers:
+        db.quarantine_prices(outliers)
+
+    changes = db.update_fuel_prices(prices)
+    validator.record(changes)
+    rows_written = len(changes['new']) + len(changes['changed'])
+    logging.info(f"Wrote {rows_written} changed prices, "
+                 f"refreshed {len(changes['unchanged'])} unchanged prices")
+
+    # 价格变化写入事件表，Web 进程推送给 SSE / 长轮询客户端
+    db.publish_price_events(changes)
+
+    # 获取最新的前10个最低价格
+    latest_prices = {}
+    for fuel_type in ['95 E10', '98 E5', 'Diesel']:
+        latest_prices[fuel_type] = db.get_latest_top10_fuel_prices(fuel_type)
+
+    # 通知逻辑：每种燃料只取阈值 >= 当前最低价格的订阅
+    subscriptions = []
+    for fuel_type, board in latest_prices.items():
+        if board:
+            min_price = min(price[2] for price in board)
+            subscriptions.extend(db.get_subscriptions_for_price(fuel_type, min_price))
+    logging.info(f"Found {len(subscriptions)} matching subscriptions")
+
+    # 用于存储每个用户的通知信息
+    notifications = match_alerts(build_subscription_index(subscriptions), latest_prices)
+    alert_modes = {sub[0]: sub[3] for sub in subscriptions}
+
+    # 去重：已经提醒过且价格没有继续下降的加油站不再提醒；不再满足阈值的加油站清除状态
+    last_alerted = db.get_alert_state()
+    fresh, matched = suppress_repeats(notifications, last_alerted, ALERT_REPEAT_EPSILON)
+    boards = {fuel_type for fuel_type, board in latest_prices.items() if board}
+    cleared = [key for key in last_alerted if key not in matched and key[1] in boards]
+    suppressed = sum(len(alerts) for alerts in notifications.values()) - sum(len(alerts) for alerts in fresh.values())
+
+    # instant 订阅的提醒写入发件箱，由 mail_dispatcher 在后台发送；daily / weekly 订阅的提醒等待汇总
+    messages = []
+    digest = []
+    for email, alerts in fresh.items():
+        if alert_modes.get(email) in DIGEST_MODES:
+            digest.extend((email, alert['fuel_type'], alert['station'], alert['price'], alert['threshold'], alert['updated'])
+                          for alert in alerts)
+        else:
+            messages.append(format_alert_email(email, alerts))
+
+    db.record_alerts(messages, digest, [(email, alert['fuel_type'], alert['station'], alert['price'])
+                                        for email, alerts in fresh.items() for alert in alerts], cleared)
+    if messages and mail_dispatcher is not None:
+        mail_dispatcher.wake()
+    logging.info(f"Queued {len(messages)} price alert emails, {len(digest)} alerts for digests, "
+                 f"suppressed {suppressed} repeated alerts")
+
+    # 预渲染主页，Web 进程直接返回快照
+    try:
+        refresh_home_snapshot()
+    except Exception as e:
+        logging.error(f"Error rendering home page snapshot: {str(e)}", exc_info=True)
+
+    logging.info("Fuel prices updated and notifications queued successfully")
+    return {'rows_written': rows_written, 'emails_queued': len(messages), 'quarantined': len(outliers),
+            'alerts_suppressed': suppressed, 'alerts_digested': len(digest)}
+
+def format_alert_email(email, alerts):
+    subject = "Fuel Price Alert"
+    message = "The following fuel prices have dropped below your thresholds:\n\n"
+    for alert in alerts:
+        message += f"- {alert['fuel_type']} at {alert['station']}: €{alert['price']} (Threshold: €{alert['threshold']}, Updated: {alert['updated']})\n"
+    return email, subject, message
+
+def send_alert_digests(alert_mode, mail_dispatcher=None):
+    # 把 daily / weekly 订阅者累积的提醒合并成每人一封邮件
+    db = get_db()
+    alerts = db.get_digest_alerts(alert_mode)
+    by_email = {}
+    for email, fuel_type, station, price, threshold, updated in alerts:
+        by_email.setdefault(email, []).append((fuel_type, station, price, threshold, updated))
+
+    messages = []
+    for email, items in by_email.items():
+        subject = f"Your {alert_mode} fuel price digest"
+        message = f"Lowest prices below your thresholds since your last {alert_mode} digest:\n\n"
+        for fuel_type, station, price, threshold, updated in items:
+            message += f"- {fuel_type} at {station}: €{price} (Threshold: €{threshold}, Updated: {updated})\n"
+        messages.append((email, subject, message))
+
+    db.enqueue_digest_emails(messages, alerts)
+    if messages and mail_dispatcher is not None:
+        mail_dispatcher.wake()
+    logging.info(f"Queued {len(messages)} {alert_mode} digest emails covering {len(alerts)} alerts")
+    return {'emails_queued': len(messages)}
+
+_render_app = None
+
+def refresh_home_snapshot():
+    # 只用 Flask 应用渲染模板，不启动 Web 进程的后台初始化
+    global _render_app
+    from api import create_app, home_snapshots
+    from snapshots import build_home_snapshot
+    if _render_app is None:
+        _render_app = create_app(background_startup=False)
+    home_snapshots.put(build_home_snapshot(_render_app, get_db()))
+
+def backfill_station_coordinates(geocoder):
+    # 为抓取到的加油站补全坐标，每次最多 100 个，按 Nominatim 限速
+    updated = backfill_station_locations(get_db(), geocoder)
+    return {'rows_written': updated}
@@ -0,0 +1,160 @@
+import base64
+import gzip
+import hashlib
+import json
+from flask import Blueprint, Response, jsonify, request
+from cache import TTLCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 每个资源可选的字段和键集分页使用的排序键
+RESOURCES = {
+    'prices': {
+        'table': 'fuel_prices',
+        'fields': ['fuel_type', 'station', 'price', 'updated', 'timestamp', 'city'],
+        'default_fields': ['fuel_type', 'station', 'price', 'updated', 'timestamp'],
+        'key': ['fuel_type', 'price', 'station'],
+        'filters': ['fuel_type', 'city'],
+    },
+    'stations': {
+        'table': 'stations',
+        'fields': ['name', 'latitude', 'longitude'],
+        'default_fields': ['name', 'latitude', 'longitude'],
+        'key': ['name'],
+        'filters': [],
+    },
+    'subscriptions': {
+        'table': 'users',
+        'fields': ['email', 'threshold', 'fuel_type', 'alert_mode'],
+        'default_fields': ['email', 'threshold', 'fuel_type'],
+        'key': ['email'],
+        'filters': ['fuel_type'],
+    },
+}
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+MIN_COMPRESS_SIZE = 500
+
+class BadRequest(ValueError):
+    pass
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except ValueError:
+        raise BadRequest("Invalid cursor")
+
+def negotiate_encoding(accept_encoding):
+    accepted = {part.split(';')[0].strip().lower() for part in accept_encoding.split(',')}
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body)
+    return gzip.compress(body, compresslevel=6)
+
+def create_api_blueprint(get_db, stamp_ttl=5):
+    api_v1 = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+    # 数据版本号在进程内缓存几秒，轮询的客户端大多直接得到 304，不访问数据库
+    stamps = TTLCache(maxsize=4, ttl=stamp_ttl)
+
+    def data_stamp(resource):
+        db = get_db()
+        versions = stamps.get_or_load('data_versions', db.get_data_versions, version=db.version)
+        return versions.get(resource, (0, None))
+
+    def parse_request(resource):
+        spec = RESOURCES[resource]
+        fields = request.args.get('fields')
+        if fields:
+            fields = [field.strip() for field in fields.split(',') if field.strip()]
+            unknown = [field for field in fields if field not in spec['fields']]
+            if unknown:
+                raise BadRequest(f"Unknown fields: {', '.join(unknown)}")
+        else:
+            fields = spec['default_fields']
+
+        try:
+            limit = int(request.args.get('limit', DEFAULT_LIMIT))
+        except ValueError:
+            raise BadRequest("limit must be an integer")
+        if not 1 <= limit <= MAX_LIMIT:
+            raise BadRequest(f"limit must be between 1 and {MAX_LIMIT}")
+
+        filters = {name: request.args[name] for name in spec['filters'] if request.args.get(name)}
+        # 已按等值过滤的列不再参与排序键
+        key = [column for column in spec['key'] if column not in filters]
+        after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        # 游标的值直接作为 SQL 参数，只接受标量
+        if after is not None and (not isinstance(after, list) or len(after) != len(key) or
+                                  not all(value is None or isinstance(value, (str, int, float)) for value in after)):
+            raise BadRequest("Invalid cursor")
+        return fields, filters, key, after, limit
+
+    def respond(resource, build_payload):
+        try:
+            query = parse_request(resource)
+        except BadRequest as e:
+            return jsonify({"error": str(e)}), 400
+
+        version, updated_at = data_stamp(resource)
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding', ''))
+        # 强 ETag：数据版本 + 查询参数，压缩后的响应再加上内容编码后缀
+        digest = hashlib.sha1(f"{resource}|{version}|{updated_at}|{sorted(request.args.items())}".encode()).hexdigest()[:20]
+        headers = {'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+        if updated_at:
+            headers['X-Data-Updated'] = updated_at
+
+        # 是否压缩取决于响应大小，比较时还不知道，所以两种形式都接受 (内容相同，只是编码不同)
+        current = {digest, f"{digest}-{encoding}"} if encoding else {digest}
+        matched = [tag for tag in (tag.strip().strip('"') for tag in request.headers.get('If-None-Match', '').split(','))
+                   if tag in current]
+        if matched:
+            headers['ETag'] = f'"{matched[0]}"'
+            return Response(status=304, headers=headers)
+
+        body = json.dumps(build_payload(*query), separators=(',', ':')).encode()
+        if encoding and len(body) >= MIN_COMPRESS_SIZE:
+            body = compress(body, encoding)
+            headers['Content-Encoding'] = encoding
+            headers['ETag'] = f'"{digest}-{encoding}"'
+        else:
+            headers['ETag'] = f'"{digest}"'
+        return Response(body, status=200, headers=headers, mimetype='application/json')
+
+    def page(resource, fields, filters, key, after, limit):
+        spec = RESOURCES[resource]
+        columns, rows = get_db().get_page(spec['table'], fields, key, filters, after, limit)
+        items = [dict(zip(columns, row)) for row in rows]
+        next_cursor = None
+        if len(rows) == limit:
+            next_cursor = encode_cursor([items[-1][column] for column in key])
+        return {
+            'data': [{field: item[field] for field in fields} for item in items],
+            'next_cursor': next_cursor
+        }
+
+    @api_v1.route('/prices')
+    def prices():
+        return respond('prices', lambda *query: page('prices', *query))
+
+    @api_v1.route('/stations')
+    def stations():
+        return respond('stations', lambda *query: page('stations', *query))
+
+    @api_v1.route('/subscriptions')
+    def subscriptions():
+        return respond('subscriptions', lambda *query: page('subscriptions', *query))
+
+    return api_v1
@@ -0,0 +1,124 @@
+import logging
+import random
+import smtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+def is_transient_error(error):
+    # 连接中断、超时以及 4xx 响应可以重试，其他错误 (如 5xx、地址被拒) 直接判定失败
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    return isinstance(error, OSError)
+
+class MailDispatcher:
+    # 从 email_outbox 取出邮件，用有限的工作线程通过 SMTP 连接池发送
+    def __init__(self, get_db, pool, workers=4, batch_size=100, max_attempts=5,
+                 base_backoff=30, poll_interval=60, on_drain=None):
+        self.get_db = get_db
+        self.pool = pool
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.poll_interval = poll_interval
+        # 每轮实际发送过邮件后回调 on_drain(started_at, finished_at, sent, failed)
+        self.on_drain = on_drain
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._drain_lock = threading.Lock()
+        self._thread = None
+        self._executor = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="smtp-worker")
+        self._thread = threading.Thread(target=self._run, name="mail-dispatcher", daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.pool.close()
+
+    def _run(self):
+        try:
+            requeued = self.get_db().requeue_interrupted_emails()
+            if requeued:
+                logging.info(f"Requeued {requeued} interrupted emails")
+        except Exception as e:
+            logging.error(f"Error requeueing interrupted emails: {str(e)}", exc_info=True)
+
+        while not self._stopped.is_set():
+            try:
+                started_at = datetime.now()
+                sent, failed = self.drain()
+                if (sent or failed) and self.on_drain is not None:
+                    self.on_drain(started_at, datetime.now(), sent, failed)
+            except Exception as e:
+                logging.error(f"Error delivering queued emails: {str(e)}", exc_info=True)
+            self._release_db()
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _release_db(self):
+        # 等待下一轮期间不占用数据库连接
+        try:
+            self.get_db().release()
+        except Exception as e:
+            logging.error(f"Error releasing database connection: {str(e)}", exc_info=True)
+
+    def _backoff(self, attempts):
+        # 指数退避并加入随机抖动
+        delay = self.base_backoff * (2 ** attempts)
+        return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+    def drain(self):
+        # 发送所有到期的邮件，返回 (成功数, 失败数)
+        executor = self._executor or ThreadPoolExecutor(max_workers=self.workers)
+        sent = failed = 0
+        with self._drain_lock:
+            try:
+                db = self.get_db()
+                while not self._stopped.is_set():
+                    batch = db.claim_pending_emails(self.batch_size)
+                    if not batch:
+                        break
+                    futures = {
+                        executor.submit(self.pool.send, to_email, subject, body): (email_id, to_email, attempts)
+                        for email_id, to_email, subject, body, attempts in batch
+                    }
+                    # 只在当前线程写数据库，工作线程只负责 SMTP
+                    for future in as_completed(futures):
+                        email_id, to_email, attempts = futures[future]
+                        error = future.exception()
+                        if error is None:
+                            db.mark_email_sent(email_id)
+                            sent += 1
+                        elif is_transient_error(error) and attempts + 1 < self.max_attempts:
+                            db.reschedule_email(email_id, datetime.now() + self._backoff(attempts), str(error))
+                            logging.warning(f"Transient error sending email to {to_email}, will retry: {str(error)}")
+                        else:
+                            db.mark_email_failed(email_id, str(error))
+                            failed += 1
+                            logging.error(f"Failed to send email to {to_email}: {str(error)}")
+            finally:
+                if executor is not self._executor:
+                    executor.shutdown(wait=True)
+        if sent or failed:
+            logging.info(f"Delivered {sent} emails, {failed} failed")
+        return sent, failed
@@ -0,0 +1,169 @@
+import functools
+import inspect
+import logging
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 默认分桶 (秒)，覆盖从毫秒级查询到数十秒的抓取
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    # 按标签值分组的直方图，输出 Prometheus 的 _bucket / _sum / _count
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # [每个桶的计数..., +Inf 桶, 总和]
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, label_values, ('le', _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(values[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.get_or_create(Histogram, name, documentation, labelnames, buckets)
+
+def render_metrics():
+    return REGISTRY.render()
+
+# 各模块共用的指标
+DB_METHOD_SECONDS = histogram('fuel_db_method_seconds', 'Time spent in Database methods', ['method'])
+SCRAPE_FETCH_SECONDS = histogram('fuel_scrape_fetch_seconds', 'HTTP fetch time per city page', ['city'])
+SCRAPE_PARSE_SECONDS = histogram('fuel_scrape_parse_seconds', 'HTML parse time per city page', ['city'])
+SMTP_SEND_SECONDS = histogram('fuel_smtp_send_seconds', 'SMTP send latency', ['result'])
+HTTP_REQUEST_SECONDS = histogram('fuel_http_request_seconds', 'Flask request latency', ['endpoint', 'method', 'status'])
+JOB_RUN_SECONDS = histogram('fuel_job_run_seconds', 'Background job duration', ['job', 'status'],
+                            buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0))
+
+def instrument_methods(cls, hist):
+    # 为类的公开方法计时 (生成器方法只会测到创建生成器的时间，跳过)
+    for name, attr in list(vars(cls).items()):
+        if name.startswith('_') or not inspect.isfunction(attr) or inspect.isgeneratorfunction(attr):
+            continue
+        setattr(cls, name, _timed_method(attr, hist, name))
+    return cls
+
+def _timed_method(func, hist, name):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            hist.observe(time.perf_counter() - start, name)
+    return wrapper
+
+# 逐行/逐条日志 (如每个抓取到的价格) 的输出方式：all 全部输出，sampled 按比例抽样，off 不输出
+_hot_path_mode = os.getenv('HOT_PATH_LOGGING', 'all')
+_hot_path_rate = float(os.getenv('HOT_PATH_LOG_SAMPLE_RATE', '0.01'))
+
+def set_hot_path_logging(mode, rate=None):
+    global _hot_path_mode, _hot_path_rate
+    if mode not in ('all', 'sampled', 'off'):
+        raise ValueError(f"Unknown hot path logging mode: {mode}")
+    _hot_path_mode = mode
+    if rate is not None:
+        _hot_path_rate = rate
+
+def log_hot_path():
+    # 用法：if log_hot_path(): logging.info(...)，不输出时连消息字符串都不会格式化
+    if _hot_path_mode == 'all':
+        return True
+    if _hot_path_mode == 'sampled':
+        return random.random() < _hot_path_rate
+    return False
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_metrics(port, host='0.0.0.0'):
+    # 没有 Flask 的进程 (job runner) 用独立的 HTTP 线程暴露 /metrics
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    logging.info(f"Serving metrics on {host}:{port}/metrics")
+    return server
@@ -0,0 +1,300 @@
+from datetime import datetime
+import logging
+
+# 结构迁移按版本号顺序执行，每个版本只执行一次，记录在 schema_version 表中。
+# SQLite 同时写入 PRAGMA user_version，启动时读一次文件头即可判断是否需要迁移；
+# PostgreSQL 没有 user_version，只使用 schema_version 表。
+# 已发布的迁移不要修改，结构变化只能追加新的版本
+
+def _initial_schema(conn, backend):
+    # 引入迁移之前 create_tables 创建的结构；旧数据库上重复执行也不会出错
+    types = backend.types
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users
+        (id {pk},
+         email TEXT UNIQUE,
+         threshold {real},
+         fuel_type TEXT)
+    '''.format(**types))
+
+    # 检查是否需要添加新列
+    backend.add_column(conn, 'users', 'latitude', types['real'])
+    backend.add_column(conn, 'users', 'longitude', types['real'])
+    backend.add_column(conn, 'users', 'address', 'TEXT')
+
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_fuel_type_threshold
+        ON users (fuel_type, threshold)
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fuel_prices
+        (id {pk},
+         fuel_type TEXT,
+         station TEXT,
+         price {real},
+         updated TEXT,
+         timestamp {datetime},
+         UNIQUE(fuel_type, station))
+    '''.format(**types))
+    # fuel_prices 只保存每个 (fuel_type, station) 的当前价格，历史记录追加到 price_history
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_fuel_prices_type_timestamp
+        ON fuel_prices (fuel_type, timestamp)
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS price_history
+        (id {pk},
+         fuel_type TEXT,
+         station TEXT,
+         price {real},
+         updated TEXT,
+         timestamp {datetime})
+    '''.format(**types))
+    # 多城市抓取时记录价格所属城市
+    backend.add_column(conn, 'fuel_prices', 'city', 'TEXT')
+    backend.add_column(conn, 'price_history', 'city', 'TEXT')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_fuel_prices_type_price
+        ON fuel_prices (fuel_type, price, station)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_price_history_key
+        ON price_history (fuel_type, station, timestamp)
+    ''')
+    # 旧数据库升级时，用已有的当前价格初始化历史表
+    conn.execute('''
+        INSERT INTO price_history (fuel_type, station, price, updated, timestamp)
+        SELECT fuel_type, station, price, updated, timestamp FROM fuel_prices
+        WHERE NOT EXISTS (SELECT 1 FROM price_history)
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_vehicles
+        (id {pk},
+         user_email TEXT,
+         latitude {real},
+         longitude {real},
+         FOREIGN KEY (user_email) REFERENCES users(email))
+    '''.format(**types))
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stations
+        (id {pk},
+         name TEXT UNIQUE,
+         latitude {real},
+         longitude {real})
+    '''.format(**types))
+    # 待发送邮件，重启后仍可继续发送
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS email_outbox
+        (id {pk},
+         to_email TEXT,
+         subject TEXT,
+         body TEXT,
+         status TEXT DEFAULT 'pending',
+         attempts INTEGER DEFAULT 0,
+         next_attempt_at {datetime},
+         last_error TEXT,
+         created_at {datetime},
+         sent_at {datetime})
+    '''.format(**types))
+    # 每类数据 (prices / stations / subscriptions) 的版本号，JSON API 用它生成 ETag
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions
+        (resource TEXT PRIMARY KEY,
+         version INTEGER,
+         updated_at {datetime})
+    '''.format(**types))
+    # 地理编码缓存，found = 0 表示查询过但没有结果
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS geocode_cache
+        (kind TEXT,
+         query_key TEXT,
+         latitude {real},
+         longitude {real},
+         address TEXT,
+         found INTEGER,
+         created_at {datetime},
+         PRIMARY KEY (kind, query_key))
+    '''.format(**types))
+    # 后台任务的租约：同一时间只有持有租约的进程执行定时任务
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS job_leases
+        (name TEXT PRIMARY KEY,
+         owner TEXT,
+         expires_at {datetime})
+    '''.format(**types))
+    # 每次任务运行的记录
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS job_runs
+        (id {pk},
+         job_name TEXT,
+         owner TEXT,
+         started_at {datetime},
+         finished_at {datetime},
+         duration_seconds {real},
+         status TEXT,
+         rows_written INTEGER DEFAULT 0,
+         emails_queued INTEGER DEFAULT 0,
+         emails_sent INTEGER DEFAULT 0,
+         error TEXT)
+    '''.format(**types))
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_job_runs_name_started
+        ON job_runs (job_name, started_at)
+    ''')
+    # 每个加油站最近的价格 (逗号分隔)，用于校验新抓取的价格
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS price_baselines
+        (fuel_type TEXT,
+         station TEXT,
+         recent TEXT,
+         updated_at {datetime},
+         PRIMARY KEY (fuel_type, station))
+    '''.format(**types))
+    # 校验未通过的价格，不写入 fuel_prices
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS price_quarantine
+        (id {pk},
+         fuel_type TEXT,
+         station TEXT,
+         city TEXT,
+         price {real},
+         updated TEXT,
+         timestamp {datetime},
+         reason TEXT,
+         score {real},
+         baseline {real},
+         created_at {datetime})
+    '''.format(**types))
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_price_quarantine_created_at
+        ON price_quarantine (created_at)
+    ''')
+    # 价格变化事件，Web 进程读取后推送给 SSE / 长轮询客户端
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS price_events
+        (id {pk},
+         kind TEXT,
+         fuel_type TEXT,
+         station TEXT,
+         city TEXT,
+         old_price {real},
+         price {real},
+         updated TEXT,
+         created_at {datetime})
+    '''.format(**types))
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_price_events_created_at
+        ON price_events (created_at)
+    ''')
+    # 提醒方式：instant (每次抓取后发送) / daily / weekly (汇总后一次发送)，NULL 视为 instant
+    backend.add_column(conn, 'users', 'alert_mode', 'TEXT')
+    # 每个订阅者最近一次提醒过的 (加油站, 价格)，价格没有继续下降时不再重复提醒
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS alert_state
+        (email TEXT,
+         fuel_type TEXT,
+         station TEXT,
+         price {real},
+         alerted_at {datetime},
+         PRIMARY KEY (email, fuel_type, station))
+    '''.format(**types))
+    # 等待汇总发送的提醒，每个 (订阅者, 加油站) 只保留一条最低价格
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS alert_digest
+        (email TEXT,
+         fuel_type TEXT,
+         station TEXT,
+         price {real},
+         threshold {real},
+         updated TEXT,
+         created_at {datetime},
+         PRIMARY KEY (email, fuel_type, station))
+    '''.format(**types))
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_email_outbox_status_next_attempt
+        ON email_outbox (status, next_attempt_at)
+    ''')
+
+def _hot_query_indexes(conn, backend):
+    # 热点查询缺少的索引，见 benchmark.py plans
+    # 导出接口按时间范围读取当前价格
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_fuel_prices_timestamp
+        ON fuel_prices (timestamp)
+    ''')
+    # 最近 N 天的价格统计 (get_price_stats) 只读取时间范围内的历史
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_price_history_type_timestamp
+        ON price_history (fuel_type, timestamp)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_alert_mode
+        ON users (alert_mode)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_vehicles_user_email
+        ON user_vehicles (user_email)
+    ''')
+    # 不按任务名过滤时的最近运行记录
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_job_runs_started_at
+        ON job_runs (started_at)
+    ''')
+
+def _rate_limits(conn, backend):
+    # 跨进程共享的限速：next_at 为下一个可用时间片的开始时间 (Unix 时间戳)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS rate_limits
+        (name TEXT PRIMARY KEY,
+         next_at {real})
+    '''.format(**backend.types))
+
+MIGRATIONS = [
+    (1, 'initial_schema', _initial_schema),
+    (2, 'hot_query_indexes', _hot_query_indexes),
+    (3, 'rate_limits', _rate_limits),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def _applied_version(conn):
+    cursor = conn.execute('SELECT MAX(version) FROM schema_version')
+    return cursor.fetchone()[0] or 0
+
+def migrate(conn, backend):
+    # 执行尚未应用的迁移，返回数据库的结构版本
+    version = backend.user_version(conn)
+    if version is not None and version >= LATEST_VERSION:
+        if version > LATEST_VERSION:
+            logging.warning(f"Database schema version {version} is newer than this code ({LATEST_VERSION})")
+        return version
+
+    # 每个迁移一个事务，并持有迁移锁：多个进程同时启动时只有一个执行，其余的看到已应用后跳过
+    backend.begin_schema_change(conn)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version
+        (version INTEGER PRIMARY KEY,
+         name TEXT,
+         applied_at {datetime})
+    '''.format(**backend.types))
+    conn.commit()
+    for number, name, apply in MIGRATIONS:
+        backend.begin_schema_change(conn)
+        try:
+            if number <= _applied_version(conn):
+                conn.rollback()
+                continue
+            logging.info(f"Applying schema migration {number} ({name})")
+            apply(conn, backend)
+            conn.execute('''
+                INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)
+            ''', (number, name, datetime.now().isoformat()))
+            backend.set_user_version(conn, number)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    version = _applied_version(conn)
+    conn.commit()
+    return version
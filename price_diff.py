@@ -0,0 +1,41 @@
+import logging
+
+def diff_prices(snapshot, prices):
+    # snapshot: {(fuel_type, station): price}，即数据库中的当前价格
+    # prices: scrape_fuel_prices() 的返回值
+    changes = {
+        'new': [],
+        'changed': [],
+        'removed': [],
+        'unchanged': []
+    }
+
+    # 同一次抓取中重复出现的加油站，以最后一条为准
+    scraped = {}
+    for fuel_type, price_list in prices.items():
+        for price in price_list:
+            scraped[(fuel_type, price['station'])] = dict(price, fuel_type=fuel_type)
+
+    for key, entry in scraped.items():
+        if key not in snapshot:
+            changes['new'].append(entry)
+        elif snapshot[key] != entry['price']:
+            entry['old_price'] = snapshot[key]
+            changes['changed'].append(entry)
+        else:
+            changes['unchanged'].append(entry)
+
+    for key, old_price in snapshot.items():
+        if key not in scraped:
+            fuel_type, station = key
+            changes['removed'].append({
+                'fuel_type': fuel_type,
+                'station': station,
+                'old_price': old_price
+            })
+
+    logging.info(
+        f"Price diff: {len(changes['new'])} new, {len(changes['changed'])} changed, "
+        f"{len(changes['removed'])} removed, {len(changes['unchanged'])} unchanged"
+    )
+    return changes
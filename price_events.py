@@ -0,0 +1,231 @@
+import json
+import logging
+import math
+import queue
+import threading
+from collections import deque
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+
+EVENT_FIELDS = ['id', 'kind', 'fuel_type', 'station', 'city', 'old_price', 'price', 'updated', 'created_at']
+# SSE 心跳间隔 (秒)，用于及时发现已断开的连接
+HEARTBEAT_INTERVAL = 15
+MAX_POLL_TIMEOUT = 60
+
+class Subscription:
+    # 单个客户端的有界队列；队列满时该客户端被判定为慢消费者并断开
+    def __init__(self, fuel_types=None, stations=None, maxsize=1000):
+        self.fuel_types = set(fuel_types) if fuel_types else None
+        self.stations = set(stations) if stations else None
+        self.queue = queue.Queue(maxsize)
+        self.dropped = False
+        # 请求的起始事件已不在内存中，客户端需要重新加载页面
+        self.stale = False
+        # 订阅时已发布的最后一个事件 id
+        self.start_id = 0
+
+    def matches(self, event):
+        return ((self.fuel_types is None or event['fuel_type'] in self.fuel_types) and
+                (self.stations is None or event['station'] in self.stations))
+
+    def get(self, timeout):
+        # 返回已到达的所有事件；超时返回 []，被断开后返回 None
+        if self.dropped:
+            return None
+        try:
+            events = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return None if self.dropped else []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                return events
+
+class EventBus:
+    # 进程内的发布/订阅：每次抓取发布一次，事件分发到各客户端的队列
+    def __init__(self, max_queue=1000, history=1000):
+        self.max_queue = max_queue
+        self._history = deque(maxlen=history)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.last_id = 0
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, fuel_types=None, stations=None, after=None):
+        subscription = Subscription(fuel_types, stations, self.max_queue)
+        with self._lock:
+            subscription.start_id = self.last_id
+            if after is not None and after < self.last_id:
+                # 断线重连：补发内存中 after 之后的事件
+                if not self._history or self._history[0]['id'] > after + 1:
+                    subscription.stale = True
+                backlog = [event for event in self._history if event['id'] > after and subscription.matches(event)]
+                for event in backlog[-self.max_queue:]:
+                    subscription.queue.put_nowait(event)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, events):
+        with self._lock:
+            self._history.extend(events)
+            if events:
+                self.last_id = max(self.last_id, events[-1]['id'])
+                self.published += len(events)
+            for subscription in list(self._subscribers):
+                for event in events:
+                    if not subscription.matches(event):
+                        continue
+                    try:
+                        subscription.queue.put_nowait(event)
+                    except queue.Full:
+                        subscription.dropped = True
+                        self._subscribers.discard(subscription)
+                        self.dropped += 1
+                        logging.warning("Dropping slow price event subscriber")
+                        break
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'last_id': self.last_id,
+                'published': self.published,
+                'dropped': self.dropped
+            }
+
+class PriceEventRelay:
+    # 价格事件由 job runner 写入 price_events 表；每个 Web 进程只用一个线程读取新事件并发布到 EventBus
+    def __init__(self, get_db, bus, poll_interval=2.0, batch_size=500):
+        self.get_db = get_db
+        self.bus = bus
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def start(self):
+        # 第一个客户端连接时才启动
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self.bus.last_id = self.get_db().get_last_price_event_id()
+            self._thread = threading.Thread(target=self._run, name="price-event-relay", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def poll_once(self):
+        rows = self.get_db().get_price_events_after(self.bus.last_id, self.batch_size)
+        events = [dict(zip(EVENT_FIELDS, row)) for row in rows]
+        if events:
+            self.bus.publish(events)
+        return len(events)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                # 一次积压较多时连续读取，直到追上
+                while self.poll_once() == self.batch_size:
+                    pass
+            except Exception as e:
+                logging.error(f"Error relaying price events: {str(e)}", exc_info=True)
+            # 两次轮询之间不占用数据库连接
+            try:
+                self.get_db().release()
+            except Exception as e:
+                logging.error(f"Error releasing database connection: {str(e)}", exc_info=True)
+            self._stopped.wait(self.poll_interval)
+
+def _split_arg(name):
+    values = [value.strip() for value in request.args.get(name, '').split(',') if value.strip()]
+    return values or None
+
+def _parse_after(value):
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError("after must be an integer event id")
+
+def format_sse(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return '\n'.join(lines) + '\n\n'
+
+def create_events_blueprint(get_db, bus=None, relay=None):
+    # /events/prices：SSE 推送；/events/prices/poll：长轮询
+    # 两者都支持 ?fuel_type=95 E10,Diesel&station=... 过滤
+    events_bp = Blueprint('events', __name__, url_prefix='/events')
+    bus = bus or EventBus()
+    relay = relay or PriceEventRelay(get_db, bus)
+    events_bp.bus = bus
+    events_bp.relay = relay
+
+    @events_bp.route('/prices')
+    def stream_prices():
+        try:
+            after = _parse_after(request.headers.get('Last-Event-ID') or request.args.get('after'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        relay.start()
+        subscription = bus.subscribe(_split_arg('fuel_type'), _split_arg('station'), after)
+
+        def generate():
+            try:
+                # 建议客户端断线 5 秒后重连
+                yield "retry: 5000\n\n"
+                if subscription.stale:
+                    yield format_sse('reset', {'last_id': bus.last_id})
+                while True:
+                    events = subscription.get(HEARTBEAT_INTERVAL)
+                    if events is None:
+                        # 被判定为慢消费者：通知客户端重新加载后断开
+                        yield format_sse('reset', {'last_id': bus.last_id})
+                        return
+                    if not events:
+                        yield ": keepalive\n\n"
+                    for event in events:
+                        yield format_sse('price', event, event['id'])
+            finally:
+                bus.unsubscribe(subscription)
+
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+    @events_bp.route('/prices/poll')
+    def poll_prices():
+        try:
+            after = _parse_after(request.args.get('after'))
+            timeout = float(request.args.get('timeout', 25))
+            # nan 经过 min / max 后仍为 nan，queue.get(timeout=nan) 会一直等待
+            if not math.isfinite(timeout):
+                raise ValueError("timeout must be a finite number of seconds")
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        timeout = min(max(timeout, 0), MAX_POLL_TIMEOUT)
+        relay.start()
+        subscription = bus.subscribe(_split_arg('fuel_type'), _split_arg('station'), after)
+        try:
+            events = subscription.get(timeout)
+        finally:
+            bus.unsubscribe(subscription)
+        # 客户端下次请求时把 last_id 作为 after 传回
+        last_id = events[-1]['id'] if events else max(after or 0, subscription.start_id)
+        return jsonify({
+            "events": events or [],
+            "last_id": last_id,
+            "reset": subscription.stale or events is None
+        }), 200
+
+    return events_bp
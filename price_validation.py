@@ -0,0 +1,177 @@
+import logging
+import os
+from collections import deque
+from statistics import median
+
+# 正态分布下 MAD 与标准差的换算系数
+MAD_SCALE = 0.6745
+
+class ScrapeValidationError(ValueError):
+    # 异常价格比例过高，本次抓取应整体放弃；outliers 为被判定异常的价格
+    def __init__(self, message, outliers):
+        super().__init__(message)
+        self.outliers = outliers
+
+def robust_baseline(recent):
+    # 返回 (中位数, MAD)
+    center = median(recent)
+    return center, median(abs(price - center) for price in recent)
+
+class PriceValidator:
+    # 抓取结果写入数据库前的校验：
+    # - 有历史价格的加油站：与该站最近 window 次价格的中位数比较 (robust z-score)
+    # - 没有历史的加油站：与本次抓取中同城同燃料价格的中位数比较
+    # 每个加油站的中位数和 MAD 只在价格变化时重新计算 (window 个值)，每次抓取的校验是 O(1)/条
+    # 持续的价格变化不会被永远隔离：
+    # - 同城大部分加油站一起变化时，按同城加油站相对各自中位数的偏移中位数平移参考价格
+    # - 同一加油站连续 recovery_runs 次被隔离且价格相差不超过 recovery_tolerance 时，接受新价格并以其作为基线
+    def __init__(self, get_db, window=20, z_threshold=6.0, mad_floor=0.03, city_deviation=0.25,
+                 max_outlier_fraction=0.3, min_history=3, min_city_size=3, recovery_runs=3,
+                 recovery_tolerance=0.05):
+        self.get_db = get_db
+        self.window = window
+        self.z_threshold = z_threshold
+        # 价格长期不变时 MAD 为 0，用下限避免正常的小幅调价被判为异常
+        self.mad_floor = mad_floor
+        self.city_deviation = city_deviation
+        self.max_outlier_fraction = max_outlier_fraction
+        self.min_history = min_history
+        self.min_city_size = min_city_size
+        self.recovery_runs = recovery_runs
+        self.recovery_tolerance = recovery_tolerance
+        self._baselines = None
+        # {(fuel_type, station): [连续被隔离的价格]}，只保存在内存中
+        self._pending = {}
+        self._version = None
+
+    def _prices_version(self, db):
+        return db.get_data_versions().get('prices', (0, None))[0]
+
+    def _load(self, fuel_types):
+        # 价格只由本进程写入时一直使用内存中的基线；其他进程写入过价格 (版本号变化) 时重新读取
+        db = self.get_db()
+        if self._baselines is not None and self._prices_version(db) == self._version:
+            return
+        recent = db.get_price_baselines()
+        if not recent:
+            # 首次运行：用历史价格初始化，并保存下来
+            for fuel_type in fuel_types:
+                for rows in db.iter_price_history_rows(fuel_type):
+                    for _, station, _, price, _ in rows:
+                        recent.setdefault((fuel_type, station), deque(maxlen=self.window)).append(price)
+            recent = {key: list(prices) for key, prices in recent.items()}
+            if recent:
+                db.save_price_baselines(recent)
+                logging.info(f"Initialized price baselines for {len(recent)} stations from price history")
+        self._baselines = {}
+        for key, prices in recent.items():
+            prices = deque(prices, maxlen=self.window)
+            self._baselines[key] = (prices,) + robust_baseline(prices)
+        self._version = self._prices_version(db)
+
+    def _city_medians(self, prices):
+        groups = {}
+        for fuel_type, price_list in prices.items():
+            for entry in price_list:
+                groups.setdefault((fuel_type, entry.get('city')), []).append(entry['price'])
+        return {key: median(values) for key, values in groups.items() if len(values) >= self.min_city_size}
+
+    def _city_shifts(self, prices):
+        # 同城同燃料有历史的加油站，本次价格相对各自中位数的偏移的中位数；整体调价时不为 0
+        groups = {}
+        for fuel_type, price_list in prices.items():
+            for entry in price_list:
+                baseline = self._baselines.get((fuel_type, entry['station']))
+                if baseline is not None and len(baseline[0]) >= self.min_history and entry['price'] > 0:
+                    groups.setdefault((fuel_type, entry.get('city')), []).append(entry['price'] - baseline[1])
+        return {key: median(values) for key, values in groups.items() if len(values) >= self.min_city_size}
+
+    def score(self, fuel_type, entry, city_medians, city_shifts=None):
+        # 返回 None (正常) 或 (原因, 分数, 参考价格)
+        price = entry['price']
+        if price <= 0:
+            return 'non_positive', 0.0, None
+        baseline = self._baselines.get((fuel_type, entry['station']))
+        if baseline is not None and len(baseline[0]) >= self.min_history:
+            _, center, mad = baseline
+            center += (city_shifts or {}).get((fuel_type, entry.get('city')), 0.0)
+            z = MAD_SCALE * abs(price - center) / max(mad, self.mad_floor)
+            if z > self.z_threshold:
+                return 'station_history', z, center
+            return None
+        city_median = city_medians.get((fuel_type, entry.get('city')))
+        if city_median:
+            deviation = abs(price - city_median) / city_median
+            if deviation > self.city_deviation:
+                return 'city_median', deviation, city_median
+        return None
+
+    def validate(self, prices):
+        # 返回 (通过校验的价格，结构与 prices 相同, 异常价格列表)
+        self._load(prices.keys())
+        city_medians = self._city_medians(prices)
+        city_shifts = self._city_shifts(prices)
+        accepted = {}
+        outliers = []
+        for fuel_type, price_list in prices.items():
+            accepted[fuel_type] = []
+            for entry in price_list:
+                key = (fuel_type, entry['station'])
+                result = self.score(fuel_type, entry, city_medians, city_shifts)
+                if result is None:
+                    self._pending.pop(key, None)
+                    accepted[fuel_type].append(entry)
+                elif result[0] != 'non_positive' and self._recovered(key, entry['price']):
+                    logging.warning(f"Accepting new price level {entry['price']} for {fuel_type} at "
+                                    f"{entry['station']} after {self.recovery_runs} quarantined scrapes")
+                    accepted[fuel_type].append(entry)
+                else:
+                    reason, score, baseline = result
+                    outliers.append(dict(entry, fuel_type=fuel_type, reason=reason, score=score, baseline=baseline))
+
+        total = sum(len(price_list) for price_list in prices.values())
+        if outliers:
+            logging.warning(f"Quarantined {len(outliers)} of {total} scraped prices")
+        if total and len(outliers) > self.max_outlier_fraction * total:
+            raise ScrapeValidationError(f"{len(outliers)} of {total} scraped prices look anomalous", outliers)
+        return accepted, outliers
+
+    def _recovered(self, key, price):
+        # 记录一次隔离；连续 recovery_runs 次价格一致时以这些价格重置该加油站的基线并返回 True
+        # 放弃整次抓取时也会计数，所以部分加油站同时调价不会让每次抓取都失败
+        pending = self._pending.get(key, [])
+        pending.append(price)
+        if max(pending) - min(pending) > self.recovery_tolerance:
+            pending = [price]
+        if len(pending) < self.recovery_runs:
+            self._pending[key] = pending
+            return False
+        del self._pending[key]
+        prices = deque(pending, maxlen=self.window)
+        self._baselines[key] = (prices,) + robust_baseline(prices)
+        return True
+
+    def record(self, changes):
+        # 把本次写入的新价格加入各加油站的窗口，只重新计算这些加油站的中位数和 MAD
+        updated = {}
+        for entry in changes['new'] + changes['changed']:
+            key = (entry['fuel_type'], entry['station'])
+            prices = self._baselines.get(key, (deque(maxlen=self.window),))[0]
+            prices.append(entry['price'])
+            self._baselines[key] = (prices,) + robust_baseline(prices)
+            updated[key] = list(prices)
+        db = self.get_db()
+        if updated:
+            db.save_price_baselines(updated)
+        self._version = self._prices_version(db)
+
+def validator_from_env(get_db):
+    return PriceValidator(
+        get_db,
+        z_threshold=float(os.getenv('PRICE_OUTLIER_Z', '6')),
+        mad_floor=float(os.getenv('PRICE_MAD_FLOOR', '0.03')),
+        city_deviation=float(os.getenv('PRICE_CITY_DEVIATION', '0.25')),
+        max_outlier_fraction=float(os.getenv('PRICE_MAX_OUTLIER_FRACTION', '0.3')),
+        recovery_runs=int(os.getenv('PRICE_RECOVERY_RUNS', '3')),
+        recovery_tolerance=float(os.getenv('PRICE_RECOVERY_TOLERANCE', '0.05'))
+    )
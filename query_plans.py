@@ -0,0 +1,110 @@
+import random
+from datetime import datetime, timedelta
+from database import Database
+
+# benchmark.py (db / load / plans) 和 tests/test_query_plans.py 共用的合成数据集和执行计划检查
+
+FUEL_TYPES = ['95 E10', '98 E5', 'Diesel']
+
+def generate_dataset(path, stations=300, subscribers=10000, hours=24 * 30, seed=0):
+    # 在 path 生成 SQLite 数据库：stations 个加油站 (奥卢附近)、subscribers 个订阅、
+    # 每个加油站每种燃料 hours 小时的价格历史 (平均每 6 小时变化一次)
+    rng = random.Random(seed)
+    db = Database(path)
+    names = [f"Station {i}" for i in range(stations)]
+    cities = ['oulu', 'kempele', 'kiiminki', 'haukipudas']
+    coords = [(65.0 + rng.uniform(-0.15, 0.15), 25.47 + rng.uniform(-0.35, 0.35)) for _ in names]
+    db.conn.executemany('INSERT INTO stations (name, latitude, longitude) VALUES (?, ?, ?)',
+                        [(name, lat, lon) for name, (lat, lon) in zip(names, coords)])
+
+    end = datetime.now().replace(minute=0, second=0, microsecond=0)
+    start = end - timedelta(hours=hours - 1)
+    history = []
+    current = []
+    for fuel_type, base in zip(FUEL_TYPES, (1.85, 1.95, 1.80)):
+        for name in names:
+            city = rng.choice(cities)
+            price = round(base + rng.uniform(-0.1, 0.1), 3)
+            timestamp = start.isoformat()
+            for hour in range(hours):
+                if hour == 0 or rng.random() < 1 / 6:
+                    price = round(min(max(price + rng.uniform(-0.03, 0.03), base - 0.2), base + 0.2), 3)
+                    timestamp = (start + timedelta(hours=hour)).isoformat()
+                    history.append((fuel_type, name, price, '1 hour ago', timestamp, city))
+            current.append((fuel_type, name, price, '1 hour ago', timestamp, city))
+    db.conn.executemany('''
+        INSERT INTO price_history (fuel_type, station, price, updated, timestamp, city) VALUES (?, ?, ?, ?, ?, ?)
+    ''', history)
+    db.conn.executemany('''
+        INSERT INTO fuel_prices (fuel_type, station, price, updated, timestamp, city) VALUES (?, ?, ?, ?, ?, ?)
+    ''', current)
+
+    users = []
+    for i in range(subscribers):
+        lat, lon = rng.choice(coords)
+        located = rng.random() < 0.5
+        users.append((f"user{i}@example.com", round(rng.uniform(1.6, 2.0), 2), rng.choice(FUEL_TYPES),
+                      lat if located else None, lon if located else None,
+                      rng.choice(['instant', 'instant', 'daily', 'weekly'])))
+    db.conn.executemany('''
+        INSERT INTO users (email, threshold, fuel_type, latitude, longitude, alert_mode) VALUES (?, ?, ?, ?, ?, ?)
+    ''', users)
+    for resource in ('prices', 'stations', 'subscriptions'):
+        db._touch_data_version(resource)
+    db.conn.commit()
+    return db, {'stations': stations, 'subscribers': subscribers, 'hours': hours,
+                'history_rows': len(history), 'coords': coords}
+
+def plan_queries(db):
+    # 请求、提醒和后台任务路径上的查询；get_all_subscriptions 等本来就读取整张表的查询不在此列
+    station = 'Station 0'
+    email = 'user0@example.com'
+    return {
+        'get_subscriptions_for_price': lambda: db.get_subscriptions_for_price('95 E10', 1.8),
+        'get_current_prices': lambda: db.get_current_prices('95 E10'),
+        'get_latest_top10_fuel_prices': lambda: db.get_latest_top10_fuel_prices('95 E10'),
+        'get_latest_top10_fuel_prices_with_locations': lambda: db.get_latest_top10_fuel_prices_with_locations('95 E10'),
+        'get_price_history': lambda: db.get_price_history('95 E10', station),
+        'iter_price_history_rows': lambda: list(db.iter_price_history_rows('95 E10')),
+        'get_latest_price_history_timestamp': lambda: db.get_latest_price_history_timestamp('95 E10'),
+        'iter_price_history_window': lambda: list(db.iter_price_history_window('95 E10', '2000-01-01')),
+        'get_price_stats': lambda: db.get_price_stats('95 E10'),
+        'get_station_price_stats': lambda: db.get_station_price_stats('95 E10', station),
+        'get_station_location': lambda: db.get_station_location(station),
+        'get_user_location': lambda: db.get_user_location(email),
+        'get_user_vehicle': lambda: db.get_user_vehicle(email),
+        'get_geocode': lambda: db.get_geocode('address', 'oulu'),
+        'get_page(fuel_prices)': lambda: db.get_page('fuel_prices', ['fuel_type', 'station', 'price'],
+                                                     ['fuel_type', 'station'], limit=50),
+        'get_page(users, fuel_type)': lambda: db.get_page('users', ['email', 'threshold'], ['email'],
+                                                          filters={'fuel_type': '95 E10'}, limit=50),
+        'iter_rows(fuel_prices, since)': lambda: list(db.iter_rows('fuel_prices', ['station', 'price'],
+                                                                   time_column='timestamp', since='2000-01-01')),
+        'get_digest_alerts': lambda: db.get_digest_alerts('daily'),
+        'claim_pending_emails': lambda: db.claim_pending_emails(10),
+        'get_lease': lambda: db.get_lease('scrape'),
+        'get_job_runs': lambda: db.get_job_runs(),
+        'get_job_runs(name)': lambda: db.get_job_runs('scrape'),
+        'get_quarantined_prices': lambda: db.get_quarantined_prices(),
+        'get_price_events_after': lambda: db.get_price_events_after(0),
+    }
+
+def full_scans(plan):
+    # "SCAN <表>" 后面没有 USING ... INDEX / PRIMARY KEY 即为全表扫描；扫描子查询结果 (CO-ROUTINE) 不算
+    subqueries = {step.split(' ', 1)[1] for step in plan if step.startswith(('CO-ROUTINE ', 'MATERIALIZE '))}
+    return [step for step in plan
+            if step.startswith('SCAN ') and ' USING ' not in step and step[len('SCAN '):] not in subqueries]
+
+def query_plan(db, query):
+    # 记录 query 实际执行的 SQL，返回其中 SELECT 语句的 EXPLAIN QUERY PLAN 步骤
+    statements = []
+    db.conn.set_trace_callback(statements.append)
+    try:
+        query()
+    finally:
+        db.conn.set_trace_callback(None)
+    plan = []
+    for sql in statements:
+        if sql.lstrip().upper().startswith('SELECT'):
+            plan.extend(row[3] for row in db.conn.execute(f'EXPLAIN QUERY PLAN {sql}'))
+    return plan
@@ -0,0 +1,360 @@
+import argparse
+import bz2
+import gzip
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from datetime import datetime
+import numpy as np
+from distance_calculator import EARTH_RADIUS_KM, calculate_distances_and_times
+
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# 没有 maxspeed 标签时各类道路的默认速度 (km/h)；不在表中的 highway (人行道、自行车道等) 不参与路径计算
+DEFAULT_SPEEDS_KMH = {
+    'motorway': 100, 'motorway_link': 60,
+    'trunk': 80, 'trunk_link': 50,
+    'primary': 60, 'primary_link': 40,
+    'secondary': 50, 'secondary_link': 40,
+    'tertiary': 40, 'tertiary_link': 30,
+    'unclassified': 40, 'residential': 30,
+    'living_street': 10, 'service': 20, 'road': 30,
+}
+MPH_TO_KMH = 1.609344
+
+# 道路图：节点坐标 + 反向边的 CSR (indptr / sources)，边上为行驶时间 (分钟) 和长度 (km)
+RoadGraph = namedtuple('RoadGraph', ['lats', 'lons', 'indptr', 'sources', 'minutes', 'lengths'])
+
+def _open_extract(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+def _speed_kmh(tags):
+    # maxspeed 无法解析 ("none"、"signals" 等) 或不是正数 (0 会使行驶时间变成 inf) 时使用道路类型的默认速度
+    maxspeed = tags.get('maxspeed', '').strip().lower()
+    try:
+        if maxspeed.endswith('mph'):
+            speed = float(maxspeed[:-3]) * MPH_TO_KMH
+        else:
+            speed = float(maxspeed)
+    except ValueError:
+        speed = None
+    if speed is None or not math.isfinite(speed) or speed <= 0:
+        return DEFAULT_SPEEDS_KMH[tags['highway']]
+    return speed
+
+def _direction(tags):
+    # 1 只能正向，-1 只能反向，0 双向
+    oneway = tags.get('oneway', '').lower()
+    if oneway in ('yes', 'true', '1'):
+        return 1
+    if oneway == '-1':
+        return -1
+    if oneway == 'no':
+        return 0
+    return 1 if tags['highway'] == 'motorway' or tags.get('junction') == 'roundabout' else 0
+
+def _equirectangular_km(lat1, lon1, lat2, lon2):
+    # 短距离 (道路的一段、吸附到最近节点) 用等距矩形近似即可
+    x = (lon2 - lon1) * np.cos(np.radians((lat1 + lat2) / 2))
+    return KM_PER_DEGREE * np.hypot(lat2 - lat1, x)
+
+def load_osm_graph(path):
+    # 读取 OSM XML 导出 (.osm / .osm.gz / .osm.bz2，PBF 需先用 osmium cat 转换)，只保留可行车的道路
+    node_coords = {}
+    ways = []
+    for _, element in ET.iterparse(_open_extract(path), events=('end',)):
+        if element.tag == 'node':
+            node_coords[int(element.get('id'))] = (float(element.get('lat')), float(element.get('lon')))
+            element.clear()
+        elif element.tag == 'way':
+            tags = {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+            if tags.get('highway') in DEFAULT_SPEEDS_KMH:
+                refs = [int(nd.get('ref')) for nd in element.iter('nd')]
+                ways.append((refs, _speed_kmh(tags), _direction(tags)))
+            element.clear()
+
+    node_ids = {}
+    src, dst, speeds = [], [], []
+    for refs, speed, direction in ways:
+        refs = [ref for ref in refs if ref in node_coords]
+        for a, b in zip(refs, refs[1:]):
+            a = node_ids.setdefault(a, len(node_ids))
+            b = node_ids.setdefault(b, len(node_ids))
+            if direction >= 0:
+                src.append(a)
+                dst.append(b)
+                speeds.append(speed)
+            if direction <= 0:
+                src.append(b)
+                dst.append(a)
+                speeds.append(speed)
+    if not node_ids:
+        raise ValueError(f"No drivable roads found in {path}")
+
+    coords = np.array([node_coords[node_id] for node_id in node_ids], dtype=np.float64)
+    graph = build_graph(coords[:, 0], coords[:, 1], np.array(src), np.array(dst), np.array(speeds, dtype=np.float64))
+    logging.info(f"Loaded road graph from {path}: {len(coords)} nodes, {len(src)} edges")
+    return graph
+
+def build_graph(lats, lons, src, dst, speeds):
+    # 按终点分组存储边 (反向图)：从加油站出发做 Dijkstra，得到的是各节点到加油站的行驶时间
+    lengths = _equirectangular_km(lats[src], lons[src], lats[dst], lons[dst])
+    order = np.argsort(dst, kind='stable')
+    indptr = np.zeros(len(lats) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(dst, minlength=len(lats)), out=indptr[1:])
+    return RoadGraph(lats, lons, indptr, src[order], (lengths / speeds * 60)[order], lengths[order])
+
+def _shortest_paths_to(adjacency, target, max_minutes):
+    # 反向图上的 Dijkstra，返回 {node: (分钟, km)}，超过 max_minutes 的节点不展开
+    indptr, sources, minutes, lengths = adjacency
+    best = {target: (0.0, 0.0)}
+    heap = [(0.0, 0.0, target)]
+    while heap:
+        time_to, length_to, node = heapq.heappop(heap)
+        if time_to > best[node][0]:
+            continue
+        for edge in range(indptr[node], indptr[node + 1]):
+            candidate = time_to + minutes[edge]
+            if candidate > max_minutes:
+                continue
+            source = sources[edge]
+            known = best.get(source)
+            if known is None or candidate < known[0]:
+                best[source] = (candidate, length_to + lengths[edge])
+                heapq.heappush(heap, (candidate, length_to + lengths[edge], source))
+    return best
+
+def _nearest_nodes(graph, lats, lons, chunk_size=256):
+    # 每个点最近的道路节点及距离 (km)
+    nodes = np.empty(len(lats), dtype=np.int64)
+    distances = np.empty(len(lats))
+    for start in range(0, len(lats), chunk_size):
+        chunk_lats = lats[start:start + chunk_size, None]
+        chunk_lons = lons[start:start + chunk_size, None]
+        chunk = _equirectangular_km(chunk_lats, chunk_lons, graph.lats[None, :], graph.lons[None, :])
+        nodes[start:start + chunk_size] = chunk.argmin(axis=1)
+        distances[start:start + chunk_size] = chunk.min(axis=1)
+    return nodes, distances
+
+class GridSpec:
+    # 覆盖道路图范围的经纬度网格，格子按行优先编号
+    def __init__(self, origin_lat, origin_lon, cell_lat, cell_lon, rows, cols):
+        self.origin_lat = origin_lat
+        self.origin_lon = origin_lon
+        self.cell_lat = cell_lat
+        self.cell_lon = cell_lon
+        self.rows = rows
+        self.cols = cols
+
+    @classmethod
+    def covering(cls, lats, lons, cell_km):
+        cell_lat = cell_km / KM_PER_DEGREE
+        cell_lon = cell_km / (KM_PER_DEGREE * max(math.cos(math.radians(float(np.mean(lats)))), 0.01))
+        rows = int((lats.max() - lats.min()) // cell_lat) + 1
+        cols = int((lons.max() - lons.min()) // cell_lon) + 1
+        return cls(float(lats.min()), float(lons.min()), cell_lat, cell_lon, rows, cols)
+
+    @property
+    def size(self):
+        return self.rows * self.cols
+
+    def cell(self, lat, lon):
+        # 返回格子编号，不在网格内时返回 None
+        row = math.floor((lat - self.origin_lat) / self.cell_lat)
+        col = math.floor((lon - self.origin_lon) / self.cell_lon)
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            return row * self.cols + col
+        return None
+
+    def cell_nodes(self, graph):
+        # 每个格子中离格子中心最近的道路节点，没有道路的格子为 -1
+        rows = ((graph.lats - self.origin_lat) // self.cell_lat).astype(np.int64)
+        cols = ((graph.lons - self.origin_lon) // self.cell_lon).astype(np.int64)
+        cells = rows * self.cols + cols
+        center_lats = self.origin_lat + (rows + 0.5) * self.cell_lat
+        center_lons = self.origin_lon + (cols + 0.5) * self.cell_lon
+        offsets = _equirectangular_km(graph.lats, graph.lons, center_lats, center_lons)
+        order = np.lexsort((offsets, cells))
+        first = np.r_[True, cells[order][1:] != cells[order][:-1]]
+        nodes = np.full(self.size, -1, dtype=np.int64)
+        nodes[cells[order][first]] = order[first]
+        return nodes
+
+    def to_dict(self):
+        return {'origin': [self.origin_lat, self.origin_lon], 'cell': [self.cell_lat, self.cell_lon],
+                'shape': [self.rows, self.cols]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(*data['origin'], *data['cell'], *data['shape'])
+
+def _station_key(lat, lon):
+    return round(float(lat), 6), round(float(lon), 6)
+
+def build_route_matrix(graph, stations, cell_km=0.5, max_minutes=60, max_snap_km=1.0):
+    # stations: [(name, latitude, longitude), ...]
+    # 返回 (grid, 加油站列表, 分钟矩阵, km 矩阵)；矩阵为 cells × stations 的 float32，
+    # 同一格子到所有加油站的值在内存中连续，查询时只读一行；不可达或超过 max_minutes 为 NaN
+    stations = [station for station in stations if station[1] is not None and station[2] is not None]
+    grid = GridSpec.covering(graph.lats, graph.lons, cell_km)
+    cell_nodes = grid.cell_nodes(graph)
+    has_node = cell_nodes >= 0
+    minutes = np.full((grid.size, len(stations)), np.nan, dtype=np.float32)
+    lengths = np.full((grid.size, len(stations)), np.nan, dtype=np.float32)
+
+    adjacency = (graph.indptr.tolist(), graph.sources.tolist(), graph.minutes.tolist(), graph.lengths.tolist())
+    station_nodes, snap_km = _nearest_nodes(graph, np.array([s[1] for s in stations], dtype=float),
+                                            np.array([s[2] for s in stations], dtype=float))
+    included = []
+    for column, (station, node, snap) in enumerate(zip(stations, station_nodes.tolist(), snap_km.tolist())):
+        if snap > max_snap_km:
+            # 加油站不在道路图范围内，查询时回退到直线距离
+            continue
+        best = _shortest_paths_to(adjacency, node, max_minutes)
+        reached = np.fromiter(best.keys(), dtype=np.int64, count=len(best))
+        values = np.array(list(best.values()))
+        by_node_minutes = np.full(len(graph.lats), np.nan)
+        by_node_lengths = np.full(len(graph.lats), np.nan)
+        by_node_minutes[reached] = values[:, 0]
+        by_node_lengths[reached] = values[:, 1] + snap
+        minutes[has_node, column] = by_node_minutes[cell_nodes[has_node]]
+        lengths[has_node, column] = by_node_lengths[cell_nodes[has_node]]
+        included.append(column)
+    logging.info(f"Built route matrix: {grid.size} cells × {len(stations)} stations "
+                 f"({len(stations) - len(included)} stations outside the road graph)")
+    return grid, stations, minutes, lengths
+
+class RouteTable:
+    # 预计算的行驶时间矩阵，以只读 memmap 打开，查询时只读用户所在格子的一行
+    def __init__(self, grid, stations, minutes, lengths, built_at=None):
+        self.grid = grid
+        self.stations = stations
+        self.minutes = minutes
+        self.lengths = lengths
+        self.built_at = built_at
+        self.columns = {_station_key(lat, lon): column for column, (_, lat, lon) in enumerate(stations)}
+
+    def __len__(self):
+        return len(self.stations)
+
+    def apply(self, user_lat, user_lon, station_lats, station_lons, distances, times):
+        # 用矩阵中的道路距离和时间覆盖 distances / times 中对应的项，矩阵中没有的保持不变
+        cell = self.grid.cell(user_lat, user_lon)
+        if cell is None:
+            return 0
+        positions = []
+        columns = []
+        for i, (lat, lon) in enumerate(zip(station_lats, station_lons)):
+            if lat is None or lon is None or lat != lat:
+                continue
+            column = self.columns.get(_station_key(lat, lon))
+            if column is not None:
+                positions.append(i)
+                columns.append(column)
+        if not columns:
+            return 0
+        # 从 memmap 中一次读出这一行里需要的列
+        minutes = self.minutes[cell, columns].astype(np.float64)
+        reachable = ~np.isnan(minutes)
+        positions = np.array(positions)[reachable]
+        times[positions] = np.round(minutes[reachable], 2)
+        distances[positions] = np.round(self.lengths[cell, columns][reachable].astype(np.float64), 2)
+        return len(positions)
+
+class RouteStore:
+    # 矩阵保存在 directory 中：routes.json 记录网格和加油站，矩阵文件名带构建时间，
+    # 新矩阵写完后才替换 routes.json，正在查询的进程继续使用已打开的旧文件
+    def __init__(self, directory):
+        self.directory = directory
+        self._table = None
+        self._manifest_mtime = None
+        self._lock = threading.Lock()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, 'routes.json')
+
+    def get(self):
+        # 没有矩阵时返回 None；routes.json 变化后重新打开
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime_ns
+        except OSError:
+            return None
+        if mtime == self._manifest_mtime:
+            return self._table
+        with self._lock:
+            if mtime != self._manifest_mtime:
+                self._table = self._open()
+                self._manifest_mtime = mtime
+        return self._table
+
+    def _open(self):
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+            minutes = np.load(os.path.join(self.directory, manifest['minutes']), mmap_mode='r')
+            lengths = np.load(os.path.join(self.directory, manifest['lengths']), mmap_mode='r')
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Could not open route matrix in {self.directory}: {str(e)}")
+            return None
+        return RouteTable(GridSpec.from_dict(manifest['grid']), [tuple(station) for station in manifest['stations']],
+                          minutes, lengths, manifest.get('built_at'))
+
+    def save(self, grid, stations, minutes, lengths, source=None):
+        os.makedirs(self.directory, exist_ok=True)
+        build_id = datetime.now().strftime('%Y%m%d%H%M%S')
+        names = {'minutes': f"minutes-{build_id}.npy", 'lengths': f"lengths-{build_id}.npy"}
+        for key, values in (('minutes', minutes), ('lengths', lengths)):
+            tmp_path = os.path.join(self.directory, f"{names[key]}.tmp")
+            with open(tmp_path, 'wb') as f:
+                np.save(f, values)
+            os.replace(tmp_path, os.path.join(self.directory, names[key]))
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(names, grid=grid.to_dict(), stations=[list(station) for station in stations],
+                           source=source, built_at=datetime.now().isoformat()), f)
+        os.replace(tmp_path, self.manifest_path)
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy') and name not in names.values():
+                os.remove(os.path.join(self.directory, name))
+
+_store = RouteStore(os.getenv('ROUTING_DIR', '/data/routing'))
+
+def get_route_table():
+    return _store.get()
+
+def route_distances_and_times(user_lat, user_lon, station_lats, station_lons, routes=None):
+    # 有预计算矩阵时返回道路距离和行驶时间；用户不在网格内、加油站不在矩阵中或不可达时回退到直线距离
+    distances, times = calculate_distances_and_times(user_lat, user_lon, station_lats, station_lons)
+    routes = routes if routes is not None else get_route_table()
+    if routes is not None:
+        routes.apply(user_lat, user_lon, station_lats, station_lons, distances, times)
+    return distances, times
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the station travel-time matrix from an OSM extract")
+    parser.add_argument('osm', help="OSM XML extract of the city (.osm, .osm.gz or .osm.bz2)")
+    parser.add_argument('--out', default=os.getenv('ROUTING_DIR', '/data/routing'))
+    parser.add_argument('--cell-km', type=float, default=0.5)
+    parser.add_argument('--max-minutes', type=float, default=60)
+    args = parser.parse_args()
+
+    from database import get_db
+    start = time.perf_counter()
+    graph = load_osm_graph(args.osm)
+    grid, stations, minutes, lengths = build_route_matrix(graph, get_db().get_all_stations(), args.cell_km, args.max_minutes)
+    RouteStore(args.out).save(grid, stations, minutes, lengths, source=os.path.basename(args.osm))
+    logging.info(f"Route matrix written to {args.out} in {time.perf_counter() - start:.1f}s")
+
+if __name__ == '__main__':
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
+    main()
@@ -1,92 +1,260 @@
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+from urllib3.util.retry import Retry
 import logging
+import os
 import re
+import threading
+import time
+from metrics import SCRAPE_FETCH_SECONDS, SCRAPE_PARSE_SECONDS, log_hot_path
 
-logging.basicConfig(level=logging.DEBUG)
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
 
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'DEBUG'))
+
+BASE_URL = "https://www.tankille.fi/{city}/"
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+FUEL_TYPES = ['95 E10', '98 E5', 'Diesel']
+
+# 价格正则和时间翻译表只编译一次
+PRICE_PATTERN = re.compile(r'(\d+[.,]\d+)')
+TIME_TRANSLATIONS = {
+    'tuntia sitten': 'hours ago',
+    'minuuttia sitten': 'minutes ago',
+    'sekuntia sitten': 'seconds ago',
+    'päivää sitten': 'days ago',
+    'juuri nyt': 'just now',
+    'tunti sitten': '1 hour ago',
+}
+TABLE_XPATH = "//table[contains(concat(' ', normalize-space(@class), ' '), ' table ')]"
+
+@lru_cache(maxsize=1024)
 def translate_time(finnish_time):
-    # 简单的翻译字典
-    translations = {
-        'tuntia sitten': 'hours ago',
-        'minuuttia sitten': 'minutes ago',
-        'sekuntia sitten': 'seconds ago',
-        'päivää sitten': 'days ago',
-        'juuri nyt': 'just now',
-        'tunti sitten': '1 hour ago',
-    }
-    
-    for finnish, english in translations.items():
+    # 页面上的时间文本重复度很高，结果按原文缓存
+    for finnish, english in TIME_TRANSLATIONS.items():
         if finnish in finnish_time:
             return finnish_time.replace(finnish, english)
     
     return finnish_time  # 如果没有匹配的翻译，返回原始字符串
 
-def scrape_fuel_prices():
-    try:
-        url = "https://www.tankille.fi/oulu/"
-        logging.info(f"Scraping fuel prices from {url}")
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers)
-        logging.debug(f"Response status code: {response.status_code}")
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        all_data = {
-            '95 E10': [],
-            '98 E5': [],
-            'Diesel': []
-        }
-
-        # 找到所有包含价格信息的表格
-        tables = soup.find_all('table', class_='table')
-        
-        for i, table in enumerate(tables):
-            if i == 0:
-                fuel_type = '95 E10'
-            elif i == 1:
-                fuel_type = '98 E5'
-            elif i == 2:
-                fuel_type = 'Diesel'
-            else:
-                logging.warning(f"Unexpected table found. Skipping.")
-                continue
-
-            logging.info(f"Processing table for fuel type: {fuel_type}")
-            
-            rows = table.find_all('tr')[1:]  # 跳过表头
-            
-            for row in rows:
-                cols = row.find_all('td')
-                if len(cols) >= 4:
-                    station = cols[1].text.strip()
-                    price_text = cols[2].text.strip()
-                    updated = translate_time(cols[3].text.strip())  # 翻译时间
-                    
-                    # 使用更灵活的正则表达式来匹配价格
-                    price_match = re.search(r'(\d+[.,]\d+)', price_text)
-                    if price_match:
-                        price = float(price_match.group(1).replace(',', '.'))
-                        all_data[fuel_type].append({
-                            'station': station,
-                            'price': price,
-                            'updated': updated,
-                            'timestamp': datetime.now().isoformat()
-                        })
+def _iter_tables_lxml(content):
+    # 直接用 lxml 解析，不构建 BeautifulSoup 树
+    if isinstance(content, bytes):
+        try:
+            content = content.decode('utf-8')
+        except UnicodeDecodeError:
+            pass
+    document = lxml.html.fromstring(content)
+    for table in document.xpath(TABLE_XPATH):
+        yield [[cell.text_content() for cell in row.iter('td')] for row in table.iter('tr')]
+
+def _iter_tables_soup(content, features):
+    # SoupStrainer 只解析 table 元素，跳过页面其余部分；class 在 find_all 中再过滤
+    soup = BeautifulSoup(content, features, parse_only=SoupStrainer('table'))
+    for table in soup.find_all('table', class_='table'):
+        yield [[cell.text for cell in row.find_all('td')] for row in table.find_all('tr')]
+
+PARSER_BACKENDS = {
+    'lxml': _iter_tables_lxml,
+    'bs4-lxml': lambda content: _iter_tables_soup(content, 'lxml'),
+    'html.parser': lambda content: _iter_tables_soup(content, 'html.parser'),
+}
+
+def default_parser_backend():
+    # SCRAPER_PARSER 可指定解析器；默认在安装了 lxml 时使用 lxml，否则回退到 html.parser
+    backend = os.getenv('SCRAPER_PARSER', 'auto')
+    if backend == 'auto':
+        return 'lxml' if lxml is not None else 'html.parser'
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown parser backend: {backend}")
+    if backend != 'html.parser' and lxml is None:
+        logging.warning(f"lxml is not installed, falling back to html.parser instead of {backend}")
+        return 'html.parser'
+    return backend
+
+class ScrapeLayoutError(ValueError):
+    # 页面的表格或列结构与预期不符，本次抓取应整体放弃
+    pass
+
+def parse_fuel_prices(content, backend=None):
+    backend = backend or default_parser_backend()
+    all_data = {fuel_type: [] for fuel_type in FUEL_TYPES}
+    tables = 0
+
+    # 找到所有包含价格信息的表格
+    for i, rows in enumerate(PARSER_BACKENDS[backend](content)):
+        tables += 1
+        if i >= len(FUEL_TYPES):
+            # 页面末尾多出的表格 (广告、说明等) 不影响前三个价格表，记录后跳过
+            logging.warning(f"Unexpected table found. Skipping.")
+            continue
+        fuel_type = FUEL_TYPES[i]
+
+        logging.info(f"Processing table for fuel type: {fuel_type}")
+
+        malformed = 0
+        for cols in rows[1:]:  # 跳过表头
+            if len(cols) >= 4:
+                station = cols[1].strip()
+                price_text = cols[2].strip()
+                updated = translate_time(cols[3].strip())  # 翻译时间
+                
+                # 使用更灵活的正则表达式来匹配价格
+                price_match = PRICE_PATTERN.search(price_text)
+                if price_match:
+                    price = float(price_match.group(1).replace(',', '.'))
+                    all_data[fuel_type].append({
+                        'station': station,
+                        'price': price,
+                        'updated': updated,
+                        'timestamp': datetime.now().isoformat()
+                    })
+                    if log_hot_path():
                         logging.info(f"Extracted: {fuel_type} - {station}: €{price} (Updated: {updated})")
-                    else:
-                        logging.warning(f"Could not extract price for {station} ({fuel_type}): {price_text}")
+                else:
+                    malformed += 1
+                    logging.warning(f"Could not extract price for {station} ({fuel_type}): {price_text}")
+            else:
+                malformed += 1
+
+        # 大部分行的列数或价格格式不对，说明页面结构变了
+        if rows[1:] and malformed * 2 > len(rows) - 1:
+            raise ScrapeLayoutError(f"{malformed} of {len(rows) - 1} rows in the {fuel_type} table do not match the expected columns")
+
+    if tables < len(FUEL_TYPES):
+        raise ScrapeLayoutError(f"Expected {len(FUEL_TYPES)} price tables, found {tables}")
+    return all_data
+
+class ScraperEngine:
+    # 并发抓取多个城市：共享 requests.Session，按主机限制并发数，支持超时、重试和条件请求
+    def __init__(self, cities=None, max_workers=8, per_host_limit=4, timeout=10, retries=3,
+                 base_url=BASE_URL):
+        self.cities = cities or default_cities()
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.base_url = base_url
+
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=['GET'])
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._host_limits = {}
+        self._lock = threading.Lock()
+        # url -> (etag, last_modified, prices)，用于 If-None-Match / If-Modified-Since
+        self._validators = {}
+
+    def _host_limit(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._host_limits[host]
+
+    def fetch_city(self, city):
+        url = self.base_url.format(city=city)
+        result = {'city': city, 'url': url, 'prices': None, 'not_modified': False, 'error': None, 'layout_changed': False}
+        start = time.perf_counter()
+        try:
+            headers = {}
+            cached = self._validators.get(url)
+            if cached:
+                etag, last_modified, _ = cached
+                if etag:
+                    headers['If-None-Match'] = etag
+                if last_modified:
+                    headers['If-Modified-Since'] = last_modified
+
+            with self._host_limit(url), SCRAPE_FETCH_SECONDS.time(city):
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            logging.debug(f"Response status code for {city}: {response.status_code}")
+
+            if response.status_code == 304 and cached:
+                # 页面未变化：沿用上次解析结果，只刷新时间戳
+                now = datetime.now().isoformat()
+                result['prices'] = {
+                    fuel_type: [dict(price, timestamp=now) for price in price_list]
+                    for fuel_type, price_list in cached[2].items()
+                }
+                result['not_modified'] = True
+            else:
+                response.raise_for_status()
+                with SCRAPE_PARSE_SECONDS.time(city):
+                    result['prices'] = parse_fuel_prices(response.content)
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+                if etag or last_modified:
+                    self._validators[url] = (etag, last_modified, result['prices'])
+        except Exception as e:
+            logging.error(f"Error scraping {url}: {str(e)}")
+            result['error'] = str(e)
+            result['layout_changed'] = isinstance(e, ScrapeLayoutError)
+        result['elapsed'] = time.perf_counter() - start
+        return result
+
+    def scrape(self, cities=None):
+        # 返回 {city: result}
+        cities = cities or self.cities
+        logging.info(f"Scraping fuel prices for {len(cities)} cities")
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(cities))) as executor:
+            results = list(executor.map(self.fetch_city, cities))
+        return {result['city']: result for result in results}
+
+    def close(self):
+        self.session.close()
+
+def default_cities():
+    return [city.strip() for city in os.getenv('SCRAPE_CITIES', 'oulu').split(',') if city.strip()]
+
+def merge_city_results(results):
+    # 合并各城市结果，供 Database.update_fuel_prices 一次性写入
+    all_data = {fuel_type: [] for fuel_type in FUEL_TYPES}
+    for city, result in results.items():
+        if result['prices'] is None:
+            continue
+        for fuel_type, price_list in result['prices'].items():
+            all_data.setdefault(fuel_type, []).extend(dict(price, city=city) for price in price_list)
+    return all_data
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    # 进程内共享一个引擎，以便复用连接和条件请求的缓存
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = ScraperEngine()
+        return _engine
+
+def scrape_fuel_prices(cities=None):
+    try:
+        results = get_engine().scrape(cities)
+        failed = [city for city, result in results.items() if result['error']]
+        # 任一城市页面结构变化都放弃本次抓取，避免写入错误的数据
+        changed = [city for city, result in results.items() if result['layout_changed']]
+        if changed:
+            raise ScrapeLayoutError(f"Page layout changed for: {', '.join(changed)}")
+        if len(failed) == len(results):
+            raise RuntimeError(f"Scraping failed for all cities: {', '.join(failed)}")
 
+        all_data = merge_city_results(results)
         for fuel_type, prices in all_data.items():
             logging.info(f"Scraped {len(prices)} prices for {fuel_type}")
-            
-            # 删除以下循环
-            # for price in prices:
-            #     latitude, longitude = get_coordinates(price['station'])
-            #     price['latitude'] = latitude
-            #     price['longitude'] = longitude
 
         total_prices = sum(len(prices) for prices in all_data.values())
         logging.info(f"Scraped {total_prices} price entries in total")
@@ -103,4 +271,4 @@ if __name__ == "__main__":
     for fuel_type, price_list in prices.items():
         print(f"\n{fuel_type}: {len(price_list)} prices")
         for price in price_list[:3]:  # 只打印前3个价格作为示例
-            print(f"{price['station']}: €{price['price']} (Updated: {price['updated']})")
\ No newline at end of file
+            print(f"{price['station']}: €{price['price']} (Updated: {price['updated']})")
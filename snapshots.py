@@ -0,0 +1,152 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime
+from flask import render_template
+from markupsafe import Markup, escape
+
+FUEL_TYPES = ['95 E10', '98 E5', 'Diesel']
+# 片段中预留的列位置，个性化页面在这里插入距离和时间列
+EXTRA_MARKER = '<!--extra-->'
+# 快照对应的数据版本 (data_versions 表)
+SNAPSHOT_RESOURCES = ('prices', 'stations', 'subscriptions')
+
+# versions: 生成快照时的数据版本；page: 匿名主页；fragments / locations: {fuel_type: ...}
+HomeSnapshot = namedtuple('HomeSnapshot', ['versions', 'page', 'page_hash', 'fragments', 'locations', 'created_at'])
+
+def content_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+def snapshot_versions(data_versions):
+    return tuple(data_versions.get(resource, (0, None))[0] for resource in SNAPSHOT_RESOURCES)
+
+def build_home_snapshot(app, db, versions=None):
+    # 在独立的请求上下文中渲染，避免把当前请求的 flash 消息渲染进共享的快照
+    versions = versions if versions is not None else snapshot_versions(db.get_data_versions())
+    with app.test_request_context('/'):
+        fragments = {}
+        locations = {}
+        for fuel_type in FUEL_TYPES:
+            rows = db.get_latest_top10_fuel_prices_with_locations(fuel_type)
+            fragments[fuel_type] = render_template('_price_table.html', fuel_type=fuel_type, prices=[row[:5] for row in rows])
+            locations[fuel_type] = [(row[5], row[6]) for row in rows]
+        page = render_template(
+            'index.html',
+            subscriptions=db.get_all_subscriptions(),
+            price_tables={fuel_type: Markup(fragment.replace(EXTRA_MARKER, '')) for fuel_type, fragment in fragments.items()},
+            user_email=None,
+            user_location=None
+        )
+    return HomeSnapshot(versions, page, content_hash(page), fragments, locations, datetime.now().isoformat())
+
+def _format_cell(value):
+    return f"<td>{escape(value) if value is not None else 'N/A'}</td>"
+
+def personalize_fragment(fragment, locations, user_location):
+    # 只计算并插入距离/时间两列，其余 HTML 直接复用片段
+    parts = fragment.split(EXTRA_MARKER)
+    distances = times = None
+    if user_location and user_location[0] is not None and locations:
+        # 距离计算依赖 NumPy，只在个性化页面中导入
+        from routing import route_distances_and_times
+        distances, times = route_distances_and_times(
+            user_location[0], user_location[1],
+            [lat if lat is not None else float('nan') for lat, _ in locations],
+            [lon if lon is not None else float('nan') for _, lon in locations]
+        )
+    cells = ['<th>Distance (km)</th><th>Time (minutes)</th>']
+    for i in range(len(parts) - 2):
+        if distances is None or distances[i] != distances[i]:
+            cells.append(_format_cell(None) + _format_cell(None))
+        else:
+            cells.append(_format_cell(float(distances[i])) + _format_cell(float(times[i])))
+    return Markup(''.join(part + cell for part, cell in zip(parts, cells)) + parts[-1])
+
+class SnapshotStore:
+    # 快照保存在内存中，同时按内容哈希写入磁盘，供其他 Web 进程和 job runner 共享
+    def __init__(self, directory):
+        self.directory = directory
+        self._snapshot = None
+        self._manifest_mtime = None
+        self._build_lock = threading.Lock()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, 'manifest.json')
+
+    def _read(self, name):
+        with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+            return f.read()
+
+    def _write(self, name, text):
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def _load_from_disk(self):
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime_ns
+            if mtime == self._manifest_mtime:
+                return self._snapshot
+            manifest = json.loads(self._read('manifest.json'))
+            page = self._read(f"index-{manifest['page']}.html")
+            fragments = {fuel_type: self._read(f"fragment-{digest}.html") for fuel_type, digest in manifest['fragments'].items()}
+        except (OSError, ValueError, KeyError):
+            return None
+        self._manifest_mtime = mtime
+        return HomeSnapshot(tuple(manifest['versions']), page, manifest['page'], fragments,
+                            {fuel_type: [tuple(location) for location in rows] for fuel_type, rows in manifest['locations'].items()},
+                            manifest['created_at'])
+
+    def get(self, versions):
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.versions == versions:
+            return snapshot
+        snapshot = self._load_from_disk()
+        if snapshot is not None and snapshot.versions == versions:
+            self._snapshot = snapshot
+            return snapshot
+        return None
+
+    def put(self, snapshot):
+        self._snapshot = snapshot
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            names = {f"index-{snapshot.page_hash}.html": snapshot.page}
+            fragment_hashes = {}
+            for fuel_type, fragment in snapshot.fragments.items():
+                fragment_hashes[fuel_type] = content_hash(fragment)
+                names[f"fragment-{fragment_hashes[fuel_type]}.html"] = fragment
+            for name, text in names.items():
+                if not os.path.exists(os.path.join(self.directory, name)):
+                    self._write(name, text)
+            self._write('manifest.json', json.dumps({
+                'versions': list(snapshot.versions),
+                'page': snapshot.page_hash,
+                'fragments': fragment_hashes,
+                'locations': snapshot.locations,
+                'created_at': snapshot.created_at
+            }))
+            self._manifest_mtime = os.stat(self.manifest_path).st_mtime_ns
+            # 清理不再被引用的旧文件；正在读取旧清单的进程读不到文件时会重新渲染
+            for name in os.listdir(self.directory):
+                if name.endswith('.html') and name not in names:
+                    os.remove(os.path.join(self.directory, name))
+        except OSError as e:
+            logging.warning(f"Could not write home page snapshot to {self.directory}: {str(e)}")
+
+    def get_or_build(self, versions, build):
+        snapshot = self.get(versions)
+        if snapshot is None:
+            # 同一进程内只渲染一次，其他请求等待结果
+            with self._build_lock:
+                snapshot = self.get(versions)
+                if snapshot is None:
+                    snapshot = build()
+                    self.put(snapshot)
+        return snapshot
@@ -0,0 +1,72 @@
+import heapq
+import math
+import numpy as np
+from distance_calculator import calculate_distances_and_times
+from routing import route_distances_and_times
+
+KM_PER_DEGREE = 111.32
+
+class StationIndex:
+    # 按经纬度网格分桶的加油站索引，查询时只计算半径范围内几个格子里的加油站
+    def __init__(self, stations, cell_km=2.0):
+        stations = [station for station in stations if station[1] is not None and station[2] is not None]
+        self.names = [station[0] for station in stations]
+        self.lats = np.array([station[1] for station in stations], dtype=float)
+        self.lons = np.array([station[2] for station in stations], dtype=float)
+        self.cell_deg = cell_km / KM_PER_DEGREE
+
+        buckets = {}
+        cells_i = np.floor(self.lats / self.cell_deg).astype(int)
+        cells_j = np.floor(self.lons / self.cell_deg).astype(int)
+        for position, cell in enumerate(zip(cells_i.tolist(), cells_j.tolist())):
+            buckets.setdefault(cell, []).append(position)
+        self.buckets = {cell: np.array(positions) for cell, positions in buckets.items()}
+
+    def __len__(self):
+        return len(self.names)
+
+    def _candidates(self, lat, lon, radius_km):
+        dlat = radius_km / KM_PER_DEGREE
+        dlon = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+        i_range = range(math.floor((lat - dlat) / self.cell_deg), math.floor((lat + dlat) / self.cell_deg) + 1)
+        j_range = range(math.floor((lon - dlon) / self.cell_deg), math.floor((lon + dlon) / self.cell_deg) + 1)
+
+        # 半径覆盖的格子比已有的桶还多时，直接遍历所有桶
+        if len(i_range) * len(j_range) > len(self.buckets):
+            cells = [cell for cell in self.buckets if cell[0] in i_range and cell[1] in j_range]
+        else:
+            cells = [(i, j) for i in i_range for j in j_range if (i, j) in self.buckets]
+        if not cells:
+            return np.array([], dtype=int)
+        return np.concatenate([self.buckets[cell] for cell in cells])
+
+    def within(self, lat, lon, radius_km):
+        # 返回 [(name, latitude, longitude, distance_km), ...]
+        candidates = self._candidates(lat, lon, radius_km)
+        if len(candidates) == 0:
+            return []
+        distances, _ = calculate_distances_and_times(lat, lon, self.lats[candidates], self.lons[candidates])
+        mask = distances <= radius_km
+        return [
+            (self.names[position], float(self.lats[position]), float(self.lons[position]), float(distance))
+            for position, distance in zip(candidates[mask].tolist(), distances[mask].tolist())
+        ]
+
+def cheapest_nearby(index, prices, lat, lon, radius_km, k=10):
+    # prices: {station: (price, updated)}；返回半径 (直线距离) 内最便宜的 k 个加油站
+    # 返回的距离和时间在有预计算矩阵时为道路距离和行驶时间
+    nearby = heapq.nsmallest(k, [
+        (prices[name][0], name, station_lat, station_lon)
+        for name, station_lat, station_lon, _ in index.within(lat, lon, radius_km)
+        if name in prices
+    ])
+    distances, times = route_distances_and_times(lat, lon, [row[2] for row in nearby], [row[3] for row in nearby])
+    return [{
+        'station': name,
+        'price': price,
+        'updated': prices[name][1],
+        'latitude': station_lat,
+        'longitude': station_lon,
+        'distance_km': float(distance),
+        'time_minutes': float(minutes)
+    } for (price, name, station_lat, station_lon), distance, minutes in zip(nearby, distances, times)]
@@ -0,0 +1,137 @@
+import hashlib
+import http.server
+import random
+import socketserver
+import threading
+import time
+
+# 测试和 benchmark.py 共用的本地模拟服务 (SMTP 服务器、tankille.fi 页面)
+
+class StandInSMTPHandler(socketserver.StreamRequestHandler):
+    # 本地模拟 SMTP 服务器：connect_delay 模拟 TLS 握手和登录，message_delay 模拟服务器处理每封邮件
+    def _reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        time.sleep(self.server.connect_delay)
+        with self.server.lock:
+            self.server.connections += 1
+        self._reply("220 stand-in ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self._reply("250-stand-in")
+                self._reply("250 AUTH PLAIN")
+            elif command.startswith('AUTH'):
+                self._reply("235 Authentication successful")
+            elif command.startswith('DATA'):
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                time.sleep(self.server.message_delay)
+                # data_replies 中的响应码按顺序用于之后的邮件 (例如 451 临时错误、550 拒收)
+                with self.server.lock:
+                    code = self.server.data_replies.pop(0) if self.server.data_replies else 250
+                    if code == 250:
+                        self.server.received += 1
+                self._reply("250 OK" if code == 250 else f"{code} stand-in error")
+            elif command.startswith('QUIT'):
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("250 OK")
+
+class StandInSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, connect_delay=0.05, message_delay=0.005, data_replies=None):
+        super().__init__(('127.0.0.1', 0), StandInSMTPHandler)
+        self.connect_delay = connect_delay
+        self.message_delay = message_delay
+        self.data_replies = list(data_replies or [])
+        self.received = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+def fixture_html(city, stations_per_table=40, seed=0):
+    # 生成与 tankille.fi 页面结构相同的 HTML：每种燃料一个 table.table，列为 排名/加油站/价格/更新时间
+    rng = random.Random(f"{city}-{seed}")
+    updated = ['juuri nyt', '5 minuuttia sitten', 'tunti sitten', '3 tuntia sitten', '2 päivää sitten']
+    parts = [f"<html><head><title>Polttoaineen hinnat {city}</title></head><body><div class='container'>"]
+    for fuel in ['95E10', '98E5', 'Diesel']:
+        parts.append(f"<h2>{fuel}</h2><table class='table table-striped'>"
+                     "<tr><th>#</th><th>Asema</th><th>Hinta</th><th>Päivitetty</th></tr>")
+        for i in range(stations_per_table):
+            price = f"{rng.uniform(1.6, 2.1):.3f}".replace('.', ',')
+            parts.append(f"<tr><td>{i + 1}</td><td><a href='/asema/{city}-{i}'>{city.title()} Station {i}</a></td>"
+                         f"<td><span class='price'>{price} €</span></td><td>{rng.choice(updated)}</td></tr>")
+        parts.append("</table>")
+    parts.append("</div></body></html>")
+    return "".join(parts).encode()
+
+class StandInHTTPHandler(http.server.BaseHTTPRequestHandler):
+    # 本地模拟 tankille.fi：按城市返回固定的 HTML，支持 ETag / If-None-Match
+    def do_GET(self):
+        # active / max_active：同时处理中的请求数，用于检查每个主机的并发限制
+        with self.server.lock:
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+        try:
+            self._respond()
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def _respond(self):
+        time.sleep(self.server.latency)
+        city = self.path.strip('/') or 'oulu'
+        # pages 可以为某个城市指定页面内容 (例如结构变化后的页面)
+        body = self.server.pages.get(city) or fixture_html(city)
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            with self.server.lock:
+                self.server.not_modified += 1
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class StandInHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.1):
+        super().__init__(('127.0.0.1', 0), StandInHTTPHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.not_modified = 0
+        self.pages = {}
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address
+        return f"http://{host}:{port}/{{city}}/"
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
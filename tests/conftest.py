@@ -0,0 +1,10 @@
+import pytest
+from database import get_db
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # 每个测试一个临时 SQLite 数据库，get_db() 也返回它
+    monkeypatch.setenv('DATABASE_URL', str(tmp_path / 'test.db'))
+    database = get_db()
+    yield database
+    database.close()
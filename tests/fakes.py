@@ -0,0 +1,26 @@
+# 测试用的替身对象
+
+class FakeLocation:
+    def __init__(self, latitude, longitude, address):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.address = address
+
+class FakeGeolocator:
+    # 代替 Nominatim：results 为 {查询: FakeLocation 或 None}，记录每次实际请求
+    def __init__(self, results=None, error=None):
+        self.results = dict(results or {})
+        self.error = error
+        self.queries = []
+
+    def _answer(self, query):
+        self.queries.append(query)
+        if self.error is not None:
+            raise self.error
+        return self.results.get(query)
+
+    def geocode(self, query):
+        return self._answer(query)
+
+    def reverse(self, query):
+        return self._answer(query)
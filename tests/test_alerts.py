@@ -0,0 +1,112 @@
+from datetime import datetime
+
+import pytest
+
+import jobs
+from alert_matcher import suppress_repeats
+from database import Database
+
+def alert(station, price, fuel_type='95 E10', threshold=1.8):
+    return {'fuel_type': fuel_type, 'station': station, 'price': price, 'threshold': threshold, 'updated': 'just now'}
+
+@pytest.mark.parametrize('previous, price, expected', [
+    (None, 1.75, True),
+    (1.75, 1.75, False),
+    (1.75, 1.745, False),
+    # 正好降低 epsilon 时也提醒
+    (1.75, 1.74, True),
+    (1.75, 1.70, True),
+    (1.75, 1.78, False),
+])
+def test_suppress_repeats(previous, price, expected):
+    last_alerted = {} if previous is None else {('user@example.com', '95 E10', 'Station A'): previous}
+
+    fresh, matched = suppress_repeats({'user@example.com': [alert('Station A', price)]}, last_alerted, 0.01)
+
+    assert bool(fresh) == expected
+    assert matched == {('user@example.com', '95 E10', 'Station A')}
+
+def test_suppress_repeats_keeps_other_stations():
+    notifications = {'user@example.com': [alert('Station A', 1.75), alert('Station B', 1.76)]}
+
+    fresh, matched = suppress_repeats(notifications, {('user@example.com', '95 E10', 'Station A'): 1.75}, 0.01)
+
+    assert fresh == {'user@example.com': [alert('Station B', 1.76)]}
+    assert len(matched) == 2
+
+@pytest.fixture
+def scrape(db, monkeypatch):
+    # 用给定的价格运行一次抓取任务，返回任务统计
+    monkeypatch.setattr(jobs, '_validator', None)
+    monkeypatch.setattr(jobs, 'refresh_home_snapshot', lambda: None)
+
+    def run(price, station='Station A'):
+        entry = {'station': station, 'price': price, 'updated': 'just now',
+                 'timestamp': datetime.now().isoformat(), 'city': 'oulu'}
+        monkeypatch.setattr(jobs, 'scrape_fuel_prices', lambda: {'95 E10': [entry], '98 E5': [], 'Diesel': []})
+        return jobs.update_fuel_prices_and_notify()
+    return run
+
+def outbox(db):
+    return [row[0] for row in db.conn.execute('SELECT to_email FROM email_outbox ORDER BY id').fetchall()]
+
+def test_repeated_alerts_are_suppressed_until_price_drops_or_clears(db, scrape):
+    db.add_user('user@example.com', 1.8, '95 E10')
+
+    assert scrape(1.75)['emails_queued'] == 1
+    assert db.get_alert_state() == {('user@example.com', '95 E10', 'Station A'): 1.75}
+    # 价格不变或降幅小于 ALERT_REPEAT_EPSILON 时不再提醒
+    assert scrape(1.75)['emails_queued'] == 0
+    assert scrape(1.745)['alerts_suppressed'] == 1
+    assert scrape(1.74)['emails_queued'] == 1
+    assert db.get_alert_state() == {('user@example.com', '95 E10', 'Station A'): 1.74}
+    # 价格回到阈值以上时清除状态，再次低于阈值时重新提醒
+    assert scrape(1.85)['emails_queued'] == 0
+    assert db.get_alert_state() == {}
+    assert scrape(1.79)['emails_queued'] == 1
+    assert len(outbox(db)) == 3
+
+def test_alert_writes_are_rolled_back_together(db, scrape, monkeypatch):
+    db.add_user('instant@example.com', 1.8, '95 E10')
+    db.add_user('daily@example.com', 1.8, '95 E10', alert_mode='daily')
+    # 最后一步 (清除状态) 失败时，发件箱、汇总表和提醒状态都不应写入
+    db.conn.execute("INSERT INTO alert_state (email, fuel_type, station, price, alerted_at) "
+                    "VALUES ('instant@example.com', '95 E10', 'Station Gone', 1.7, '2024-01-01T00:00:00')")
+    db.conn.commit()
+    executemany = Database.cursor.fget(db).executemany
+
+    class FailingCursor:
+        def executemany(self, sql, rows):
+            if 'DELETE FROM alert_state' in sql:
+                raise RuntimeError("disk full")
+            return executemany(sql, rows)
+    monkeypatch.setattr(Database, 'cursor', property(lambda self: FailingCursor()))
+
+    with pytest.raises(RuntimeError):
+        scrape(1.75)
+
+    assert outbox(db) == []
+    assert db.get_digest_alerts('daily') == []
+    assert db.get_alert_state() == {('instant@example.com', '95 E10', 'Station Gone'): 1.7}
+
+def test_digest_alerts_are_sent_once(db, scrape):
+    db.add_user('daily@example.com', 1.8, '95 E10', alert_mode='daily')
+    db.add_user('weekly@example.com', 1.8, '95 E10', alert_mode='weekly')
+
+    stats = scrape(1.75)
+    scrape(1.70, station='Station B')
+
+    assert stats['emails_queued'] == 0
+    assert stats['alerts_digested'] == 2
+    assert outbox(db) == []
+
+    assert jobs.send_alert_digests('daily') == {'emails_queued': 1}
+    assert outbox(db) == ['daily@example.com']
+    body = db.conn.execute('SELECT body FROM email_outbox').fetchone()[0]
+    assert 'Station A: €1.75' in body and 'Station B: €1.7' in body
+    # 已汇总的提醒被删除，weekly 订阅者的提醒保留到 weekly 汇总
+    assert db.get_digest_alerts('daily') == []
+    assert len(db.get_digest_alerts('weekly')) == 2
+    assert jobs.send_alert_digests('daily') == {'emails_queued': 0}
+    assert jobs.send_alert_digests('weekly') == {'emails_queued': 1}
+    assert outbox(db) == ['daily@example.com', 'weekly@example.com']
@@ -0,0 +1,132 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from flask import Flask
+
+from analytics import PriceAnalytics, forward_fill, rolling_mean, seasonal_profile
+from analytics_api import create_analytics_blueprint
+
+# 2024-01-01 是星期一
+START = datetime(2024, 1, 1)
+START_HOUR = int(np.datetime64('2024-01-01T00', 'h').astype(np.int64))
+
+def record(db, station, price, hour, city='oulu'):
+    # 写入一次价格变化 (START 之后第 hour 小时)
+    timestamp = (START + timedelta(hours=hour)).isoformat()
+    db.apply_price_changes({'new': [{'fuel_type': '95 E10', 'station': station, 'price': price,
+                                     'updated': '1 hour ago', 'timestamp': timestamp, 'city': city}],
+                            'changed': [], 'unchanged': []})
+
+def weekly_dip(hours, dip_day=2, dip_hour=4):
+    # 每周 dip_day (0 = 星期一) 的 dip_hour 点便宜 0.1，其余时间为 1.8
+    hour = np.arange(hours)
+    return np.where((hour // 24 % 7 == dip_day) & (hour % 24 == dip_hour), 1.7, 1.8)
+
+def test_rolling_mean_ignores_nan_and_uses_partial_windows():
+    values = np.array([[1.0, 2.0, np.nan, 4.0, 5.0], [np.nan] * 5])
+
+    means = rolling_mean(values, 2)
+
+    np.testing.assert_allclose(means[0], [1.0, 1.5, 2.0, 4.0, 4.5])
+    assert np.isnan(means[1]).all()
+
+def test_forward_fill_keeps_leading_nan():
+    values = np.array([[np.nan, 1.0, np.nan, np.nan, 2.0, np.nan]])
+
+    np.testing.assert_allclose(forward_fill(values), [[np.nan, 1.0, 1.0, 1.0, 2.0, 2.0]])
+
+def test_seasonal_profile_finds_weekly_dip():
+    values = weekly_dip(4 * 168)
+
+    profile, counts = seasonal_profile(values, START_HOUR)
+
+    assert profile.shape == counts.shape == (7, 24)
+    assert counts.sum() == 4 * 168
+    assert np.unravel_index(np.nanargmin(profile), profile.shape) == (2, 4)
+
+@pytest.fixture
+def history(db):
+    # 两个加油站，4 周的小时价格；Station B 只在第一周开头有一次记录
+    for hour, price in enumerate(weekly_dip(4 * 168)):
+        record(db, 'Station A', float(price), hour)
+    record(db, 'Station B', 1.9, 0, city='kempele')
+    return db
+
+def test_cheapest_time_recommends_weekly_dip(history):
+    engine = PriceAnalytics(lambda: history, stamp_ttl=0)
+
+    recommendation = engine.cheapest_time('95 E10', station='Station A')['recommendation']
+
+    assert recommendation['day_of_week'] == 'Wednesday'
+    assert recommendation['hour'] == 4
+    assert recommendation['expected_saving'] > 0
+    assert recommendation['cheapest_hour_of_day'] == 4
+
+def test_first_read_is_bounded_to_window(history):
+    engine = PriceAnalytics(lambda: history, max_days=7, stamp_ttl=0)
+
+    matrix = engine.matrix('95 E10')
+    _, _, hours = engine._buffers['95 E10'].arrays()
+
+    # 窗口内 168 行，加上两个加油站各一条窗口前的记录
+    assert len(hours) == 168 + 2
+    assert (hours < matrix.start_hour).sum() == 2
+    assert matrix.values.shape == (2, 168)
+    # Station B 在窗口之前的价格前向填充到整个窗口
+    np.testing.assert_allclose(matrix.values[list(matrix.stations).index('Station B')], 1.9)
+    assert dict(zip(matrix.stations, matrix.cities)) == {'Station A': 'oulu', 'Station B': 'kempele'}
+
+def test_incremental_read_prunes_rows_leaving_window(history):
+    engine = PriceAnalytics(lambda: history, max_days=7, stamp_ttl=0)
+    engine.matrix('95 E10')
+
+    for hour in range(4 * 168, 4 * 168 + 48):
+        record(history, 'Station A', 1.75, hour)
+    matrix = engine.matrix('95 E10')
+    _, _, hours = engine._buffers['95 E10'].arrays()
+
+    assert len(hours) == 168 + 2
+    assert matrix.values.shape == (2, 168)
+    assert matrix.start_hour == START_HOUR + 4 * 168 + 48 - 168
+    np.testing.assert_allclose(matrix.values[list(matrix.stations).index('Station A'), -48:], 1.75)
+
+def test_rolling_series_for_city(history):
+    engine = PriceAnalytics(lambda: history, stamp_ttl=0)
+
+    result = engine.rolling('95 E10', city='kempele', window=24, days=1)
+
+    assert result['prices'] == [1.9] * 24
+    assert result['rolling_mean'] == [1.9] * 24
+    with pytest.raises(KeyError):
+        engine.rolling('95 E10', city='helsinki')
+
+@pytest.fixture
+def client(history):
+    app = Flask(__name__)
+    app.register_blueprint(create_analytics_blueprint(lambda: history,
+                                                      engine=PriceAnalytics(lambda: history, stamp_ttl=0)))
+    return app.test_client()
+
+def test_analytics_endpoints(client):
+    rolling = client.get('/api/v1/analytics/rolling?station=Station A&window=6&days=2')
+    seasonality = client.get('/api/v1/analytics/seasonality?station=Station A')
+    cheapest = client.get('/api/v1/analytics/cheapest_time?station=Station A')
+
+    assert rolling.status_code == seasonality.status_code == cheapest.status_code == 200
+    assert len(rolling.get_json()['prices']) == len(rolling.get_json()['rolling_mean']) == 48
+    assert seasonality.get_json()['hours_observed'] == 4 * 168
+    assert min(seasonality.get_json()['day_of_week'], key=seasonality.get_json()['day_of_week'].get) == 'Wednesday'
+    assert cheapest.get_json()['recommendation']['day_of_week'] == 'Wednesday'
+
+@pytest.mark.parametrize('path', ['rolling', 'seasonality', 'cheapest_time'])
+def test_unknown_station_is_not_found(client, path):
+    response = client.get(f'/api/v1/analytics/{path}?station=Station Z')
+
+    assert response.status_code == 404
+
+@pytest.mark.parametrize('query', ['window=0', 'window=abc', f'window={24 * 90 + 1}', 'days=0', 'days=367'])
+def test_rolling_rejects_bad_window(client, query):
+    response = client.get(f'/api/v1/analytics/rolling?station=Station A&{query}')
+
+    assert response.status_code == 400
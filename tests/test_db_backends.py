@@ -0,0 +1,163 @@
+import sqlite3
+import threading
+
+import pytest
+
+from db_backends import SQLiteBackend
+
+@pytest.fixture
+def sqlite_backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'pool.db'), pool_size=2)
+    yield backend
+    backend.close()
+
+def test_sqlite_released_connection_is_reused_by_other_threads(sqlite_backend):
+    conn = sqlite_backend.connect()
+    sqlite_backend.release(conn)
+
+    reused = []
+    def request():
+        other = sqlite_backend.connect()
+        reused.append(other)
+        other.execute('SELECT 1').fetchone()
+        sqlite_backend.release(other)
+
+    thread = threading.Thread(target=request)
+    thread.start()
+    thread.join()
+    assert reused == [conn]
+
+def test_sqlite_pool_keeps_at_most_pool_size_idle_connections(sqlite_backend):
+    connections = [sqlite_backend.connect() for _ in range(4)]
+    for conn in connections:
+        sqlite_backend.release(conn)
+    assert len(sqlite_backend._idle) == 2
+    # 超出的连接已关闭
+    with pytest.raises(sqlite3.ProgrammingError):
+        connections[-1].execute('SELECT 1')
+
+def test_sqlite_release_rolls_back_uncommitted_writes(sqlite_backend):
+    conn = sqlite_backend.connect()
+    conn.execute('CREATE TABLE t (x INTEGER)')
+    conn.commit()
+    conn.execute('INSERT INTO t VALUES (1)')
+    sqlite_backend.release(conn)
+    conn = sqlite_backend.connect()
+    assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+
+def test_database_release_returns_thread_connection(db):
+    conn = db.conn
+    db.release()
+    assert db.conn is conn
+
+class StandInPgCursor:
+    def __init__(self, raw):
+        self.raw = raw
+
+    def execute(self, sql, params=None):
+        if sql.startswith('PREPARE '):
+            name = sql.split()[1]
+            # 与 PostgreSQL 相同：同一会话中重复 PREPARE 会报错
+            if name in self.raw.prepared:
+                raise RuntimeError(f'prepared statement "{name}" already exists')
+            self.raw.prepared.add(name)
+        self.raw.statements.append(sql)
+
+    def fetchall(self):
+        return []
+
+class StandInPgConnection:
+    def __init__(self):
+        self.prepared = set()
+        self.statements = []
+
+    def cursor(self, name=None):
+        return StandInPgCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+class StandInPgPool:
+    # 与 ThreadedConnectionPool 相同的接口，空闲连接按 LIFO 复用
+    def __init__(self, minconn, maxconn, dsn=None):
+        self.idle = []
+        self.opened = 0
+
+    def getconn(self):
+        if self.idle:
+            return self.idle.pop()
+        self.opened += 1
+        return StandInPgConnection()
+
+    def putconn(self, conn):
+        self.idle.append(conn)
+
+    def closeall(self):
+        self.idle = []
+
+@pytest.fixture
+def pg_backend(monkeypatch):
+    import psycopg2.pool
+    from db_backends import PostgresBackend
+
+    monkeypatch.setattr(psycopg2.pool, 'ThreadedConnectionPool', StandInPgPool)
+    return PostgresBackend('postgresql://stand-in/fuel_prices')
+
+def test_postgres_prepared_statements_survive_pool_checkout(pg_backend):
+    sql = 'SELECT station FROM fuel_prices WHERE fuel_type = ?'
+    first = pg_backend.connect()
+    pg_backend.execute_prepared(first, 'stations_by_fuel', sql, ('95 E10',))
+    pg_backend.release(first)
+
+    second = pg_backend.connect()
+    assert second.raw is first.raw
+    pg_backend.execute_prepared(second, 'stations_by_fuel', sql, ('Diesel',))
+    pg_backend.release(second)
+
+    statements = second.raw.statements
+    assert sum(statement.startswith('PREPARE') for statement in statements) == 1
+    assert sum(statement.startswith('EXECUTE') for statement in statements) == 2
+
+def test_postgres_new_connection_prepares_again(pg_backend):
+    sql = 'SELECT 1'
+    first = pg_backend.connect()
+    second = pg_backend.connect()
+    pg_backend.execute_prepared(first, 'one', sql, ())
+    pg_backend.execute_prepared(second, 'one', sql, ())
+    assert first.raw is not second.raw
+    assert first.raw.prepared == second.raw.prepared == {'one'}
+
+def test_postgres_connect_waits_for_a_released_connection(monkeypatch):
+    import psycopg2.pool
+    from db_backends import PostgresBackend
+
+    monkeypatch.setattr(psycopg2.pool, 'ThreadedConnectionPool', StandInPgPool)
+    backend = PostgresBackend('postgresql://stand-in/fuel_prices', maxconn=1, timeout=5)
+    held = backend.connect()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(backend.connect()))
+    waiter.start()
+    waiter.join(0.2)
+    assert acquired == []
+    backend.release(held)
+    waiter.join(5)
+    assert acquired and acquired[0].raw is held.raw
+
+def test_postgres_connect_times_out_when_pool_is_exhausted(monkeypatch):
+    import psycopg2.pool
+    from db_backends import PostgresBackend
+
+    monkeypatch.setattr(psycopg2.pool, 'ThreadedConnectionPool', StandInPgPool)
+    backend = PostgresBackend('postgresql://stand-in/fuel_prices', maxconn=1, timeout=0.05)
+    backend.connect()
+    with pytest.raises(psycopg2.pool.PoolError):
+        backend.connect()
+
+def test_run_job_returns_its_connection(db):
+    from jobs import run_job
+
+    assert run_job('test_job', lambda: {'rows_written': 1}) == {'rows_written': 1}
+    assert getattr(db._local, 'conn', None) is None
@@ -0,0 +1,141 @@
+import csv
+import io
+import os
+import subprocess
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+
+import pytest
+
+# view_data 在第一次请求时才导入 exporter (及 pyarrow)，先导入以免计入峰值
+import exporter
+from api import create_app
+from database import get_db
+
+ROWS = 1000000
+START = datetime(2024, 1, 1)
+# 路由测试在 tracemalloc 下很慢，用 since / until 导出其中 1 万行和 10 万行比较；命令行导出 10 万行和 100 万行
+ROUTE_SIZES = (10000, 100000)
+CLI_SIZES = (100000, ROWS)
+# 路由测试用 tracemalloc 统计 Python 堆 (输出的数据块都在这里)；pyarrow 的缓冲区和 Parquet 元数据不经过 tracemalloc，
+# 由命令行测试的进程峰值 RSS 覆盖
+PEAK_LIMIT = 3 * 1024 * 1024
+# 导出行数多 10 倍时允许的峰值增长：逐块输出时只有分配器的碎片差异
+ROUTE_GROWTH = 256 * 1024
+CLI_GROWTH = 8 * 1024 * 1024
+FORMATS = ['csv', 'ndjson', 'arrow', 'parquet']
+CLI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'view_data.py')
+
+def until(rows):
+    # 第 i 行的时间戳为 START + i 秒
+    return (START + timedelta(seconds=rows)).isoformat()
+
+@pytest.fixture(scope='module')
+def database_url(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('export') / 'export.db')
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv('DATABASE_URL', path)
+        db = get_db()
+        # 在 SQLite 中生成行，避免在 Python 中构造 100 万个元组
+        db.conn.execute(f'''
+            WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < {ROWS - 1})
+            INSERT INTO price_history (fuel_type, station, price, updated, timestamp, city)
+            SELECT '95 E10', 'Station ' || (i % 300), 1.7 + (i % 50) / 1000.0, '1 hour ago',
+                   strftime('%Y-%m-%dT%H:%M:%S', {int(START.timestamp())} + i, 'unixepoch', 'localtime'), 'oulu'
+            FROM n
+        ''')
+        db.conn.commit()
+        yield path
+        db.close()
+
+@pytest.fixture(scope='module')
+def client(database_url):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv('DATABASE_URL', database_url)
+        yield create_app(background_startup=False).test_client()
+
+def stream(client, url):
+    # 逐块读取响应，返回 (字节数, 行数, 第一行, 最后一行, 峰值内存)
+    tracemalloc.start()
+    try:
+        response = client.get(url, buffered=False)
+        assert response.status_code == 200
+        size = lines = 0
+        first = last = tail = b''
+        for chunk in response.response:
+            chunk = chunk.encode() if isinstance(chunk, str) else chunk
+            size += len(chunk)
+            lines += chunk.count(b'\n')
+            data = tail + chunk
+            if not first and b'\n' in data:
+                first = data.split(b'\n', 1)[0]
+            parts = data.rsplit(b'\n', 2)
+            if len(parts) > 1 and parts[-2]:
+                last = parts[-2]
+            tail = parts[-1][-4096:]
+        response.close()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return size, lines, first, last, peak
+
+def test_csv_export_streams_every_row(client):
+    _, lines, first, last, _ = stream(client, f'/view_data?table=price_history&format=csv&until={until(ROUTE_SIZES[0])}')
+
+    assert lines == ROUTE_SIZES[0] + 1
+    assert next(csv.reader(io.StringIO(first.decode()))) == ['id', 'fuel_type', 'station', 'price',
+                                                              'updated', 'timestamp', 'city']
+    assert next(csv.reader(io.StringIO(last.decode())))[0] == str(ROUTE_SIZES[0])
+
+@pytest.mark.parametrize('export_format', ['csv', 'arrow', 'parquet'])
+def test_route_peak_memory_does_not_grow_with_table_size(client, monkeypatch, export_format):
+    if export_format != 'csv' and exporter.pa is None:
+        pytest.skip("pyarrow is not installed")
+    # Parquet 最多缓冲一个 row group；缩小 row group，让两种大小都处于稳定状态 (默认大小由命令行测试覆盖)
+    monkeypatch.setattr(exporter, 'PARQUET_ROW_GROUP_ROWS', 2000)
+    peaks = []
+    sizes = []
+    for rows in ROUTE_SIZES:
+        size, _, _, _, peak = stream(client, f'/view_data?table=price_history&format={export_format}&until={until(rows)}')
+        sizes.append(size)
+        peaks.append(peak)
+
+    assert sizes[1] > 9 * sizes[0]
+    assert peaks[1] < PEAK_LIMIT
+    assert peaks[1] - peaks[0] < ROUTE_GROWTH, peaks
+
+# 在子进程中运行 view_data.py，退出前读取本进程的峰值 RSS (VmHWM，exec 后重新计算；fork 时的 ru_maxrss 会沿用 pytest 进程的值)
+PEAK_RSS = """
+import runpy, sys
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name='__main__')
+sys.stdout.flush()
+with open('/proc/self/status') as status:
+    print(next(line.split()[1] for line in status if line.startswith('VmHWM:')), file=sys.stderr)
+"""
+
+def run_cli(database_url, *args):
+    # 导出到 /dev/null，返回峰值 RSS (字节)
+    result = subprocess.run([sys.executable, '-c', PEAK_RSS, CLI, '--database', database_url, '--table', 'price_history',
+                             *args], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+    return int(result.stderr.split()[-1]) * 1024
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/status'), reason="needs /proc/self/status")
+@pytest.mark.parametrize('export_format', FORMATS)
+def test_cli_peak_rss_does_not_grow_with_table_size(database_url, export_format):
+    if export_format in ('arrow', 'parquet') and exporter.pa is None:
+        pytest.skip("pyarrow is not installed")
+    small = run_cli(database_url, '--format', export_format, '--until', until(CLI_SIZES[0]))
+    large = run_cli(database_url, '--format', export_format)
+
+    assert large - small < CLI_GROWTH, (small, large)
+
+def test_cli_writes_every_row(database_url, tmp_path):
+    output = tmp_path / 'export.csv'
+    with open(output, 'wb') as stdout:
+        subprocess.run([sys.executable, CLI, '--database', database_url, '--table', 'price_history',
+                        '--format', 'csv', '--since', until(ROWS - 10)], stdout=stdout, check=True)
+    rows = list(csv.reader(output.open()))
+    assert len(rows) == 11
+    assert [row[0] for row in rows[1:]] == [str(i) for i in range(ROWS - 9, ROWS + 1)]
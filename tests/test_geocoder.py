@@ -0,0 +1,120 @@
+import time
+from datetime import datetime
+
+import pytest
+
+from geocoder import NEGATIVE_TTL, GeocodeCache, RateLimiter, backfill_station_locations
+from tests.fakes import FakeGeolocator, FakeLocation
+
+KIRKKOKATU = FakeLocation(65.0124, 25.4682, 'Kirkkokatu 1, Oulu, Finland')
+
+def make_cache(db, geolocator):
+    return GeocodeCache(lambda: db, geolocator, min_interval=0)
+
+def cached_row(db, kind, key):
+    return db.conn.execute('SELECT found, latitude FROM geocode_cache WHERE kind = ? AND query_key = ?',
+                           (kind, key)).fetchone()
+
+def test_miss_is_fetched_once_then_served_from_cache(db):
+    geolocator = FakeGeolocator({'Kirkkokatu 1, Oulu': KIRKKOKATU})
+    cache = make_cache(db, geolocator)
+
+    assert cache.geocode('Kirkkokatu 1, Oulu') == (65.0124, 25.4682, 'Kirkkokatu 1, Oulu, Finland')
+    # 大小写和空白不同的同一地址使用同一条缓存
+    assert cache.geocode('  kirkkokatu 1,   OULU ') == (65.0124, 25.4682, 'Kirkkokatu 1, Oulu, Finland')
+    assert geolocator.queries == ['Kirkkokatu 1, Oulu']
+    assert cached_row(db, 'forward', 'kirkkokatu 1, oulu') == (1, 65.0124)
+
+def test_database_cache_survives_restart(db):
+    make_cache(db, FakeGeolocator({'Kirkkokatu 1, Oulu': KIRKKOKATU})).geocode('Kirkkokatu 1, Oulu')
+
+    # 新的实例没有内存缓存，从 geocode_cache 表读取
+    geolocator = FakeGeolocator()
+    assert make_cache(db, geolocator).geocode('Kirkkokatu 1, Oulu')[:2] == (65.0124, 25.4682)
+    assert geolocator.queries == []
+
+def test_not_found_is_cached_as_negative_entry(db):
+    geolocator = FakeGeolocator()
+    cache = make_cache(db, geolocator)
+
+    assert cache.geocode('Nowhere 123') is None
+    assert cache.geocode('Nowhere 123') is None
+    assert geolocator.queries == ['Nowhere 123']
+    assert cached_row(db, 'forward', 'nowhere 123') == (0, None)
+    # 重启后负缓存仍然有效
+    assert make_cache(db, geolocator).geocode('Nowhere 123') is None
+    assert len(geolocator.queries) == 1
+
+def test_negative_entry_expires(db):
+    geolocator = FakeGeolocator()
+    make_cache(db, geolocator).geocode('Nowhere 123')
+    expired = (datetime.now() - NEGATIVE_TTL - NEGATIVE_TTL / 7).isoformat()
+    db.conn.execute('UPDATE geocode_cache SET created_at = ?', (expired,))
+    db.conn.commit()
+
+    geolocator.results['Nowhere 123'] = KIRKKOKATU
+    assert make_cache(db, geolocator).geocode('Nowhere 123')[:2] == (65.0124, 25.4682)
+    assert len(geolocator.queries) == 2
+    assert cached_row(db, 'forward', 'nowhere 123')[0] == 1
+
+def test_service_errors_are_not_cached(db):
+    geolocator = FakeGeolocator(error=TimeoutError('service timed out'))
+    cache = make_cache(db, geolocator)
+    with pytest.raises(TimeoutError):
+        cache.geocode('Kirkkokatu 1, Oulu')
+    assert cached_row(db, 'forward', 'kirkkokatu 1, oulu') is None
+
+    geolocator.error = None
+    geolocator.results['Kirkkokatu 1, Oulu'] = KIRKKOKATU
+    assert cache.geocode('Kirkkokatu 1, Oulu') is not None
+    assert len(geolocator.queries) == 2
+
+def test_reverse_lookups_share_a_coordinate_cell(db):
+    geolocator = FakeGeolocator({'65.01241, 25.46821': KIRKKOKATU})
+    cache = make_cache(db, geolocator)
+
+    assert cache.reverse(65.01241, 25.46821) == 'Kirkkokatu 1, Oulu, Finland'
+    # 同一个约 11 米的格子
+    assert cache.reverse(65.01243, 25.46818) == 'Kirkkokatu 1, Oulu, Finland'
+    assert len(geolocator.queries) == 1
+
+def test_backfill_locates_stations_without_coordinates(db):
+    now = datetime.now().isoformat()
+    db.conn.executemany('''
+        INSERT INTO fuel_prices (fuel_type, station, price, updated, timestamp, city) VALUES (?, ?, ?, ?, ?, ?)
+    ''', [('95 E10', 'Neste Oulu Kaakkuri', 1.8, 'just now', now, 'oulu'),
+          ('95 E10', 'Unknown Station', 1.9, 'just now', now, 'oulu')])
+    db.conn.commit()
+    geolocator = FakeGeolocator({'Neste Oulu Kaakkuri, Oulu, Finland': FakeLocation(64.98, 25.52, 'Kaakkuri')})
+
+    assert backfill_station_locations(db, make_cache(db, geolocator)) == 1
+    assert db.get_station_location('Neste Oulu Kaakkuri') == (64.98, 25.52)
+    assert db.get_station_location('Unknown Station') is None
+    # 查不到的加油站已写入负缓存，下一次补全不再请求
+    backfill_station_locations(db, make_cache(db, geolocator))
+    assert len(geolocator.queries) == 2
+
+def test_rate_limit_slots_are_shared_through_the_database(db):
+    # 同一个 name 的时间片依次排开，与调用的进程无关
+    first = db.reserve_rate_limit_slot('nominatim', 1.0)
+    second = db.reserve_rate_limit_slot('nominatim', 1.0)
+    third = db.reserve_rate_limit_slot('nominatim', 1.0)
+    assert second - first == pytest.approx(1.0) and third - second == pytest.approx(1.0)
+    # 其他限速互不影响
+    assert db.reserve_rate_limit_slot('other', 1.0) <= time.time()
+
+def test_separate_geocoders_share_one_budget(db):
+    # 两个实例 (相当于两个 Web worker 或 Web + job runner) 一共每 0.2 秒最多请求一次
+    geolocator = FakeGeolocator()
+    web = GeocodeCache(lambda: db, geolocator, min_interval=0.2)
+    runner = GeocodeCache(lambda: db, geolocator, min_interval=0.2)
+    start = time.monotonic()
+    for i in range(3):
+        web.geocode(f"Street {i}")
+        runner.geocode(f"Road {i}")
+    assert time.monotonic() - start >= 5 * 0.2 - 0.05
+    assert len(geolocator.queries) == 6
+
+def test_zero_interval_does_not_touch_the_database(db):
+    RateLimiter(lambda: db, min_interval=0).wait()
+    assert db.conn.execute('SELECT COUNT(*) FROM rate_limits').fetchone()[0] == 0
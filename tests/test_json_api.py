@@ -0,0 +1,91 @@
+import gzip
+from datetime import datetime
+
+import pytest
+from flask import Flask
+
+from json_api import create_api_blueprint, encode_cursor
+
+@pytest.fixture
+def client(db):
+    app = Flask(__name__)
+    app.register_blueprint(create_api_blueprint(lambda: db, stamp_ttl=0))
+    return app.test_client()
+
+def add_stations(db, count):
+    for i in range(count):
+        db.add_or_update_station(f"Station {i:03d}", 65.0 + i / 1000, 25.4)
+
+def add_prices(db, count):
+    now = datetime.now().isoformat()
+    db.conn.executemany('''
+        INSERT INTO fuel_prices (fuel_type, station, price, updated, timestamp, city) VALUES (?, ?, ?, ?, ?, ?)
+    ''', [('95 E10', f"Station {i:03d}", round(1.7 + i / 1000, 3), 'just now', now, 'oulu') for i in range(count)])
+    db._touch_data_version('prices')
+    db.conn.commit()
+
+def revalidate(client, path, response, **headers):
+    return client.get(path, headers=dict(headers, **{'If-None-Match': response.headers['ETag']}))
+
+def test_small_uncompressed_response_revalidates_with_gzip(client, db):
+    # 响应小于 MIN_COMPRESS_SIZE 时不压缩，ETag 不带编码后缀，再次请求仍应得到 304
+    add_stations(db, 1)
+    first = client.get('/api/v1/stations', headers={'Accept-Encoding': 'gzip'})
+    assert first.status_code == 200
+    assert 'Content-Encoding' not in first.headers
+    assert '-gzip' not in first.headers['ETag']
+
+    second = revalidate(client, '/api/v1/stations', first, **{'Accept-Encoding': 'gzip'})
+    assert second.status_code == 304
+    assert second.headers['ETag'] == first.headers['ETag']
+
+def test_compressed_response_revalidates(client, db):
+    add_prices(db, 100)
+    first = client.get('/api/v1/prices?limit=100', headers={'Accept-Encoding': 'gzip'})
+    assert first.headers['Content-Encoding'] == 'gzip'
+    assert first.headers['ETag'].endswith('-gzip"')
+    assert len(gzip.decompress(first.data)) > len(first.data)
+
+    assert revalidate(client, '/api/v1/prices?limit=100', first, **{'Accept-Encoding': 'gzip'}).status_code == 304
+    # 同一版本的未压缩表示同样有效
+    plain = client.get('/api/v1/prices?limit=100')
+    assert revalidate(client, '/api/v1/prices?limit=100', plain, **{'Accept-Encoding': 'gzip'}).status_code == 304
+
+def test_data_change_invalidates_etag(client, db):
+    add_stations(db, 1)
+    first = client.get('/api/v1/stations')
+    add_stations(db, 2)
+    second = revalidate(client, '/api/v1/stations', first)
+    assert second.status_code == 200
+    assert len(second.get_json()['data']) == 2
+
+def test_etag_depends_on_query(client, db):
+    add_prices(db, 10)
+    first = client.get('/api/v1/prices?limit=5')
+    assert revalidate(client, '/api/v1/prices?limit=6', first).status_code == 200
+
+def test_keyset_pagination_walks_all_rows(client, db):
+    add_prices(db, 25)
+    stations = []
+    cursor = None
+    while True:
+        path = '/api/v1/prices?fuel_type=95%20E10&limit=10' + (f'&cursor={cursor}' if cursor else '')
+        page = client.get(path).get_json()
+        stations.extend(item['station'] for item in page['data'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert stations == [f"Station {i:03d}" for i in range(25)]
+
+def test_bad_requests(client):
+    assert client.get('/api/v1/prices?limit=0').status_code == 400
+    assert client.get('/api/v1/prices?fields=password').status_code == 400
+    assert client.get('/api/v1/prices?cursor=%%%').status_code == 400
+
+# fuel_type 过滤时排序键为 (price, station)
+@pytest.mark.parametrize('values', [[{'a': 1}, 'Station 001'], [1.7, [1, 2]], [1.7], {'station': 'Station 001'}, 'Station 001'])
+def test_malformed_cursor_is_rejected(client, db, values):
+    add_prices(db, 5)
+    response = client.get(f'/api/v1/prices?fuel_type=95%20E10&cursor={encode_cursor(values)}')
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid cursor"}
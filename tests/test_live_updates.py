@@ -0,0 +1,52 @@
+import time
+
+import pytest
+
+import price_events
+from api import create_app
+from snapshots import build_home_snapshot
+
+@pytest.fixture
+def client(db):
+    app = create_app(background_startup=False)
+    yield app.test_client()
+    # 第一次请求时启动的事件读取线程，测试结束后停止
+    app.blueprints['events'].relay.stop()
+
+def render_home(db, monkeypatch, mode):
+    if mode is not None:
+        monkeypatch.setenv('LIVE_UPDATES', mode)
+    return build_home_snapshot(create_app(background_startup=False), db).page
+
+def test_home_polls_by_default(db, monkeypatch):
+    # 默认不打开 SSE 长连接，同步 worker 下不会被占满
+    monkeypatch.delenv('LIVE_UPDATES', raising=False)
+    page = render_home(db, monkeypatch, None)
+    assert 'EventSource' not in page
+    assert '/events/prices/poll' in page and 'timeout=0' in page
+
+def test_home_uses_sse_when_enabled(db, monkeypatch):
+    page = render_home(db, monkeypatch, 'sse')
+    assert 'new EventSource("/events/prices")' in page
+    assert '/events/prices/poll' not in page
+
+def test_live_updates_can_be_disabled(db, monkeypatch):
+    page = render_home(db, monkeypatch, 'off')
+    assert '/events/prices' not in page
+
+def test_poll_returns_immediately_with_last_id(client):
+    data = client.get('/events/prices/poll?timeout=0').get_json()
+    assert data == {'events': [], 'last_id': 0, 'reset': False}
+
+@pytest.mark.parametrize('timeout', ['nan', 'inf', '-inf', 'soon'])
+def test_poll_rejects_non_finite_timeout(client, timeout):
+    response = client.get(f'/events/prices/poll?timeout={timeout}')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+def test_poll_timeout_is_clamped(client, monkeypatch):
+    monkeypatch.setattr(price_events, 'MAX_POLL_TIMEOUT', 0.2)
+    start = time.monotonic()
+    assert client.get('/events/prices/poll?timeout=1000').status_code == 200
+    assert client.get('/events/prices/poll?timeout=-5').status_code == 200
+    assert time.monotonic() - start < 2
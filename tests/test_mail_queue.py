@@ -0,0 +1,123 @@
+import smtplib
+from datetime import datetime, timedelta
+
+import pytest
+
+import jobs
+from email_sender import SMTPConnectionPool
+from mail_queue import MailDispatcher
+from standins import StandInSMTPServer
+
+@pytest.fixture
+def smtp_server():
+    server = StandInSMTPServer(connect_delay=0, message_delay=0)
+    yield server
+    server.close()
+
+def make_dispatcher(db, server, **kwargs):
+    host, port = server.server_address
+    pool = SMTPConnectionPool(host, port, 'alerts@example.com', 'secret', size=2, use_ssl=False)
+    return MailDispatcher(lambda: db, pool, workers=2, **kwargs)
+
+def outbox(db):
+    cursor = db.conn.execute('SELECT status, attempts, next_attempt_at, last_error FROM email_outbox ORDER BY id')
+    return cursor.fetchall()
+
+def make_due(db):
+    db.conn.execute('UPDATE email_outbox SET next_attempt_at = ?', ((datetime.now() - timedelta(seconds=1)).isoformat(),))
+    db.conn.commit()
+
+def test_delivers_over_pooled_connections(db, smtp_server):
+    dispatcher = make_dispatcher(db, smtp_server)
+    db.enqueue_emails([(f"user{i}@example.com", "Fuel Price Alert", "body") for i in range(10)])
+
+    assert dispatcher.drain() == (10, 0)
+    assert smtp_server.received == 10
+    # 连接池最多 2 个连接，不会每封邮件重新连接
+    assert smtp_server.connections <= 2
+    assert {row[0] for row in outbox(db)} == {'sent'}
+
+def test_transient_error_is_retried_after_backoff(db, smtp_server):
+    smtp_server.data_replies = [451]
+    dispatcher = make_dispatcher(db, smtp_server, base_backoff=30)
+    db.enqueue_emails([('user@example.com', "Fuel Price Alert", "body")])
+
+    before = datetime.now()
+    assert dispatcher.drain() == (0, 0)
+    status, attempts, next_attempt_at, last_error = outbox(db)[0]
+    assert (status, attempts) == ('pending', 1)
+    assert '451' in last_error
+    delay = (datetime.fromisoformat(next_attempt_at) - before).total_seconds()
+    assert 30 * 0.8 - 1 <= delay <= 30 * 1.2 + 1
+
+    # 还没到重试时间
+    assert dispatcher.drain() == (0, 0)
+    make_due(db)
+    assert dispatcher.drain() == (1, 0)
+    assert outbox(db)[0][:2] == ('sent', 2)
+
+def test_backoff_grows_exponentially(db, smtp_server):
+    dispatcher = make_dispatcher(db, smtp_server, base_backoff=10)
+    for attempts in range(5):
+        delay = dispatcher._backoff(attempts).total_seconds()
+        assert 10 * 2 ** attempts * 0.8 <= delay <= 10 * 2 ** attempts * 1.2
+
+def test_permanent_error_is_not_retried(db, smtp_server):
+    smtp_server.data_replies = [550]
+    dispatcher = make_dispatcher(db, smtp_server)
+    db.enqueue_emails([('user@example.com', "Fuel Price Alert", "body")])
+
+    assert dispatcher.drain() == (0, 1)
+    status, attempts, _, last_error = outbox(db)[0]
+    assert (status, attempts) == ('failed', 1)
+    assert '550' in last_error
+
+def test_gives_up_after_max_attempts(db, smtp_server):
+    smtp_server.data_replies = [451, 451, 451]
+    dispatcher = make_dispatcher(db, smtp_server, max_attempts=3)
+    db.enqueue_emails([('user@example.com', "Fuel Price Alert", "body")])
+
+    results = []
+    for _ in range(3):
+        results.append(dispatcher.drain())
+        make_due(db)
+    assert results == [(0, 0), (0, 0), (0, 1)]
+    assert outbox(db)[0][:2] == ('failed', 3)
+    assert smtp_server.received == 0
+
+def test_interrupted_sends_are_requeued(db):
+    db.enqueue_emails([('user@example.com', "Fuel Price Alert", "body")])
+    assert len(db.claim_pending_emails(10)) == 1
+    assert outbox(db)[0][0] == 'sending'
+    assert db.requeue_interrupted_emails() == 1
+    assert outbox(db)[0][0] == 'pending'
+
+def test_notify_job_only_enqueues(db, monkeypatch):
+    # 抓取任务只把提醒写入发件箱，不连接 SMTP 服务器
+    def no_smtp(*args, **kwargs):
+        raise AssertionError("the notify job must not send email itself")
+
+    monkeypatch.setattr(smtplib, 'SMTP', no_smtp)
+    monkeypatch.setattr(smtplib, 'SMTP_SSL', no_smtp)
+    monkeypatch.setattr(jobs, '_validator', None)
+    monkeypatch.setattr(jobs, 'refresh_home_snapshot', lambda: None)
+    now = datetime.now().isoformat()
+    monkeypatch.setattr(jobs, 'scrape_fuel_prices', lambda: {
+        '95 E10': [{'station': 'Station A', 'price': 1.75, 'updated': 'just now', 'timestamp': now, 'city': 'oulu'}],
+        '98 E5': [],
+        'Diesel': []
+    })
+    db.add_user('user@example.com', 1.80, '95 E10')
+
+    class Dispatcher:
+        woken = 0
+
+        def wake(self):
+            self.woken += 1
+
+    dispatcher = Dispatcher()
+    stats = jobs.update_fuel_prices_and_notify(dispatcher)
+
+    assert stats['emails_queued'] == 1
+    assert dispatcher.woken == 1
+    assert [row[:2] for row in outbox(db)] == [('pending', 0)]
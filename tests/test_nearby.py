@@ -0,0 +1,59 @@
+from datetime import datetime
+
+import pytest
+
+import api
+from api import create_app
+
+@pytest.fixture
+def client(db):
+    # 缓存按版本号区分，不同测试的临时数据库版本号相同，先清空
+    api.board_cache.clear()
+    api.version_stamps.clear()
+    now = datetime.now().isoformat()
+    for i, (lat, lon, price) in enumerate([(65.01, 25.47, 1.85), (65.02, 25.48, 1.79), (65.30, 25.47, 1.70)]):
+        db.add_or_update_station(f"Station {i}", lat, lon)
+        db.conn.execute('''
+            INSERT INTO fuel_prices (fuel_type, station, price, updated, timestamp, city) VALUES (?, ?, ?, ?, ?, ?)
+        ''', ('95 E10', f"Station {i}", price, 'just now', now, 'oulu'))
+    db._touch_data_version('prices')
+    db.conn.commit()
+    return create_app(background_startup=False).test_client()
+
+def test_returns_cheapest_stations_within_radius(client):
+    response = client.get('/api/nearby?lat=65.0&lon=25.47&radius_km=5')
+    assert response.status_code == 200
+    assert [station['station'] for station in response.get_json()['stations']] == ['Station 1', 'Station 0']
+
+@pytest.mark.parametrize('query', [
+    'lat=65.0&lon=25.47&radius_km=inf',
+    'lat=65.0&lon=25.47&radius_km=nan',
+    'lat=65.0&lon=25.47&radius_km=-1',
+    'lat=65.0&lon=25.47&radius_km=101',
+    'lat=nan&lon=25.47',
+    'lat=65.0&lon=inf',
+    'lat=65.0&lon=25.47&k=0',
+    'lat=65.0&lon=25.47&radius_km=far',
+    'lon=25.47',
+])
+def test_invalid_arguments_are_rejected(client, query):
+    response = client.get(f'/api/nearby?{query}')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+def test_index_is_kept_across_unrelated_writes(client, db, monkeypatch):
+    loads = []
+    get_all_stations = db.get_all_stations
+    monkeypatch.setattr(db, 'get_all_stations', lambda: loads.append(1) or get_all_stations())
+
+    assert client.get('/api/nearby?lat=65.0&lon=25.47').status_code == 200
+    # 新订阅只改变 subscriptions 的版本号
+    db.add_user('user@example.com', 1.80, '95 E10')
+    assert client.get('/api/nearby?lat=65.0&lon=25.47').status_code == 200
+    assert len(loads) == 1
+
+    # 加油站坐标变化后重建索引
+    db.add_or_update_station('Station 3', 65.001, 25.47)
+    stations = client.get('/api/nearby?lat=65.0&lon=25.47').get_json()['stations']
+    assert len(loads) == 2
+    assert 'Station 3' not in [station['station'] for station in stations]  # 没有价格
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from scraper import PARSER_BACKENDS, ScrapeLayoutError, lxml, parse_fuel_prices
+from standins import fixture_html
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+BACKENDS = [name for name in PARSER_BACKENDS if lxml is not None or name == 'html.parser']
+
+# tankille_oulu.html 中各表格应解析出的 (加油站, 价格, 更新时间)
+EXPECTED_OULU = {
+    '95 E10': [
+        ('Teboil Oulu Limingantulli', 1.799, '5 minutes ago'),
+        ('Neste Oulu Kaakkuri', 1.819, 'just now'),
+        ('ABC Kaijonharju', 1.829, '1 hour ago'),
+    ],
+    '98 E5': [
+        ('St1 Toppila', 1.899, '3 hours ago'),
+        ('Shell Räksilä', 1.929, '2 days ago'),
+    ],
+    'Diesel': [
+        ('Neste Oulu Kaakkuri', 1.709, 'eilen'),
+        ('Teboil Oulu Limingantulli', 1.719, '10 seconds ago'),
+        ('ABC Kaijonharju', 1.729, 'just now'),
+    ],
+}
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return f.read()
+
+def without_timestamps(prices):
+    return {
+        fuel_type: [(price['station'], price['price'], price['updated']) for price in price_list]
+        for fuel_type, price_list in prices.items()
+    }
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_stored_page(backend):
+    # 嵌套标签、&nbsp;、小数点格式、无 class="table" 的表格和跨列说明行
+    prices = parse_fuel_prices(read_fixture('tankille_oulu.html'), backend)
+    assert without_timestamps(prices) == EXPECTED_OULU
+    assert all(price['timestamp'] for price_list in prices.values() for price in price_list)
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_stored_page_as_text(backend):
+    content = read_fixture('tankille_oulu.html').decode('utf-8')
+    assert without_timestamps(parse_fuel_prices(content, backend)) == EXPECTED_OULU
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_swapped_columns_are_a_layout_change(backend):
+    with pytest.raises(ScrapeLayoutError):
+        parse_fuel_prices(read_fixture('tankille_columns_swapped.html'), backend)
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_missing_table_is_a_layout_change(backend):
+    page = read_fixture('tankille_oulu.html').replace(b'<table class="table table-striped">', b'<table>', 1)
+    with pytest.raises(ScrapeLayoutError):
+        parse_fuel_prices(page, backend)
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_extra_table_is_skipped(backend, caplog):
+    extra = ('<table class="table"><tr><th>#</th><th>Asema</th><th>Hinta</th><th>Päivitetty</th></tr>'
+             '<tr><td>1</td><td>Mainos</td><td>0,999</td><td>nyt</td></tr></table></body>')
+    page = read_fixture('tankille_oulu.html').replace(b'</body>', extra.encode(), 1)
+    assert without_timestamps(parse_fuel_prices(page, backend)) == EXPECTED_OULU
+    assert "Unexpected table found. Skipping." in caplog.text
+
+def test_backends_agree_on_large_page():
+    page = fixture_html('oulu', stations_per_table=200)
+    results = [without_timestamps(parse_fuel_prices(page, backend)) for backend in BACKENDS]
+    assert all(result == results[0] for result in results)
+    assert [len(result) for result in results[0].values()] == [200, 200, 200]
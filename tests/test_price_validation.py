@@ -0,0 +1,79 @@
+import pytest
+
+from price_validation import PriceValidator, ScrapeValidationError
+
+STATIONS = [f"Station {i}" for i in range(10)]
+
+@pytest.fixture
+def validator(db):
+    db.save_price_baselines({('95 E10', station): [1.80, 1.81, 1.79, 1.80, 1.82] for station in STATIONS})
+    return PriceValidator(lambda: db)
+
+def scrape(prices):
+    # prices: {station: price}，其余加油站价格不变
+    return {'95 E10': [
+        {'station': station, 'price': prices.get(station, 1.80), 'city': 'oulu',
+         'updated': '1 hour ago', 'timestamp': '2024-01-01T12:00:00'}
+        for station in STATIONS
+    ]}
+
+def accepted_prices(accepted):
+    return {entry['station']: entry['price'] for entry in accepted['95 E10']}
+
+def test_single_station_spike_is_quarantined(validator):
+    accepted, outliers = validator.validate(scrape({'Station 0': 2.40}))
+    assert [(entry['station'], entry['reason']) for entry in outliers] == [('Station 0', 'station_history')]
+    assert 'Station 0' not in accepted_prices(accepted)
+
+def test_market_wide_move_is_accepted(validator):
+    # 同城所有加油站一起上涨 0.40 €：不是异常，也不应放弃整次抓取
+    accepted, outliers = validator.validate(scrape({station: 2.20 for station in STATIONS}))
+    assert outliers == []
+    assert set(accepted_prices(accepted).values()) == {2.20}
+
+def test_station_moving_against_market_is_still_quarantined(validator):
+    prices = {station: 2.20 for station in STATIONS}
+    prices['Station 0'] = 1.80
+    _, outliers = validator.validate(scrape(prices))
+    assert [entry['station'] for entry in outliers] == ['Station 0']
+
+def test_lasting_station_move_is_accepted_after_consistent_quarantines(validator):
+    for _ in range(validator.recovery_runs - 1):
+        _, outliers = validator.validate(scrape({'Station 0': 2.30}))
+        assert [entry['station'] for entry in outliers] == ['Station 0']
+
+    accepted, outliers = validator.validate(scrape({'Station 0': 2.31}))
+    assert outliers == []
+    assert accepted_prices(accepted)['Station 0'] == 2.31
+    # 之后以新价格为基线
+    accepted, outliers = validator.validate(scrape({'Station 0': 2.32}))
+    assert outliers == [] and accepted_prices(accepted)['Station 0'] == 2.32
+    _, outliers = validator.validate(scrape({'Station 0': 1.80}))
+    assert [entry['station'] for entry in outliers] == ['Station 0']
+
+def test_inconsistent_quarantines_do_not_recover(validator):
+    for price in (2.30, 2.60, 2.30, 2.60, 2.30):
+        _, outliers = validator.validate(scrape({'Station 0': price}))
+        assert [entry['station'] for entry in outliers] == ['Station 0']
+
+def test_accepted_price_resets_recovery(validator):
+    validator.validate(scrape({'Station 0': 2.30}))
+    validator.validate(scrape({'Station 0': 2.30}))
+    validator.validate(scrape({}))
+    _, outliers = validator.validate(scrape({'Station 0': 2.30}))
+    assert [entry['station'] for entry in outliers] == ['Station 0']
+
+def test_partial_move_stops_failing_after_recovery(validator):
+    # 4/10 个加油站一起调价：超过异常比例，放弃抓取；连续几次一致后接受新价格
+    moved = {station: 2.30 for station in STATIONS[:4]}
+    for _ in range(validator.recovery_runs - 1):
+        with pytest.raises(ScrapeValidationError):
+            validator.validate(scrape(moved))
+    accepted, outliers = validator.validate(scrape(moved))
+    assert outliers == []
+    assert all(accepted_prices(accepted)[station] == 2.30 for station in moved)
+
+def test_non_positive_price_never_recovers(validator):
+    for _ in range(validator.recovery_runs + 1):
+        _, outliers = validator.validate(scrape({'Station 0': 0}))
+        assert [entry['reason'] for entry in outliers] == ['non_positive']
@@ -0,0 +1,19 @@
+import pytest
+
+from query_plans import full_scans, generate_dataset, plan_queries, query_plan
+
+# 与 python benchmark.py plans 相同的检查，数据集小一些
+QUERIES = list(plan_queries(None))
+
+@pytest.fixture(scope='module')
+def dataset(tmp_path_factory):
+    db, _ = generate_dataset(str(tmp_path_factory.mktemp('plans') / 'plans.db'),
+                             stations=60, subscribers=2000, hours=24 * 7)
+    yield db
+    db.close()
+
+@pytest.mark.parametrize('name', QUERIES)
+def test_hot_query_uses_an_index(dataset, name):
+    plan = query_plan(dataset, plan_queries(dataset)[name])
+    assert plan, f"{name} ran no SELECT"
+    assert full_scans(plan) == [], f"{name}: {'; '.join(plan)}"
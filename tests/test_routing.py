@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from routing import (DEFAULT_SPEEDS_KMH, MPH_TO_KMH, RouteTable, _equirectangular_km, _speed_kmh, build_graph,
+                     build_route_matrix, load_osm_graph)
+
+# 沿经线的 5 个节点，间隔 0.01° (约 1.11 km)，相邻节点之间双向通行，60 km/h 时行驶分钟数等于 km 数
+LATS = np.array([65.00, 65.01, 65.02, 65.03, 65.04])
+LONS = np.full(5, 25.0)
+STEP_KM = float(_equirectangular_km(65.00, 25.0, 65.01, 25.0))
+
+@pytest.fixture
+def graph():
+    src = np.array([0, 1, 1, 2, 2, 3, 3, 4])
+    dst = np.array([1, 0, 2, 1, 3, 2, 4, 3])
+    return build_graph(LATS, LONS, src, dst, np.full(len(src), 60.0))
+
+@pytest.mark.parametrize('maxspeed, expected', [
+    ('80', 80),
+    ('30 mph', 30 * MPH_TO_KMH),
+    ('none', DEFAULT_SPEEDS_KMH['residential']),
+    ('0', DEFAULT_SPEEDS_KMH['residential']),
+    ('-20', DEFAULT_SPEEDS_KMH['residential']),
+    ('0 mph', DEFAULT_SPEEDS_KMH['residential']),
+    ('nan', DEFAULT_SPEEDS_KMH['residential']),
+    ('inf', DEFAULT_SPEEDS_KMH['residential']),
+])
+def test_speed_falls_back_to_road_default(maxspeed, expected):
+    assert _speed_kmh({'highway': 'residential', 'maxspeed': maxspeed}) == pytest.approx(expected)
+
+def test_zero_maxspeed_in_extract_gives_finite_times(tmp_path):
+    path = tmp_path / 'roads.osm'
+    path.write_text('''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lat="65.00" lon="25.0"/>
+  <node id="2" lat="65.01" lon="25.0"/>
+  <node id="3" lat="65.02" lon="25.0"/>
+  <way id="10">
+    <nd ref="1"/><nd ref="2"/><nd ref="3"/>
+    <tag k="highway" v="residential"/>
+    <tag k="maxspeed" v="0"/>
+    <tag k="oneway" v="yes"/>
+  </way>
+  <way id="11">
+    <nd ref="1"/><nd ref="3"/>
+    <tag k="highway" v="footway"/>
+  </way>
+</osm>
+''')
+
+    graph = load_osm_graph(str(path))
+
+    # 单行道只有两条边，人行道不参与
+    assert len(graph.sources) == 2
+    assert np.isfinite(graph.minutes).all()
+    np.testing.assert_allclose(graph.minutes, STEP_KM / DEFAULT_SPEEDS_KMH['residential'] * 60)
+
+def test_build_graph_groups_edges_by_destination(graph):
+    for node in range(len(LATS)):
+        incoming = graph.sources[graph.indptr[node]:graph.indptr[node + 1]]
+        assert sorted(incoming.tolist()) == [neighbour for neighbour in (node - 1, node + 1) if 0 <= neighbour < len(LATS)]
+    np.testing.assert_allclose(graph.lengths, STEP_KM)
+    np.testing.assert_allclose(graph.minutes, STEP_KM)
+
+def test_route_matrix_and_apply(graph):
+    stations = [('End', 65.04, 25.0), ('Far away', 60.0, 25.0), ('No location', None, None)]
+
+    grid, stations, minutes, lengths = build_route_matrix(graph, stations, cell_km=0.5, max_minutes=60)
+
+    assert [name for name, _, _ in stations] == ['End', 'Far away']
+    assert minutes.shape == lengths.shape == (grid.size, 2)
+    start = grid.cell(65.0, 25.0)
+    assert minutes[start, 0] == pytest.approx(4 * STEP_KM, rel=1e-5)
+    assert lengths[start, 0] == pytest.approx(4 * STEP_KM, rel=1e-5)
+    # 不在道路图范围内的加油站整列为 NaN
+    assert np.isnan(minutes[:, 1]).all()
+
+    table = RouteTable(grid, stations, minutes, lengths)
+    distances = np.array([99.0, 99.0])
+    times = np.array([99.0, 99.0])
+    applied = table.apply(65.0, 25.0, [65.04, 60.0], [25.0, 25.0], distances, times)
+
+    assert applied == 1
+    assert times.tolist() == [round(4 * STEP_KM, 2), 99.0]
+    assert distances.tolist() == [round(4 * STEP_KM, 2), 99.0]
+    # 用户不在网格内时不修改
+    assert table.apply(61.0, 25.0, [65.04], [25.0], distances[:1], times[:1]) == 0
+
+def test_route_matrix_respects_max_minutes(graph):
+    grid, _, minutes, _ = build_route_matrix(graph, [('End', 65.04, 25.0)], cell_km=0.5, max_minutes=3)
+
+    assert np.isnan(minutes[grid.cell(65.0, 25.0), 0])
+    assert minutes[grid.cell(65.03, 25.0), 0] == pytest.approx(STEP_KM, rel=1e-5)
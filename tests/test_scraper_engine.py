@@ -0,0 +1,58 @@
+import pytest
+
+from scraper import ScraperEngine, merge_city_results
+from standins import StandInHTTPServer
+
+@pytest.fixture
+def http_server():
+    server = StandInHTTPServer(latency=0.05)
+    yield server
+    server.close()
+
+def without_timestamps(prices):
+    return {
+        fuel_type: [(price['station'], price['price'], price['updated']) for price in price_list]
+        for fuel_type, price_list in prices.items()
+    }
+
+def test_per_host_limit_caps_concurrent_requests(http_server):
+    engine = ScraperEngine([f"city{i}" for i in range(8)], max_workers=8, per_host_limit=2,
+                           base_url=http_server.base_url)
+    results = engine.scrape()
+    engine.close()
+
+    assert all(result['error'] is None for result in results.values())
+    assert http_server.max_active == 2
+
+def test_unchanged_pages_are_revalidated_with_304(http_server):
+    engine = ScraperEngine(['oulu', 'kempele'], base_url=http_server.base_url)
+    first = engine.scrape()
+    second = engine.scrape()
+    engine.close()
+
+    assert not any(result['not_modified'] for result in first.values())
+    assert all(result['not_modified'] for result in second.values())
+    assert http_server.not_modified == 2
+    # 304 时沿用上次解析的价格，只刷新时间戳
+    for city in ('oulu', 'kempele'):
+        assert without_timestamps(second[city]['prices']) == without_timestamps(first[city]['prices'])
+        assert second[city]['prices']['95 E10'][0]['timestamp'] >= first[city]['prices']['95 E10'][0]['timestamp']
+
+def test_results_are_merged_with_city(http_server):
+    engine = ScraperEngine(['oulu', 'kempele'], base_url=http_server.base_url)
+    merged = merge_city_results(engine.scrape())
+    engine.close()
+
+    cities = {price['city'] for price_list in merged.values() for price in price_list}
+    assert cities == {'oulu', 'kempele'}
+    assert len(merged['Diesel']) == 80
+
+def test_layout_change_is_reported_per_city(http_server):
+    # 表格数量不对的页面：该城市标记为结构变化，其他城市正常
+    http_server.pages['kempele'] = b"<html><body><table class='table'><tr><th>#</th></tr></table></body></html>"
+    engine = ScraperEngine(['oulu', 'kempele'], base_url=http_server.base_url)
+    results = engine.scrape()
+    engine.close()
+
+    assert results['kempele']['layout_changed'] and results['kempele']['prices'] is None
+    assert not results['oulu']['layout_changed'] and results['oulu']['error'] is None
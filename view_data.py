@@ -1,20 +1,31 @@
-import sqlite3
-import json
+import argparse
+import logging
+import sys
+from database import Database
+from exporter import EXPORT_TABLES, FORMATS, iter_table_chunks, stream_export, stream_ndjson
 
-conn = sqlite3.connect('./data/database.sqlite')
-cursor = conn.cursor()
+# 流式导出数据库内容，内存占用与表大小无关
+parser = argparse.ArgumentParser(description="Export database tables")
+parser.add_argument('--database', default='./data/database.sqlite')
+parser.add_argument('--table', choices=sorted(EXPORT_TABLES), help="Table to export (default: all tables as NDJSON)")
+parser.add_argument('--format', default='ndjson', choices=sorted(FORMATS))
+parser.add_argument('--fuel-type')
+parser.add_argument('--since', help="ISO timestamp, inclusive")
+parser.add_argument('--until', help="ISO timestamp, exclusive")
+args = parser.parse_args()
 
-cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-tables = cursor.fetchall()
+logging.getLogger().setLevel(logging.WARNING)
+db = Database(args.database)
 
-data = {}
-for table in tables:
-    table_name = table[0]
-    cursor.execute(f"SELECT * FROM {table_name}")
-    columns = [description[0] for description in cursor.description]
-    rows = cursor.fetchall()
-    data[table_name] = [dict(zip(columns, row)) for row in rows]
+if args.table:
+    _, _, body = stream_export(db, args.table, args.format, args.fuel_type, args.since, args.until)
+    output = sys.stdout.buffer
+    for chunk in body:
+        output.write(chunk.encode() if isinstance(chunk, str) else chunk)
+else:
+    for table in EXPORT_TABLES:
+        columns, chunks = iter_table_chunks(db, table)
+        for chunk in stream_ndjson(['table'] + columns, ([(table,) + tuple(row) for row in rows] for rows in chunks)):
+            sys.stdout.write(chunk)
 
-conn.close()
-
-print(json.dumps(data, indent=2))
\ No newline at end of file
+db.close()